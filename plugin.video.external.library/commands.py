@@ -12,6 +12,7 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=import-outside-toplevel
 import logging
 import sys
 
@@ -19,22 +20,99 @@ import xbmc
 import xbmcgui
 
 from libs.exception_logger import catch_exception
-from libs.json_rpc_api import update_playcount
-from libs.kodi_service import GettextEmulator, initialize_logging
+from libs.kodi_service import ADDON_NAME, ADDON_PROFILE_DIR, GettextEmulator, initialize_logging
+from libs.library_cache import LIBRARY_CACHE
+
+# Modules that are needed only by some commands are imported by those commands
 
 initialize_logging()
 logger = logging.getLogger(__name__)
 _ = GettextEmulator.gettext
 
 
+def _parse_optional_int(value):
+    return int(value) if value else None
+
+
+def fill_details(content_type, tvshowid, season):
+    from libs.content_type_handlers import CONTENT_TYPE_HANDLERS
+    content_type_handler_class = CONTENT_TYPE_HANDLERS[content_type]
+    content_type_handler = content_type_handler_class(_parse_optional_int(tvshowid),
+                                                      _parse_optional_int(season))
+    content_type_handler.fill_details()
+    logger.debug('Full details for %s have been cached.', content_type)
+
+
+def show_info(item_id_param, item_id):
+    from libs.json_rpc_api import get_details_batch
+    from libs.media_info_service import set_info, set_art
+    media_info = get_details_batch(item_id_param, [item_id])[0]
+    list_item = xbmcgui.ListItem(media_info.get('title') or media_info.get('label', ''))
+    if art := media_info.get('art'):
+        set_art(list_item, art)
+    set_info(list_item.getVideoInfoTag(), media_info, item_id_param[:-2])
+    xbmcgui.Dialog().info(list_item)
+
+
+def set_playcount(item_id_param, item_id, playcount):
+    from libs.delta_sync import reconcile_watched_state
+    from libs.json_rpc_api import update_playcount
+    details = {'playcount': playcount, 'resume': {'position': 0.0, 'total': 0.0}}
+    # Show the new watched status from the patched cache without waiting for the remote Kodi
+    is_patched = LIBRARY_CACHE.patch_item(item_id_param, item_id, details)
+    if is_patched:
+        xbmc.executebuiltin('Container.Refresh')
+    try:
+        update_playcount(item_id_param, item_id, playcount)
+    except Exception:
+        # Revert the patched values if the remote Kodi has not accepted them for any reason
+        LIBRARY_CACHE.invalidate_watched_state(item_id_param, item_id)
+        raise
+    if reconcile_watched_state([(item_id_param, item_id)]) or not is_patched:
+        xbmc.executebuiltin('Container.Refresh')
+
+
+def show_stats():
+    from libs.instrumentation import format_summary, read_records, summarize_records
+    summary = summarize_records(read_records(ADDON_PROFILE_DIR))
+    if not summary:
+        xbmcgui.Dialog().notification(ADDON_NAME, _('No performance statistics collected.'))
+        return
+    xbmcgui.Dialog().textviewer(_('Performance statistics'), format_summary(summary),
+                                usemono=True)
+
+
+def profile_next(invocations=None):
+    from libs.profiler import PROFILES_DIR, request_profiling
+    if invocations is None:
+        invocations = xbmcgui.Dialog().numeric(0, _('Number of invocations to profile'), '5')
+        if not invocations:
+            return
+    request_profiling(int(invocations))
+    xbmcgui.Dialog().notification(
+        ADDON_NAME,
+        _('Profiles of the next {invocations} invocations will be saved to {profiles_dir}').format(
+            invocations=invocations, profiles_dir=PROFILES_DIR))
+
+
 def main():
     logger.debug('Executing command: %s', str(sys.argv))
     if len(sys.argv) == 1:
         xbmcgui.Dialog().ok(_('Kodi External Video Library Client'),
                             _(r'Please run this addon from \"Video addons\" section.'))
     elif sys.argv[1] == 'update_playcount':
-        update_playcount(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
-        xbmc.executebuiltin('Container.Refresh')
+        set_playcount(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    elif sys.argv[1] == 'clear_cache':
+        LIBRARY_CACHE.invalidate()
+        xbmcgui.Dialog().notification(ADDON_NAME, _('Local cache cleared.'))
+    elif sys.argv[1] == 'fill_details':
+        fill_details(sys.argv[2], sys.argv[3], sys.argv[4])
+    elif sys.argv[1] == 'show_info':
+        show_info(sys.argv[2], int(sys.argv[3]))
+    elif sys.argv[1] == 'show_stats':
+        show_stats()
+    elif sys.argv[1] == 'profile_next':
+        profile_next(sys.argv[2] if len(sys.argv) > 2 else None)
 
 
 if __name__ == '__main__':
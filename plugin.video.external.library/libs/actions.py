@@ -12,29 +12,25 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=import-outside-toplevel
 
 import logging
 import sys
+from typing import Dict, List
 from urllib.parse import parse_qsl
 
 import xbmcplugin
-from xbmcgui import Dialog, ListItem, NOTIFICATION_ERROR
-
-from libs.content_type_handlers import (
-    MoviesHandler,
-    RecentMoviesHandler,
-    TvShowsHandler,
-    SeasonsHandler,
-    EpisodesHandler,
-    RecentEpisodesHandler,
-    MusicVideosHandler,
-    RecentMusicVideosHandler,
-)
+from xbmcgui import Dialog, ListItem, NOTIFICATION_ERROR, NOTIFICATION_WARNING
+
 from libs.exceptions import NoDataError, RemoteKodiError
-from libs.json_rpc_api import VideoLibraryScan
-from libs.kodi_service import ADDON, ADDON_ID, ADDON_NAME, GettextEmulator, get_plugin_url
-from libs.media_info_service import set_info, set_art
-from libs.mem_storage import MemStorage
+from libs.instrumentation import (count, discard_record, finish_record, measure,
+                                  measure_iterable, start_record)
+from libs.kodi_service import (ADDON_ID, ADDON_NAME, ADDON_PROFILE_DIR, ADDON_SETTINGS,
+                               GettextEmulator, get_plugin_url)
+from libs.playback_map import PlaybackMap
+
+# Content type handlers, JSON-RPC API and HTTP modules are imported by actions
+# that use them, so the root menu is shown without importing networking code.
 
 logger = logging.getLogger(__name__)
 _ = GettextEmulator.gettext
@@ -43,57 +39,69 @@ HANDLE = int(sys.argv[1])
 
 DIALOG = Dialog()
 
-MEM_STORAGE = MemStorage()
-
-CONTENT_TYPE_HANDLERS = {
-    'movies': MoviesHandler,
-    'recent_movies': RecentMoviesHandler,
-    'tvshows': TvShowsHandler,
-    'seasons': SeasonsHandler,
-    'episodes': EpisodesHandler,
-    'recent_episodes': RecentEpisodesHandler,
-    'music_videos': MusicVideosHandler,
-    'recent_music_videos': RecentMusicVideosHandler,
-}
+PLAYBACK_MAP = PlaybackMap()
+
+ROOT_SECTIONS = [
+    # (the setting to show a section, content type, section title, section icon)
+    ('show_movies', 'movies', 'Movies', 'DefaultMovies.png'),
+    ('show_recent_movies', 'recent_movies', 'Recently added movies',
+     'DefaultRecentlyAddedMovies.png'),
+    ('show_tvshows', 'tvshows', 'TV Shows', 'DefaultTVShows.png'),
+    ('show_recent_episodes', 'recent_episodes', 'Recently added episodes',
+     'DefaultRecentlyAddedEpisodes.png'),
+    ('show_music_videos', 'music_videos', 'Music videos', 'DefaultMusicVideos.png'),
+    ('show_recent_music_videos', 'recent_music_videos', 'Recently added music videos',
+     'DefaultRecentlyAddedMusicVideos.png'),
+]
+
+
+def get_item_counts(content_types: List[str]) -> Dict[str, int]:
+    """
+    Get the number of items for content types in one JSON-RPC batch request
+
+    :param content_types: the list of content types
+    :return: content type to the number of items mapping. Content types
+        for which the number of items cannot be retrieved are omitted.
+    """
+    from libs.content_type_handlers import CONTENT_TYPE_HANDLERS
+    from libs.json_rpc_api import JsonRpcBatch, MediaItemsCounter
+
+    batch = JsonRpcBatch()
+    indexes = {}
+    for content_type in content_types:
+        api_class = CONTENT_TYPE_HANDLERS[content_type].api_class
+        indexes[content_type] = batch.add(MediaItemsCounter(api_class))
+    try:
+        batch.send()
+    except (NoDataError, RemoteKodiError):
+        logger.exception('Unable to retrieve the numbers of items from the remote Kodi library')
+        return {}
+    item_counts = {}
+    for content_type, index in indexes.items():
+        try:
+            item_counts[content_type] = MediaItemsCounter.parse_count(batch.get_reply(index))
+        except NoDataError as exc:
+            logger.error('Unable to retrieve the number of %s: %s', content_type, exc)
+    return item_counts
 
 
 def root():
     """Root action"""
+    settings = ADDON_SETTINGS.get()
     xbmcplugin.setPluginCategory(HANDLE,
                                  _('Kodi Medialibrary on {kodi_host}').format(
-                                     kodi_host=ADDON.getSettingString('kodi_host')))
-    if ADDON.getSettingBool('show_movies'):
-        list_item = ListItem(f'[{_("Movies")}]')
-        list_item.setArt({'icon': 'DefaultMovies.png', 'thumb': 'DefaultMovies.png'})
-        url = get_plugin_url(content_type='movies')
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
-    if ADDON.getSettingBool('show_recent_movies'):
-        list_item = ListItem(f'[{_("Recently added movies")}]')
-        list_item.setArt({'icon': 'DefaultRecentlyAddedMovies.png',
-                          'thumb': 'DefaultRecentlyAddedMovies.png'})
-        url = get_plugin_url(content_type='recent_movies')
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
-    if ADDON.getSettingBool('show_tvshows'):
-        list_item = ListItem(f'[{_("TV Shows")}]')
-        list_item.setArt({'icon': 'DefaultTVShows.png', 'thumb': 'DefaultTVShows.png'})
-        url = get_plugin_url(content_type='tvshows')
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
-    if ADDON.getSettingBool('show_recent_episodes'):
-        list_item = ListItem(f'[{_("Recently added episodes")}]')
-        list_item.setArt({'icon': 'DefaultRecentlyAddedEpisodes.png',
-                          'thumb': 'DefaultRecentlyAddedEpisodes.png'})
-        url = get_plugin_url(content_type='recent_episodes')
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
-    if ADDON.getSettingBool('show_music_videos'):
-        list_item = ListItem(f'[{_("Music videos")}]')
-        list_item.setArt({'icon': 'DefaultMusicVideos.png', 'thumb': 'DefaultMusicVideos.png'})
-        url = get_plugin_url(content_type='music_videos')
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
-    if ADDON.getSettingBool('show_recent_music_videos'):
-        list_item = ListItem(f'[{_("Recently added music videos")}]')
-        list_item.setArt({'icon': 'DefaultRecentlyAddedMusicVideos.png',
-                          'thumb': 'DefaultRecentlyAddedMusicVideos.png'})
-        url = get_plugin_url(content_type='recent_music_videos')
+                                     kodi_host=settings.kodi_host))
+    sections = [section for section in ROOT_SECTIONS if getattr(settings, section[0])]
+    item_counts = {}
+    if sections and settings.show_item_counts:
+        item_counts = get_item_counts([section[1] for section in sections])
+    for _setting_id, content_type, title, icon in sections:
+        label = f'[{_(title)}]'
+        if (item_count := item_counts.get(content_type)) is not None:
+            label += f' ({item_count})'
+        list_item = ListItem(label)
+        list_item.setArt({'icon': icon, 'thumb': icon})
+        url = get_plugin_url(content_type=content_type)
         xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
     list_item = ListItem(_('Update remote videolibrary'))
     list_item.setArt({'icon': 'DefaultAddonsUpdates.png', 'thumb': 'DefaultAddonsUpdates.png'})
@@ -101,15 +109,54 @@ def root():
     xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=False)
 
 
+def _create_directory_item(content_type_handler, media_info):
+    from libs.media_info_service import set_art
+    list_item = ListItem(media_info.get('title') or media_info.get('label', ''))
+    if art := media_info.get('art'):
+        with measure('set_art'):
+            set_art(list_item, art)
+    with measure('set_info'):
+        content_type_handler.get_info_tag_filler().fill(list_item.getVideoInfoTag(), media_info)
+    list_item.addContextMenuItems(content_type_handler.get_item_context_menu(media_info))
+    return (
+        content_type_handler.get_item_url(media_info),
+        list_item,
+        content_type_handler.item_is_folder,
+    )
+
+
 def show_media_items(content_type, tvshowid=None, season=None, parent_category=None):
+    from libs.content_type_handlers import CONTENT_TYPE_HANDLERS
     content_type_handler_class = CONTENT_TYPE_HANDLERS.get(content_type)
     if content_type_handler_class is None:
         raise RuntimeError(f'Unknown content type: {content_type}')
     content_type_handler = content_type_handler_class(tvshowid, season, parent_category)
-    xbmcplugin.setPluginCategory(HANDLE, content_type_handler.get_plugin_category())
+    plugin_category = content_type_handler.get_plugin_category()
+    xbmcplugin.setPluginCategory(HANDLE, plugin_category)
     xbmcplugin.setContent(HANDLE, content_type_handler.content)
+    # If paging is enabled, directory items are added in chunks as pages arrive
+    chunk_size = content_type_handler.page_size
+    logger.debug('Creating a list of %s items...', content_type)
+    directory_items = []
+    # Only the fields stored in the playback map are kept, not whole media items
+    playable_items = []
+    item_id_param = f'{content_type_handler.mediatype}id'
+    item_count = 0
     try:
-        media_items = content_type_handler.get_media_items()
+        for media_info in measure_iterable('get_media_items',
+                                           content_type_handler.get_media_items()):
+            directory_items.append(_create_directory_item(content_type_handler, media_info))
+            item_count += 1
+            if content_type_handler.should_save_to_mem_storage:
+                playable_items.append({
+                    item_id_param: media_info[item_id_param],
+                    'file': media_info['file'],
+                    'playcount': media_info.get('playcount', 0),
+                })
+            if chunk_size and len(directory_items) >= chunk_size:
+                with measure('add_directory_items'):
+                    xbmcplugin.addDirectoryItems(HANDLE, directory_items, len(directory_items))
+                directory_items = []
     except NoDataError:
         logger.exception('Unable to retrieve %s from the remote Kodi library',
                          content_type)
@@ -121,44 +168,49 @@ def show_media_items(content_type, tvshowid=None, season=None, parent_category=N
         DIALOG.notification(ADDON_ID, _('Unable to connect to the remote Kodi host!'),
                             icon=NOTIFICATION_ERROR)
         return
-    logger.debug('Creating a list of %s items...', content_type)
-    directory_items = []
-    mem_storage_items = []
-    for media_info in media_items:
-        list_item = ListItem(media_info.get('title') or media_info.get('label', ''))
-        if art := media_info.get('art'):
-            set_art(list_item, art)
-        info_tag = list_item.getVideoInfoTag()
-        set_info(info_tag, media_info, content_type_handler.mediatype)
-        list_item.addContextMenuItems(content_type_handler.get_item_context_menu(media_info))
-        directory_items.append((
-            content_type_handler.get_item_url(media_info),
-            list_item,
-            content_type_handler.item_is_folder,
-        ))
-        if content_type_handler.should_save_to_mem_storage:
-            item_id_param = f'{content_type_handler.mediatype}id'
-            mem_storage_items.append({
-                'item_id_param': item_id_param,
-                item_id_param: media_info[item_id_param],
-                'file': media_info['file'],
-                'playcount': media_info.get('playcount', 0),
-            })
-    xbmcplugin.addDirectoryItems(HANDLE, directory_items, len(directory_items))
-    MEM_STORAGE[f'__{ADDON_ID}_media_list__'] = mem_storage_items
+    count('items', item_count)
+    if content_type_handler.is_stale:
+        xbmcplugin.setPluginCategory(HANDLE, f'{plugin_category} [{_("Offline")}]')
+        DIALOG.notification(ADDON_ID, _('Remote Kodi host is unavailable. Showing cached items.'),
+                            icon=NOTIFICATION_WARNING)
+    if directory_items:
+        with measure('add_directory_items'):
+            xbmcplugin.addDirectoryItems(HANDLE, directory_items, len(directory_items))
+    if playable_items:
+        with measure('playback_map_update'):
+            PLAYBACK_MAP.update(playable_items, item_id_param)
     for sort_method in content_type_handler.get_sort_methods():
         xbmcplugin.addSortMethod(HANDLE, sort_method)
     logger.debug('Finished creating a list of %s items.', content_type)
 
 
 def update_remote_library():
+    from libs.json_rpc_api import VideoLibraryScan
     VideoLibraryScan().send_json_rpc()
     DIALOG.ok(ADDON_NAME, _('Updating the remote videolibrary started.'))
 
 
+def log_session_stats():
+    # The HTTP session module is not imported if the remote Kodi has not been called
+    if (http_session := sys.modules.get('libs.http_session')) is not None:
+        http_session.log_session_stats()
+
+
 def router(paramstring):
     params = dict(parse_qsl(paramstring))
     logger.debug('Called addon with params: %s', str(sys.argv))
+    # The record is started before settings are read to include the settings load
+    start_record('plugin', content_type=params.get('content_type',
+                                                    params.get('action', 'root')))
+    if not ADDON_SETTINGS.get().collect_stats:
+        discard_record()
+    try:
+        _route(params)
+    finally:
+        finish_record(ADDON_PROFILE_DIR)
+
+
+def _route(params):
     if 'content_type' in params:
         if (tvshowid := params.get('tvshowid')) is not None:
             tvshowid = int(tvshowid)
@@ -168,7 +220,10 @@ def router(paramstring):
         show_media_items(params['content_type'], tvshowid, season, parent_category)
     elif params.get('action') == 'update_library':
         update_remote_library()
+        log_session_stats()
         return
     else:
         root()
-    xbmcplugin.endOfDirectory(HANDLE)
+    with measure('end_of_directory'):
+        xbmcplugin.endOfDirectory(HANDLE)
+    log_session_stats()
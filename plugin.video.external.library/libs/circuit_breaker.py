@@ -0,0 +1,130 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Circuit breaker for requests to the remote Kodi
+
+When the remote host is unreachable, each request waits for a connection
+timeout. After several consecutive connection failures the circuit is opened,
+and requests fail immediately with :class:`CircuitOpenError`, so listings can be
+served from the local cache without waiting. The circuit state is stored
+in MemStorage, so it is shared by plugin invocations and the service.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from libs.exceptions import CircuitOpenError
+from libs.kodi_service import ADDON_ID
+from libs.mem_storage import MemStorage
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_STATE_KEY = f'__{ADDON_ID}_circuit_breaker__'
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive connection failures to the remote Kodi host
+
+    An open circuit lets one request through every :attr:`retry_timeout` seconds
+    to check if the host is back, so the circuit is closed even if the service
+    is not running. The state is bound to the host URL, so changing the host
+    in settings closes the circuit.
+    """
+    failure_threshold = 2
+    retry_timeout = 30.0
+
+    def __init__(self):
+        self._mem_storage = MemStorage()
+
+    def _get_state(self, kodi_url: str) -> Optional[Dict[str, Any]]:
+        state = self._mem_storage.get(CIRCUIT_STATE_KEY)
+        if state is None or state['url'] != kodi_url:
+            return None
+        return state
+
+    def is_open(self, kodi_url: str) -> bool:
+        state = self._get_state(kodi_url)
+        return state is not None and state['opened_at'] is not None
+
+    def before_request(self, kodi_url: str) -> None:
+        """
+        Check if a request can be sent
+
+        :raises CircuitOpenError: if the circuit is open
+        """
+        state = self._get_state(kodi_url)
+        if state is None or state['opened_at'] is None:
+            return
+        if time.time() - state['opened_at'] < self.retry_timeout:
+            raise CircuitOpenError(kodi_url)
+        # Let this request through, other requests fail fast until it completes
+        state['opened_at'] = time.time()
+        self._mem_storage[CIRCUIT_STATE_KEY] = state
+        logger.debug('Circuit breaker: checking if %s is available', kodi_url)
+
+    def record_success(self, kodi_url: str) -> None:
+        """Close the circuit after a successful request"""
+        if self._mem_storage.get(CIRCUIT_STATE_KEY) is None:
+            return
+        if self.is_open(kodi_url):
+            logger.info('Circuit breaker: %s is available again', kodi_url)
+        del self._mem_storage[CIRCUIT_STATE_KEY]
+
+    def record_failure(self, kodi_url: str) -> None:
+        """Count a connection failure and open the circuit if the threshold is reached"""
+        state = self._get_state(kodi_url) or {'url': kodi_url, 'failures': 0, 'opened_at': None}
+        state['failures'] += 1
+        if state['failures'] >= self.failure_threshold:
+            if state['opened_at'] is None:
+                logger.warning('Circuit breaker: %s is unavailable, requests are suspended',
+                               kodi_url)
+            state['opened_at'] = time.time()
+        self._mem_storage[CIRCUIT_STATE_KEY] = state
+
+
+CIRCUIT_BREAKER = CircuitBreaker()
+
+
+class RecoveryProbe(threading.Thread):
+    """
+    Checks in background if the remote Kodi is available while the circuit is open
+
+    :param get_kodi_url: a callable that returns the current remote Kodi URL
+    :param probe: a callable that sends a lightweight request bypassing the circuit
+        breaker and records its result. It returns ``True`` if the host is available.
+    :param on_recovered: a callable that is called when the host is available again
+    """
+    check_interval = 5.0
+
+    def __init__(self, get_kodi_url: Callable[[], str], probe: Callable[[], bool],
+                 on_recovered: Optional[Callable[[], None]] = None):
+        super().__init__(name='RecoveryProbe', daemon=True)
+        self._get_kodi_url = get_kodi_url
+        self._probe = probe
+        self._on_recovered = on_recovered
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.check_interval):
+            if not CIRCUIT_BREAKER.is_open(self._get_kodi_url()):
+                continue
+            if self._probe() and self._on_recovered is not None:
+                self._on_recovered()
@@ -15,15 +15,26 @@
 """Classes that are responsible for processing supported content types: Movies, TV Shows etc."""
 
 import enum
-from typing import Type, List, Dict, Any, Optional, Tuple, Iterable
+import functools
+import logging
+import math
+from typing import Type, List, Dict, Any, NamedTuple, Optional, Tuple, Iterable
 from urllib.parse import urljoin, quote
 
+import xbmc
 import xbmcplugin
 
-from libs import json_rpc_api
-from libs.kodi_service import GettextEmulator, get_remote_kodi_url, ADDON_ID, ADDON, get_plugin_url
+from libs import fetch_daemon, json_rpc_api
+from libs.delta_sync import sync_listing
+from libs.exceptions import RemoteKodiError
+from libs.kodi_service import (GettextEmulator, get_remote_kodi_url, ADDON_ID, ADDON_SETTINGS,
+                               get_plugin_url)
+from libs.library_cache import LIBRARY_CACHE, ListingKey
+from libs.media_info_service import InfoTagFiller, get_info_tag_filler
+from libs.single_flight import SingleFlight
 
 __all__ = [
+    'CONTENT_TYPE_HANDLERS',
     'MoviesHandler',
     'RecentMoviesHandler',
     'TvShowsHandler',
@@ -34,10 +45,34 @@ __all__ = [
     'RecentMusicVideosHandler',
 ]
 
+logger = logging.getLogger(__name__)
 _ = GettextEmulator.gettext
 
-REMOTE_KODI_URL = get_remote_kodi_url(with_credentials=True)
-VIDEO_URL = urljoin(REMOTE_KODI_URL, 'vfs')
+# Concurrent requests for the same listing, e.g. from several skin widgets
+LISTING_FLIGHTS = SingleFlight('Listings')
+
+
+@functools.lru_cache(maxsize=None)
+def get_video_url() -> str:
+    """Get the base URL of video files on the remote Kodi. Settings are read on first use."""
+    return urljoin(get_remote_kodi_url(with_credentials=True), 'vfs')
+
+
+ADDON_SETTINGS.add_listener(get_video_url.cache_clear)
+
+
+class ListingProfile(enum.IntEnum):
+    """Which media properties are retrieved for a listing"""
+    FULL = 0
+    LEAN = 1
+    AUTO = 2
+
+
+class ListingState(NamedTuple):
+    """How a listing is retrieved"""
+    is_lean_listing: bool = False
+    # The listing is served from the local cache because the remote Kodi is unavailable
+    is_stale: bool = False
 
 
 # pylint: disable=unused-argument
@@ -46,6 +81,8 @@ class BaseContentTypeHandler:
     item_is_folder: bool
     should_save_to_mem_storage: bool = False
     api_class: Type[json_rpc_api.BaseMediaItemsRetriever]
+    cache_ttl_setting: str = 'cache_ttl'
+    listing_profile_setting: Optional[str] = None
 
     def __init__(self, tvshowid: Optional[int] = None,
                  season: Optional[int] = None,
@@ -53,14 +90,192 @@ class BaseContentTypeHandler:
         self._tvshowid = tvshowid
         self._season = season
         self._parent_category = parent_category
-        self._api = self.api_class(self.content, self._tvshowid, self._season)
+        self._settings = ADDON_SETTINGS.get()
+        self._listing_state = ListingState()
+        self._api = self._create_api(self.api_class.properties)
+        self._info_tag_filler = None
 
     @property
     def content(self) -> str:
         return f'{self.mediatype}s'
 
+    @property
+    def page_size(self) -> int:
+        return self._settings.page_size
+
+    @property
+    def is_lean_listing(self) -> bool:
+        return self._listing_state.is_lean_listing
+
+    @property
+    def is_stale(self) -> bool:
+        return self._listing_state.is_stale
+
+    def _update_listing_state(self, **changes: bool) -> None:
+        self._listing_state = self._listing_state._replace(**changes)
+
+    @classmethod
+    def get_content_type(cls) -> str:
+        for content_type, handler_class in CONTENT_TYPE_HANDLERS.items():
+            if handler_class is cls:
+                return content_type
+        raise RuntimeError(f'{cls.__name__} is not registered in CONTENT_TYPE_HANDLERS')
+
+    def _create_api(self, properties: List[str]) -> json_rpc_api.BaseMediaItemsRetriever:
+        return self.api_class(self.content, self._tvshowid, self._season,
+                              page_size=self.page_size, properties=properties)
+
+    def _get_server(self) -> str:
+        # Listings of different remote Kodi hosts are cached separately
+        return f'{self._settings.kodi_host}:{self._settings.kodi_port}'
+
+    def get_listing_key(self) -> ListingKey:
+        return ListingKey(self._get_server(), type(self).__name__, self.mediatype,
+                          self._tvshowid, self._season, tuple(self._api.properties))
+
+    def _should_use_lean_listing(self) -> bool:
+        if self.listing_profile_setting is None or self.api_class.lean_properties is None:
+            return False
+        listing_profile = getattr(self._settings, self.listing_profile_setting)
+        if listing_profile == ListingProfile.FULL:
+            return False
+        if listing_profile == ListingProfile.LEAN:
+            return True
+        threshold = self._settings.lean_listing_threshold
+        listing_size = LIBRARY_CACHE.get_listing_size(self._get_server(), type(self).__name__,
+                                                      self._tvshowid, self._season)
+        if listing_size is None:
+            counter = json_rpc_api.MediaItemsCounter(self.api_class, self._tvshowid, self._season)
+            listing_size = counter.parse_count(counter.send_json_rpc())
+        return listing_size > threshold
+
+    def _switch_to_lean_listing(self) -> None:
+        self._update_listing_state(is_lean_listing=True)
+        self._api = self._create_api(self.api_class.lean_properties)
+        self._info_tag_filler = None
+
+    def _switch_to_full_listing(self) -> None:
+        self._update_listing_state(is_lean_listing=False)
+        self._api = self._create_api(self.api_class.properties)
+        self._info_tag_filler = None
+
+    def get_info_tag_filler(self) -> InfoTagFiller:
+        """Get an info tag filler for the media properties of the current listing"""
+        if self._info_tag_filler is None:
+            self._info_tag_filler = get_info_tag_filler(self.mediatype,
+                                                        tuple(self._api.properties),
+                                                        self._settings.max_cast_members)
+        return self._info_tag_filler
+
     def get_media_items(self) -> Iterable[Dict[str, Any]]:
-        yield from self._api.get_media_items()
+        """
+        Get media items from the fetch daemon in the service or retrieve them directly
+        """
+        daemon_listing = fetch_daemon.get_media_items(self.get_content_type(),
+                                                      self._tvshowid, self._season)
+        if daemon_listing is not None:
+            is_lean_listing, is_stale, media_items = daemon_listing
+            if is_lean_listing:
+                self._switch_to_lean_listing()
+            self._update_listing_state(is_stale=is_stale)
+            yield from media_items
+            return
+        yield from self.fetch_media_items()
+
+    def fetch_media_items(self) -> Iterable[Dict[str, Any]]:
+        """
+        Get media items from the local cache or the remote Kodi
+
+        If the same listing is already being retrieved in this process,
+        media items of the in-flight request are shared.
+        """
+        # The listing key includes the remote Kodi host, so a request to a previous host
+        # that is still in flight after changing settings is not joined
+        media_items, leader = LISTING_FLIGHTS.join(self.get_listing_key(),
+                                                   self._fetch_media_items, self)
+        try:
+            for media_info in media_items:
+                # The leader selects a lean listing before retrieving the first item
+                if leader.is_lean_listing and not self.is_lean_listing:
+                    self._switch_to_lean_listing()
+                self._update_listing_state(is_stale=leader.is_stale)
+                yield media_info
+        finally:
+            # Leave the in-flight request if this generator is closed early
+            media_items.close()
+
+    def _fetch_media_items(self) -> Iterable[Dict[str, Any]]:
+        is_started = False
+        try:
+            for media_info in self._fetch_fresh_media_items():
+                is_started = True
+                yield media_info
+        except RemoteKodiError:
+            # A listing that is partially shown cannot be replaced with a cached one
+            if is_started or (stale_items := self._get_stale_media_items()) is None:
+                raise
+            logger.warning('Remote Kodi is unavailable. Showing cached %s.', self.content)
+            self._update_listing_state(is_stale=True)
+            yield from stale_items
+
+    def _get_stale_media_items(self) -> Optional[Iterable[Dict[str, Any]]]:
+        """Get the last cached listing regardless of its age or ``None``"""
+        self._switch_to_full_listing()
+        if (cached_items := LIBRARY_CACHE.get_listing(self.get_listing_key(),
+                                                      math.inf)) is not None:
+            return cached_items
+        if self.api_class.lean_properties is None:
+            return None
+        self._switch_to_lean_listing()
+        return LIBRARY_CACHE.get_listing(self.get_listing_key(), math.inf)
+
+    def _fetch_fresh_media_items(self) -> Iterable[Dict[str, Any]]:
+        cache_ttl = getattr(self._settings, self.cache_ttl_setting) * 60
+        if not cache_ttl:
+            if self._should_use_lean_listing():
+                self._switch_to_lean_listing()
+            yield from self._api.get_media_items()
+            return
+        listing_key = self.get_listing_key()
+        # A listing with full details is used if it is cached, regardless of the profile
+        if (cached_items := LIBRARY_CACHE.get_listing(listing_key, cache_ttl)) is not None:
+            yield from cached_items
+            return
+        if self._should_use_lean_listing():
+            self._switch_to_lean_listing()
+            listing_key = self.get_listing_key()
+            if (cached_items := LIBRARY_CACHE.get_listing(listing_key, cache_ttl)) is not None:
+                yield from cached_items
+                return
+        if (self._settings.delta_sync and sync_listing(listing_key, self._api)
+                # The listing might have been invalidated right after the sync
+                and (cached_items := LIBRARY_CACHE.get_listing(listing_key,
+                                                               cache_ttl)) is not None):
+            yield from cached_items
+        else:
+            yield from LIBRARY_CACHE.store_listing(listing_key, self._api.get_media_items(),
+                                                   self.api_class.delta_sync_fields)
+        if self.is_lean_listing and self._settings.background_details_fill:
+            self.start_details_fill()
+
+    def start_details_fill(self) -> None:
+        """
+        Start retrieving the listing with full details in a separate script
+
+        The next time the listing is requested, full details are served from the cache.
+        """
+        tvshowid = '' if self._tvshowid is None else self._tvshowid
+        season = '' if self._season is None else self._season
+        xbmc.executebuiltin(f'RunScript({ADDON_ID},fill_details,'
+                            f'{self.get_content_type()},{tvshowid},{season})')
+
+    def fill_details(self) -> None:
+        """Retrieve the listing with full details and store it in the cache"""
+        self._switch_to_full_listing()
+        listing_key = self.get_listing_key()
+        for _ in LIBRARY_CACHE.store_listing(listing_key, self._api.get_media_items(),
+                                             self.api_class.delta_sync_fields):
+            pass
 
     def get_plugin_category(self) -> str:
         raise NotImplementedError
@@ -101,17 +316,22 @@ class PlayableContentMixin:
         item_id = media_info[item_id_param]
         command = f'RunScript({ADDON_ID},' \
                   f'update_playcount,{item_id_param},{item_id},{playcount_to_set})'
-        return [(caption, command)]
+        context_menu = [(caption, command)]
+        if self.is_lean_listing:
+            context_menu.append((_('Full information'),
+                                 f'RunScript({ADDON_ID},show_info,{item_id_param},{item_id})'))
+        return context_menu
 
     def get_item_url(self, media_info: Dict[str, Any]) -> str:
-        if ADDON.getSettingBool('files_on_shares'):
+        if self._settings.files_on_shares:
             return media_info['file']
-        return f'{VIDEO_URL}/{quote(media_info["file"])}'
+        return f'{get_video_url()}/{quote(media_info["file"])}'
 
 
 class MoviesHandler(PlayableContentMixin, BaseContentTypeHandler):
     mediatype = 'movie'
     api_class = json_rpc_api.GetMovies
+    listing_profile_setting = 'movies_listing_profile'
 
     def get_plugin_category(self) -> str:
         return _('Movies')
@@ -119,6 +339,7 @@ class MoviesHandler(PlayableContentMixin, BaseContentTypeHandler):
 
 class RecentMoviesHandler(MoviesHandler):
     api_class = json_rpc_api.GetRecentlyAddedMovies
+    cache_ttl_setting = 'recent_cache_ttl'
 
     def get_plugin_category(self) -> str:
         return _('Recently added movies')
@@ -148,10 +369,11 @@ class TvShowsHandler(BaseContentTypeHandler):
     def get_item_url(self, media_info: Dict[str, Any]) -> str:
         parent_category = media_info.get('title') or media_info['label']
         tvshowid = media_info['tvshowid']
-        if ADDON.getSettingInt('flatten_seasons') == self.FlattenSeasons.ALWAYS:
+        flatten_seasons = self._settings.flatten_seasons
+        if flatten_seasons == self.FlattenSeasons.ALWAYS:
             return get_plugin_url(content_type='episodes', tvshowid=tvshowid,
                                   parent_category=parent_category)
-        if ADDON.getSettingInt('flatten_seasons') == self.FlattenSeasons.IF_ONE_SEASON:
+        if flatten_seasons == self.FlattenSeasons.IF_ONE_SEASON:
             if media_info['season'] == 1:
                 return get_plugin_url(content_type='episodes', tvshowid=tvshowid,
                                       parent_category=parent_category)
@@ -184,6 +406,7 @@ class SeasonsHandler(BaseContentTypeHandler):
 class EpisodesHandler(PlayableContentMixin, BaseContentTypeHandler):
     mediatype = 'episode'
     api_class = json_rpc_api.GetEpisodes
+    listing_profile_setting = 'episodes_listing_profile'
 
     def get_plugin_category(self) -> str:
         return self._parent_category
@@ -197,6 +420,7 @@ class EpisodesHandler(PlayableContentMixin, BaseContentTypeHandler):
 
 class RecentEpisodesHandler(EpisodesHandler):
     api_class = json_rpc_api.GetRecentlyAddedEpisodes
+    cache_ttl_setting = 'recent_cache_ttl'
 
     def get_plugin_category(self) -> str:
         return _('Recently added episodes')
@@ -213,6 +437,7 @@ class RecentEpisodesHandler(EpisodesHandler):
 class MusicVideosHandler(PlayableContentMixin, BaseContentTypeHandler):
     mediatype = 'musicvideo'
     api_class = json_rpc_api.GetMusicVideos
+    listing_profile_setting = 'musicvideos_listing_profile'
 
     def get_plugin_category(self) -> str:
         return _('Music videos')
@@ -228,9 +453,22 @@ class MusicVideosHandler(PlayableContentMixin, BaseContentTypeHandler):
 
 class RecentMusicVideosHandler(MusicVideosHandler):
     api_class = json_rpc_api.GetRecentlyAddedMusicVideos
+    cache_ttl_setting = 'recent_cache_ttl'
 
     def get_plugin_category(self) -> str:
         return _('Recently added music videos')
 
     def get_sort_methods(self) -> List[int]:
         return []
+
+
+CONTENT_TYPE_HANDLERS: Dict[str, Type[BaseContentTypeHandler]] = {
+    'movies': MoviesHandler,
+    'recent_movies': RecentMoviesHandler,
+    'tvshows': TvShowsHandler,
+    'seasons': SeasonsHandler,
+    'episodes': EpisodesHandler,
+    'recent_episodes': RecentEpisodesHandler,
+    'music_videos': MusicVideosHandler,
+    'recent_music_videos': RecentMusicVideosHandler,
+}
@@ -0,0 +1,122 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Incremental updates of cached listings with changes from the remote library"""
+
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from libs.exceptions import NoDataError
+from libs.json_rpc_api import (BaseMediaItemsRetriever, JsonRpcBatch, WATCHED_STATE_PROPERTIES,
+                               get_details_batch)
+from libs.library_cache import LIBRARY_CACHE, ListingKey
+
+logger = logging.getLogger(__name__)
+
+KODI_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Changes that do not update date fields of media items (e.g. "Mark as unwatched"
+# on the remote Kodi) are picked up by a periodic full re-sync.
+FULL_SYNC_INTERVAL = 24 * 60 * 60
+
+
+def _get_since(watermark: str) -> str:
+    # JSON-RPC "after" filter operator is exclusive and dates have 1 second
+    # resolution, so step back a little to not miss items changed
+    # during the same second as the watermark.
+    since = datetime.strptime(watermark, KODI_DATE_FORMAT) - timedelta(seconds=1)
+    return since.strftime(KODI_DATE_FORMAT)
+
+
+def sync_listing(listing_key: ListingKey, api: BaseMediaItemsRetriever) -> bool:
+    """
+    Update a cached listing with changes from the remote library
+
+    IDs of all remote items and items added or modified since the last sync
+    watermark are retrieved in one JSON-RPC batch request. Then modified
+    items are updated, new items are added and missing items are removed
+    from the cached listing.
+
+    :param listing_key: listing key
+    :param api: media items retriever for the listing
+    :return: ``True`` if the listing has been updated, ``False`` if it needs
+        to be fully re-fetched from the remote Kodi.
+    :raises NoDataError: if the changes cannot be retrieved
+    :raises RemoteKodiError: if unable to connect to remote Kodi
+    """
+    if not api.delta_sync_fields:
+        return False
+    sync_state = LIBRARY_CACHE.get_sync_state(listing_key)
+    if (sync_state is None or not sync_state.watermark
+            or time.time() - sync_state.full_synced_at > FULL_SYNC_INTERVAL):
+        return False
+    try:
+        since = _get_since(sync_state.watermark)
+    except ValueError:
+        logger.warning('Invalid sync watermark "%s" for %s',
+                       sync_state.watermark, listing_key)
+        return False
+    ids_api = api.get_item_ids_api()
+    changes_api = api.get_changed_items_api(since)
+    batch = JsonRpcBatch()
+    ids_index = batch.add(ids_api)
+    changes_index = batch.add(changes_api)
+    batch.send()
+    remote_ids = ids_api.parse_item_ids(batch.get_reply(ids_index))
+    changed_items = changes_api.parse_media_items(batch.get_reply(changes_index))
+    changed_ids = {item[api.item_id_param] for item in changed_items}
+    cached_ids = LIBRARY_CACHE.get_item_ids(listing_key)
+    if remote_ids - cached_ids - changed_ids:
+        # Items that were added with an earlier date, e.g. restored from a backup
+        logger.debug('Unable to sync %s incrementally: unknown items found', listing_key)
+        return False
+    LIBRARY_CACHE.merge_listing(listing_key, changed_items, remote_ids,
+                                api.delta_sync_fields)
+    return True
+
+
+def reconcile_watched_state(items: Iterable[Tuple[str, int]]) -> bool:
+    """
+    Update locally patched watched status of media items in cached listings
+    with actual values from the remote library
+
+    If the actual values cannot be retrieved, e.g. an item has been removed,
+    cached listings with the item are invalidated.
+
+    :param items: (item_id_param, item_id) tuples, e.g. ``[('movieid', 42)]``
+    :return: ``True`` if cached data have been changed
+    :raises RemoteKodiError: if unable to connect to remote Kodi
+    """
+    item_ids: Dict[str, List[int]] = defaultdict(list)
+    for item_id_param, item_id in items:
+        item_ids[item_id_param].append(item_id)
+    is_changed = False
+    for item_id_param, ids in item_ids.items():
+        try:
+            details = get_details_batch(item_id_param, ids, WATCHED_STATE_PROPERTIES)
+        except NoDataError as exc:
+            logger.warning('Unable to reconcile watched status of %s %s: %s',
+                           item_id_param, ids, exc)
+            for item_id in ids:
+                LIBRARY_CACHE.invalidate_watched_state(item_id_param, item_id)
+            is_changed = True
+            continue
+        for item_id, item_details in zip(ids, details):
+            watched_state = {key: item_details[key] for key in WATCHED_STATE_PROPERTIES
+                             if key in item_details}
+            is_changed |= LIBRARY_CACHE.patch_item(item_id_param, item_id, watched_state)
+    return is_changed
@@ -20,3 +20,21 @@ class NoDataError(Exception):
 
 class RemoteKodiError(ConnectionError):
     pass
+
+
+class CircuitOpenError(RemoteKodiError):
+    """The remote Kodi is known to be unavailable, so a request has not been sent"""
+
+
+class JsonRpcError(NoDataError):
+    """An error returned by the remote JSON-RPC API"""
+
+    def __init__(self, method, message, code=None):
+        super().__init__(f'{method}: {message}')
+        self.method = method
+        self.code = code
+
+    @classmethod
+    def from_reply(cls, method, json_reply):
+        error = json_reply.get('error') or {}
+        return cls(method, error.get('message', 'Unknown error'), error.get('code'))
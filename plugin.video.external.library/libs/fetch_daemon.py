@@ -0,0 +1,219 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Fetch daemon that retrieves media listings in the service process
+
+The service owns remote Kodi connections and caches, and plugin invocations
+request ready-to-render media items over a loopback socket. The daemon address
+and an access token are published in MemStorage. Each request and reply
+is a line of JSON: the reply starts with a header, followed by media items
+and an end marker.
+"""
+
+import json
+import logging
+import secrets
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from libs.exceptions import NoDataError, RemoteKodiError
+from libs.instrumentation import count, finish_record, start_record
+from libs.kodi_service import ADDON_ID, ADDON_PROFILE_DIR, ADDON_SETTINGS
+from libs.mem_storage import MemStorage
+from libs.profiler import get_profile_id, profile_request
+
+logger = logging.getLogger(__name__)
+
+DAEMON_ADDRESS_KEY = f'__{ADDON_ID}_fetch_daemon__'
+
+CONNECT_TIMEOUT = 1.0
+# Retrieving a large listing from the remote Kodi may take a while
+READ_TIMEOUT = 300.0
+
+ERROR_TYPES = {
+    'NoDataError': NoDataError,
+    'RemoteKodiError': RemoteKodiError,
+}
+
+
+def _send_message(wfile, message: Dict[str, Any]) -> None:
+    wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+
+
+class FetchRequestHandler(socketserver.StreamRequestHandler):
+    """Serves one listing request from a plugin invocation"""
+    server: 'FetchDaemon'
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if not secrets.compare_digest(str(request.get('token')), self.server.token):
+            logger.warning('Fetch daemon request with an invalid token')
+            return
+        content_type = request['content_type']
+        if ADDON_SETTINGS.get().collect_stats:
+            start_record('fetch_daemon', content_type=content_type)
+        try:
+            # Only requests from profiled plugin invocations are profiled
+            with profile_request(request.get('profile_id'), f'fetch_daemon-{content_type}',
+                                 f'tvshowid={request.get("tvshowid")} '
+                                 f'season={request.get("season")}'):
+                self._serve_listing(request)
+        finally:
+            finish_record(ADDON_PROFILE_DIR)
+
+    def _serve_listing(self, request: Dict[str, Any]) -> None:
+        start_time = time.monotonic()
+        content_type = request['content_type']
+        handler_class = self.server.content_type_handlers[content_type]
+        content_type_handler = handler_class(request.get('tvshowid'), request.get('season'))
+        media_items = content_type_handler.fetch_media_items()
+        header_sent = False
+        item_count = 0
+        try:
+            # A lean or a stale listing is selected when the first item is retrieved
+            for media_info in media_items:
+                if not header_sent:
+                    self._send_header(content_type_handler)
+                    header_sent = True
+                _send_message(self.wfile, {'item': media_info})
+                item_count += 1
+            if not header_sent:
+                self._send_header(content_type_handler)
+            _send_message(self.wfile, {'end': True})
+        except (NoDataError, RemoteKodiError) as exc:
+            logger.exception('Fetch daemon: unable to retrieve %s', content_type)
+            error_type = 'RemoteKodiError' if isinstance(exc, RemoteKodiError) else 'NoDataError'
+            _send_message(self.wfile, {'error': error_type, 'message': str(exc)})
+        except OSError:
+            logger.debug('Fetch daemon: the client has disconnected')
+            return
+        finally:
+            media_items.close()
+        count('items', item_count)
+        logger.debug('Fetch daemon: served %s %s items in %.3f s',
+                     item_count, content_type, time.monotonic() - start_time)
+
+    def _send_header(self, content_type_handler) -> None:
+        _send_message(self.wfile, {
+            'is_lean_listing': content_type_handler.is_lean_listing,
+            'is_stale': content_type_handler.is_stale,
+        })
+
+
+class FetchDaemon(socketserver.ThreadingTCPServer):
+    """
+    Loopback server that retrieves media listings for plugin invocations
+
+    :param content_type_handlers: the mapping of content types to content handler classes
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, content_type_handlers):
+        super().__init__(('127.0.0.1', 0), FetchRequestHandler)
+        self.content_type_handlers = content_type_handlers
+        self.token = secrets.token_hex(16)
+        self._thread = threading.Thread(target=self.serve_forever, name='FetchDaemon',
+                                        daemon=True)
+        self._mem_storage = MemStorage()
+
+    def handle_error(self, request, client_address) -> None:
+        logger.exception('Fetch daemon: unhandled error while serving %s', client_address)
+
+    def start(self) -> None:
+        self._thread.start()
+        self._mem_storage[DAEMON_ADDRESS_KEY] = {
+            'port': self.server_address[1],
+            'token': self.token,
+        }
+        logger.debug('Fetch daemon started on port %s', self.server_address[1])
+
+    def stop(self) -> None:
+        del self._mem_storage[DAEMON_ADDRESS_KEY]
+        self.shutdown()
+        self.server_close()
+        logger.debug('Fetch daemon stopped.')
+
+
+def _iter_media_items(sock: socket.socket, reader) -> Iterator[Dict[str, Any]]:
+    with sock, reader:
+        while True:
+            try:
+                message = json.loads(reader.readline())
+            except (OSError, ValueError) as exc:
+                raise NoDataError('Fetch daemon connection has been lost') from exc
+            if 'item' in message:
+                yield message['item']
+            elif 'error' in message:
+                error_class = ERROR_TYPES.get(message['error'], NoDataError)
+                raise error_class(message['message'])
+            else:
+                return
+
+
+def get_media_items(content_type: str, tvshowid: Optional[int],
+                    season: Optional[int]
+                    ) -> Optional[Tuple[bool, bool, Iterator[Dict[str, Any]]]]:
+    """
+    Request media items from the fetch daemon
+
+    :param content_type: content type, e.g. "movies"
+    :param tvshowid: TV show ID for seasons and episodes
+    :param season: season number for episodes
+    :return: (is lean listing, is stale listing, media items iterator) tuple or ``None``
+        if the daemon is not available and media items need to be retrieved directly.
+    :raises NoDataError: if the daemon is unable to retrieve media items
+    :raises RemoteKodiError: if the daemon is unable to connect to remote Kodi
+    """
+    if not ADDON_SETTINGS.get().fetch_daemon:
+        return None
+    if (daemon_address := MemStorage().get(DAEMON_ADDRESS_KEY)) is None:
+        return None
+    request = {
+        'token': daemon_address['token'],
+        'content_type': content_type,
+        'tvshowid': tvshowid,
+        'season': season,
+        'profile_id': get_profile_id(),
+    }
+    try:
+        sock = socket.create_connection(('127.0.0.1', daemon_address['port']),
+                                        CONNECT_TIMEOUT)
+    except OSError as exc:
+        logger.warning('Fetch daemon is not available: %s', exc)
+        return None
+    reader = sock.makefile('rb')
+    try:
+        sock.settimeout(READ_TIMEOUT)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        header = json.loads(reader.readline())
+    except (OSError, ValueError) as exc:
+        logger.warning('Fetch daemon request failed: %s', exc)
+        reader.close()
+        sock.close()
+        return None
+    if 'error' in header:
+        reader.close()
+        sock.close()
+        error_class = ERROR_TYPES.get(header['error'], NoDataError)
+        raise error_class(header['message'])
+    count('fetch_daemon_hits')
+    return header['is_lean_listing'], header.get('is_stale', False), _iter_media_items(sock, reader)
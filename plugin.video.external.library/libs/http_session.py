@@ -0,0 +1,312 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Persistent keep-alive HTTP connections to the remote Kodi host"""
+
+import base64
+import http.client
+import json
+import logging
+import queue
+import ssl
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from libs.instrumentation import count, measure
+
+logger = logging.getLogger(__name__)
+
+# Exceptions that mean that a reused keep-alive connection has been closed
+# by the remote side while it was idle in the pool
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+ConnectionType = http.client.HTTPConnection
+
+
+class HttpStatusError(http.client.HTTPException):
+    pass
+
+
+class SessionStats:
+    """
+    Connection reuse statistics of a :class:`KeepAliveSession`
+
+    Counters are updated by concurrent requests, including both attempts
+    of a hedged request, so they must be changed with :meth:`increment`.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.stale_retries = 0
+        self.hedged_requests = 0
+        self.hedges_won = 0
+        self._lock = threading.Lock()
+
+    def increment(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            'requests': self.requests,
+            'connections_opened': self.connections_opened,
+            'connections_reused': self.connections_reused,
+            'stale_retries': self.stale_retries,
+            'hedged_requests': self.hedged_requests,
+            'hedges_won': self.hedges_won,
+        }
+
+    def __str__(self):
+        reuse_percent = 0
+        if self.requests:
+            reuse_percent = round(self.connections_reused * 100 / self.requests)
+        return (f'requests: {self.requests}, connections opened: {self.connections_opened}, '
+                f'reused: {self.connections_reused} ({reuse_percent}%), '
+                f'stale connection retries: {self.stale_retries}, '
+                f'hedged requests: {self.hedged_requests}, won by hedges: {self.hedges_won}')
+
+
+class KeepAliveSession:
+    """
+    A thread-safe pool of persistent HTTP/1.1 connections to a single host
+
+    Idle connections are kept in the pool and reused by subsequent requests,
+    so TCP and TLS handshakes are performed only once per connection.
+    Connecting and sending a request are limited by :attr:`connect_timeout`,
+    and waiting for reply data is limited by a read timeout, so a stalled
+    remote host results in :class:`TimeoutError` instead of a hang.
+    """
+    max_idle_connections = 4
+    max_idle_time = 60.0
+    connect_timeout = 5.0
+    default_read_timeout = 30.0
+
+    def __init__(self, base_url: str, auth: Optional[Tuple[str, str]] = None):
+        self._url_parts = urlsplit(base_url)
+        self._auth_header = None
+        if auth is not None:
+            credentials = base64.b64encode(':'.join(auth).encode('utf-8')).decode('ascii')
+            self._auth_header = f'Basic {credentials}'
+        self.key = self.make_key(base_url, auth)
+        self.stats = SessionStats()
+        self._idle_connections: List[Tuple[ConnectionType, float]] = []
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    @staticmethod
+    def make_key(base_url: str, auth: Optional[Tuple[str, str]]) -> Tuple[Any, ...]:
+        """Get a key that identifies connection settings"""
+        return base_url, auth
+
+    def _get_ssl_context(self) -> ssl.SSLContext:
+        if self._ssl_context is None:
+            # Remote Kodi instances usually use self-signed certificates
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self._ssl_context = context
+        return self._ssl_context
+
+    def _open_connection(self) -> ConnectionType:
+        self.stats.increment('connections_opened')
+        host = self._url_parts.hostname
+        port = self._url_parts.port
+        if self._url_parts.scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.connect_timeout,
+                                               context=self._get_ssl_context())
+        return http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+
+    def _acquire_connection(self) -> Tuple[ConnectionType, bool]:
+        now = time.monotonic()
+        with self._lock:
+            while self._idle_connections:
+                connection, released_at = self._idle_connections.pop()
+                if now - released_at < self.max_idle_time:
+                    self.stats.increment('connections_reused')
+                    return connection, True
+                connection.close()
+            return self._open_connection(), False
+
+    def _release_connection(self, connection: ConnectionType) -> None:
+        with self._lock:
+            if len(self._idle_connections) < self.max_idle_connections:
+                self._idle_connections.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def _get_headers(self) -> Dict[str, str]:
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Connection': 'keep-alive',
+        }
+        if self._auth_header is not None:
+            headers['Authorization'] = self._auth_header
+        return headers
+
+    def _send(self, connection: ConnectionType, path: str, body: bytes,
+              headers: Dict[str, str],
+              read_timeout: float) -> Tuple[http.client.HTTPResponse, bytes]:
+        if connection.sock is not None:
+            connection.sock.settimeout(self.connect_timeout)
+        # A new connection is established with the connect timeout
+        connection.request('POST', path, body=body, headers=headers)
+        connection.sock.settimeout(read_timeout)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def post_json(self, path: str, payload: Any, read_timeout: Optional[float] = None,
+                  hedge_after: Optional[float] = None) -> Any:
+        """
+        Send a JSON payload with a POST request and return a decoded JSON reply
+
+        :param path: URL path on the remote host
+        :param payload: JSON-serializable object
+        :param read_timeout: the maximum time to wait for reply data in seconds
+            instead of :attr:`default_read_timeout`
+        :param hedge_after: if not ``None``, the same request is sent once again
+            over another connection if no reply has been received in this time,
+            and the reply that arrives first is used. Only requests that can be
+            safely repeated must be hedged.
+        :return: decoded JSON reply
+        :raises OSError: on connection errors, including timeouts
+        :raises http.client.HTTPException: on HTTP protocol errors
+        :raises ValueError: if a reply is not a valid JSON
+        """
+        body = json.dumps(payload).encode('utf-8')
+        if read_timeout is None:
+            read_timeout = self.default_read_timeout
+        with measure('json_rpc_round_trip'):
+            if hedge_after is None:
+                content = self._post(path, body, read_timeout)
+            else:
+                content = self._post_hedged(path, body, read_timeout, hedge_after)
+        count('json_rpc_requests')
+        count('bytes_received', len(content))
+        with measure('json_rpc_decode'):
+            return json.loads(content)
+
+    def _post(self, path: str, body: bytes, read_timeout: float) -> bytes:
+        headers = self._get_headers()
+        self.stats.increment('requests')
+        connection, is_reused = self._acquire_connection()
+        try:
+            try:
+                response, content = self._send(connection, path, body, headers, read_timeout)
+            except STALE_CONNECTION_ERRORS:
+                if not is_reused:
+                    raise
+                # The remote host has closed an idle connection. Retry with a new one.
+                connection.close()
+                self.stats.increment('stale_retries')
+                with self._lock:
+                    connection = self._open_connection()
+                response, content = self._send(connection, path, body, headers, read_timeout)
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+        if response.status >= 400:
+            raise HttpStatusError(f'HTTP error {response.status}: {response.reason}')
+        return content
+
+    def _post_hedged(self, path: str, body: bytes, read_timeout: float,
+                     hedge_after: float) -> bytes:
+        # Each attempt runs in its own thread, so the caller can wait for either of them.
+        # A losing attempt completes in the background and returns its connection to the pool.
+        results: queue.Queue = queue.Queue()
+
+        def attempt(is_hedge: bool) -> None:
+            try:
+                results.put((is_hedge, self._post(path, body, read_timeout), None))
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                results.put((is_hedge, None, exc))
+
+        threading.Thread(target=attempt, args=(False,), name='HttpAttempt', daemon=True).start()
+        try:
+            is_hedge, content, error = results.get(timeout=hedge_after)
+        except queue.Empty:
+            self.stats.increment('hedged_requests')
+            threading.Thread(target=attempt, args=(True,), name='HttpHedge', daemon=True).start()
+            is_hedge, content, error = results.get()
+            if error is not None:
+                # The other attempt may still succeed
+                is_hedge, content, error = results.get()
+        if error is not None:
+            raise error
+        if is_hedge:
+            self.stats.increment('hedges_won')
+        return content
+
+    def close(self) -> None:
+        """Close all idle connections"""
+        with self._lock:
+            for connection, _ in self._idle_connections:
+                connection.close()
+            self._idle_connections.clear()
+
+
+_SESSION: Optional[KeepAliveSession] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session(base_url: str, auth: Optional[Tuple[str, str]] = None) -> KeepAliveSession:
+    """
+    Get a process-wide keep-alive session for the remote Kodi host
+
+    If the host address or credentials have changed since the previous call,
+    the old session is closed and a new one is created.
+
+    :param base_url: remote Kodi base URL without credentials
+    :param auth: optional (login, password) tuple
+    :return: keep-alive session instance
+    """
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is None or _SESSION.key != KeepAliveSession.make_key(base_url, auth):
+            if _SESSION is not None:
+                logger.debug('Remote Kodi connection settings changed. Reconnecting. %s',
+                             _SESSION.stats)
+                _SESSION.close()
+            _SESSION = KeepAliveSession(base_url, auth)
+        return _SESSION
+
+
+def close_session() -> None:
+    """Close the process-wide keep-alive session"""
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is not None:
+            log_session_stats()
+            _SESSION.close()
+            _SESSION = None
+
+
+def log_session_stats() -> None:
+    """Write connection reuse statistics to the Kodi log"""
+    if _SESSION is not None:
+        logger.debug('Remote Kodi HTTP session stats: %s', _SESSION.stats)
@@ -0,0 +1,262 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Per-invocation timings and counters
+
+An invocation record is bound to the thread that has started it, so code
+deep in the call stack, e.g. JSON-RPC calls or MemStorage writes, reports
+to the record of the invocation that has called it. If no record has been
+started in the current thread, timers and counters do nothing.
+Finished records are appended as JSON lines to a rolling statistics file.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATS_FILE_NAME = 'stats.jsonl'
+ROTATED_STATS_FILE_NAME = 'stats.1.jsonl'
+# When the statistics file exceeds this size, it replaces the rotated file
+MAX_STATS_FILE_SIZE = 512 * 1024
+
+PERCENTILES = (50, 90, 99)
+
+_NULL_TIMER = nullcontext()
+_LOCAL = threading.local()
+
+
+class InvocationRecord:
+    """
+    Timings and counters of one addon invocation
+
+    Stage timings are accumulated, so a stage that is repeated for each item,
+    e.g. setting ListItem art, reports the total time for a listing.
+    Stages may be nested, e.g. a JSON-RPC call inside retrieving media items.
+    A stage reports its exclusive time without the time of stages nested in it,
+    so stage timings do not overlap and add up to at most the total time.
+    """
+
+    def __init__(self, invocation: str, **context: Any):
+        self.invocation = invocation
+        self.context = context
+        self.timings: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self._timestamp = time.time()
+        self._started_at = time.perf_counter()
+        # The time of nested stages for each stage that is being measured
+        self._nested_times: List[float] = []
+
+    def enter_stage(self) -> None:
+        self._nested_times.append(0.0)
+
+    def exit_stage(self, stage: str, seconds: float) -> None:
+        """
+        Add the time of a stage that has been entered last
+
+        :param stage: stage name
+        :param seconds: the wall time of the stage including nested stages
+        """
+        nested_time = self._nested_times.pop()
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds - nested_time
+        if self._nested_times:
+            self._nested_times[-1] += seconds
+
+    def count(self, counter: str, value: int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get a compact record with timings in milliseconds"""
+        return {
+            'ts': int(self._timestamp),
+            'invocation': self.invocation,
+            **self.context,
+            'total': round((time.perf_counter() - self._started_at) * 1000, 3),
+            'timings': {stage: round(seconds * 1000, 3)
+                        for stage, seconds in self.timings.items()},
+            'counters': self.counters,
+        }
+
+
+class _StageTimer:
+    __slots__ = ('_record', '_stage', '_started_at')
+
+    def __init__(self, record: InvocationRecord, stage: str):
+        self._record = record
+        self._stage = stage
+        self._started_at = 0.0
+
+    def __enter__(self):
+        self._record.enter_stage()
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._record.exit_stage(self._stage, time.perf_counter() - self._started_at)
+
+
+def start_record(invocation: str, **context: Any) -> InvocationRecord:
+    """
+    Start recording timings and counters in the current thread
+
+    :param invocation: invocation kind, e.g. "plugin" or "playback"
+    :param context: additional record fields, e.g. content_type
+    :return: the started record
+    """
+    record = InvocationRecord(invocation, **context)
+    _LOCAL.record = record
+    return record
+
+
+def get_record() -> Optional[InvocationRecord]:
+    """Get the record of the current thread or ``None``"""
+    return getattr(_LOCAL, 'record', None)
+
+
+def discard_record() -> None:
+    """Stop recording without saving the record"""
+    _LOCAL.record = None
+
+
+def measure(stage: str):
+    """
+    Get a context manager that adds the exclusive wall time of a block to a stage
+
+    :param stage: stage name
+    """
+    record = get_record()
+    if record is None:
+        return _NULL_TIMER
+    return _StageTimer(record, stage)
+
+
+def measure_iterable(stage: str, iterable: Iterable[Any]) -> Iterator[Any]:
+    """
+    Add the time spent in retrieving items from an iterable to a stage
+
+    The time spent by the consumer between items is not included.
+    """
+    iterator = iter(iterable)
+    while True:
+        with measure(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(counter: str, value: int = 1) -> None:
+    """Increment a counter of the current record"""
+    record = get_record()
+    if record is not None:
+        record.count(counter, value)
+
+
+def finish_record(stats_dir: Path) -> None:
+    """
+    Stop recording and append the record of the current thread to the statistics file
+
+    :param stats_dir: the directory of statistics files, e.g. the addon profile directory
+    """
+    record = get_record()
+    if record is None:
+        return
+    discard_record()
+    stats_path = stats_dir / STATS_FILE_NAME
+    line = json.dumps(record.to_dict(), separators=(',', ':')) + '\n'
+    try:
+        stats_dir.mkdir(parents=True, exist_ok=True)
+        if stats_path.exists() and stats_path.stat().st_size > MAX_STATS_FILE_SIZE:
+            stats_path.replace(stats_dir / ROTATED_STATS_FILE_NAME)
+        with stats_path.open('a', encoding='utf-8') as fo:
+            fo.write(line)
+    except OSError as exc:
+        logger.warning('Unable to save invocation statistics: %s', exc)
+
+
+def read_records(stats_dir: Path) -> Iterator[Dict[str, Any]]:
+    """Read saved records from the oldest to the newest"""
+    for file_name in (ROTATED_STATS_FILE_NAME, STATS_FILE_NAME):
+        try:
+            with (stats_dir / file_name).open('r', encoding='utf-8') as fo:
+                for line in fo:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A line may be truncated if Kodi has exited while writing it
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def _get_percentile(sorted_values: List[float], percentile: int) -> float:
+    index = max(0, -(-len(sorted_values) * percentile // 100) - 1)  # Nearest rank
+    return sorted_values[index]
+
+
+def summarize_records(records: Iterable[Dict[str, Any]]
+                      ) -> Dict[str, Tuple[int, Dict[str, Tuple[float, ...]]]]:
+    """
+    Get percentiles of timings and counters grouped by content type
+
+    Records of other invocations, e.g. playback, are grouped by invocation kind.
+    A stage or a counter that is absent in a record is not included in percentiles.
+
+    :param records: saved records
+    :return: group name to (number of records, metric to percentiles) mapping.
+        Timing metrics are suffixed with ", ms".
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        invocation = record.get('invocation', 'plugin')
+        group = record.get('content_type') or invocation
+        if invocation not in ('plugin', group):
+            group = f'{group} ({invocation})'
+        groups.setdefault(group, []).append(record)
+    summary = {}
+    for group, group_records in sorted(groups.items()):
+        metrics: Dict[str, List[float]] = {}
+        for record in group_records:
+            metrics.setdefault('total, ms', []).append(record.get('total', 0.0))
+            for stage, value in record.get('timings', {}).items():
+                metrics.setdefault(f'{stage}, ms', []).append(value)
+            for counter, value in record.get('counters', {}).items():
+                metrics.setdefault(counter, []).append(value)
+        summary[group] = (
+            len(group_records),
+            {metric: tuple(_get_percentile(sorted(values), percentile)
+                           for percentile in PERCENTILES)
+             for metric, values in metrics.items()}
+        )
+    return summary
+
+
+def format_summary(summary: Dict[str, Tuple[int, Dict[str, Tuple[float, ...]]]]) -> str:
+    """Format a summary as a plain text table for each group"""
+    header = ' / '.join(f'p{percentile}' for percentile in PERCENTILES)
+    lines = []
+    for group, (record_count, metrics) in summary.items():
+        lines.append(f'{group}: {record_count} records, {header}')
+        for metric, values in metrics.items():
+            formatted_values = ' / '.join(f'{value:g}' for value in values)
+            lines.append(f'    {metric}: {formatted_values}')
+        lines.append('')
+    return '\n'.join(lines)
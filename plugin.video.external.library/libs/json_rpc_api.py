@@ -14,46 +14,234 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """Classes and functions responsible for interacting with the remote JSON-RPC API"""
 
+import copy
+import http.client
 import logging
+import threading
+import time
+from collections import deque
 from pprint import pformat
-from typing import List, Dict, Any, Optional
+from typing import (List, Deque, Dict, Any, Optional, Set, Tuple, Type, Union, Iterable,
+                    Iterator)
 
-import simple_requests as requests
-
-from libs.exceptions import NoDataError, RemoteKodiError
-from libs.kodi_service import ADDON, get_remote_kodi_url
+from libs.circuit_breaker import CIRCUIT_BREAKER
+from libs.exceptions import NoDataError, RemoteKodiError, JsonRpcError
+from libs.http_session import get_session
+from libs.kodi_service import ADDON_SETTINGS, get_remote_kodi_url
 
 logger = logging.getLogger(__name__)
 
 
-class BaseJsonRpcApi:
+JsonRpcPayload = Union[Dict[str, Any], List[Dict[str, Any]]]
+
+# Methods that only read data, so their requests can be safely sent twice
+IDEMPOTENT_METHOD_PREFIXES = ('VideoLibrary.Get', 'JSONRPC.')
+
+
+class LatencyTracker:
+    """
+    Derives deadlines from recent latencies of JSON-RPC requests
+
+    Latencies are tracked separately for each request shape, i.e. a method
+    with the number of requested properties and the page size, because
+    retrieving a full listing takes much longer than a lean one or a single item.
+    Until enough latencies are observed, the default read timeout is used
+    and requests are not hedged.
+    """
+    sample_size = 50
+    min_samples = 5
+    min_read_timeout = 10.0
+    max_read_timeout = 120.0
+    # The read timeout is this number of times longer than p99 latency
+    read_timeout_factor = 4.0
+    hedge_percentile = 95
+    # Short requests are not hedged to avoid doubling requests because of network jitter
+    min_hedge_delay = 0.1
+
+    def __init__(self):
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(payload: JsonRpcPayload) -> str:
+        """Get a key of the request shape"""
+        if isinstance(payload, list):
+            return '+'.join(sorted(LatencyTracker.get_key(request) for request in payload))
+        params = payload.get('params', {})
+        limits = params.get('limits', {})
+        page_size = limits.get('end', 0) - limits.get('start', 0)
+        return f'{payload["method"]}/{len(params.get("properties", ()))}/{page_size}'
+
+    def record(self, key: str, latency: float) -> None:
+        with self._lock:
+            if (latencies := self._latencies.get(key)) is None:
+                latencies = self._latencies[key] = deque(maxlen=self.sample_size)
+            latencies.append(latency)
+
+    def _get_percentile(self, key: str, percentile: int) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return latencies[max(0, -(-len(latencies) * percentile // 100) - 1)]
+
+    def get_read_timeout(self, key: str) -> Optional[float]:
+        """
+        Get a read timeout for a request or ``None`` to use the default timeout
+        """
+        if (p99 := self._get_percentile(key, 99)) is None:
+            return None
+        return min(self.max_read_timeout,
+                   max(self.min_read_timeout, p99 * self.read_timeout_factor))
+
+    def get_hedge_delay(self, key: str) -> Optional[float]:
+        """
+        Get the time after which a request is sent again or ``None`` if it is not hedged
+        """
+        if (delay := self._get_percentile(key, self.hedge_percentile)) is None:
+            return None
+        return max(self.min_hedge_delay, delay)
+
+
+LATENCY_TRACKER = LatencyTracker()
+
+
+def _is_idempotent(payload: JsonRpcPayload) -> bool:
+    requests = payload if isinstance(payload, list) else [payload]
+    return all(request['method'].startswith(IDEMPOTENT_METHOD_PREFIXES) for request in requests)
+
+
+def post_json_rpc(payload: JsonRpcPayload) -> Any:
+    """
+    Post a JSON-RPC request or a batch of requests to remote Kodi
+
+    Read deadlines adapt to observed latencies of similar requests,
+    and read-only requests that take longer than usual are hedged.
+
+    :param payload: a JSON-RPC request or a list of requests
+    :return: decoded JSON-RPC reply
+    :raises RemoteKodiError: if unable to connect to remote Kodi
+        or remote Kodi has not replied in time
+    :raises CircuitOpenError: if remote Kodi is known to be unavailable
+    """
+    kodi_url = get_remote_kodi_url(with_credentials=False)
+    CIRCUIT_BREAKER.before_request(kodi_url)
+    return _post_json_rpc(kodi_url, payload)
+
+
+def _post_json_rpc(kodi_url: str, payload: JsonRpcPayload,
+                   read_timeout: Optional[float] = None) -> Any:
+    auth = None
+    settings = ADDON_SETTINGS.get()
+    if settings.kodi_login:
+        auth = (settings.kodi_login, settings.kodi_password)
+    session = get_session(kodi_url, auth)
+    latency_key = LatencyTracker.get_key(payload)
+    hedge_after = None
+    if _is_idempotent(payload):
+        hedge_after = LATENCY_TRACKER.get_hedge_delay(latency_key)
+    if read_timeout is None:
+        read_timeout = LATENCY_TRACKER.get_read_timeout(latency_key)
+    start_time = time.monotonic()
+    try:
+        reply = session.post_json('/jsonrpc', payload, read_timeout=read_timeout,
+                                  hedge_after=hedge_after)
+    except OSError as exc:
+        # Only connection failures and timeouts mean that the host is unavailable
+        CIRCUIT_BREAKER.record_failure(kodi_url)
+        raise RemoteKodiError(kodi_url) from exc
+    except (http.client.HTTPException, ValueError) as exc:
+        raise RemoteKodiError(kodi_url) from exc
+    CIRCUIT_BREAKER.record_success(kodi_url)
+    # Recorded only in the calling thread, so both attempts of a hedged request
+    # add one sample with the latency that the caller has observed
+    LATENCY_TRACKER.record(latency_key, time.monotonic() - start_time)
+    return reply
+
+
+# Probes should not wait for a stalled host for as long as regular requests
+PROBE_READ_TIMEOUT = 5.0
+
+
+def probe_remote_kodi() -> bool:
+    """
+    Check if remote Kodi is available, bypassing the circuit breaker
+
+    The result is recorded by the circuit breaker.
+
+    :return: ``True`` if remote Kodi has replied
+    """
     kodi_url = get_remote_kodi_url(with_credentials=False)
+    try:
+        _post_json_rpc(kodi_url, JsonRpcPing().get_request(), PROBE_READ_TIMEOUT)
+    except RemoteKodiError:
+        return False
+    return True
+
+
+# Long lists in logged payloads, e.g. media items, are shortened to this number of items
+MAX_LOGGED_ITEMS = 3
+MAX_LOGGED_PAYLOAD_LENGTH = 4096
+
+
+def _shorten_payload(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _shorten_payload(item) for key, item in value.items()}
+    if isinstance(value, list):
+        shortened = [_shorten_payload(item) for item in value[:MAX_LOGGED_ITEMS]]
+        if len(value) > MAX_LOGGED_ITEMS:
+            shortened.append(f'... {len(value) - MAX_LOGGED_ITEMS} more items')
+        return shortened
+    return value
+
+
+# Logging calls str() on its arguments only if a record is emitted, so __str__ is the only method
+class LoggedPayload:  # pylint: disable=too-few-public-methods
+    """
+    Renders a JSON-RPC payload for logging only when a log record is emitted
+
+    Long lists are summarized and long text is truncated, so logging a reply
+    with a large listing does not take longer than retrieving it.
+    """
+
+    def __init__(self, payload: Any):
+        self._payload = payload
+
+    def __str__(self) -> str:
+        text = pformat(_shorten_payload(self._payload))
+        if len(text) > MAX_LOGGED_PAYLOAD_LENGTH:
+            text = (f'{text[:MAX_LOGGED_PAYLOAD_LENGTH]}... '
+                    f'[{len(text) - MAX_LOGGED_PAYLOAD_LENGTH} more characters]')
+        return text
+
+
+class BaseJsonRpcApi:
     method: str
 
-    def send_json_rpc(self):
+    def get_request(self, request_id: str = '1') -> Dict[str, Any]:
         """
-        Send JSON-RPC to remote Kodi
+        Get JSON-RPC request object
+
+        :param request_id: JSON-RPC request ID
         """
         request = {
             'jsonrpc': '2.0',
             'method': self.method,
-            'id': '1',
+            'id': request_id,
         }
         params = self.get_params()  # pylint: disable=assignment-from-none
         if params is not None:
             request['params'] = params
-        logger.debug('JSON-RPC request: %s', pformat(request))
-        auth = None
-        login = ADDON.getSetting('kodi_login')
-        password = ADDON.getSetting('kodi_password')
-        if login:
-            auth = (login, password)
-        try:
-            json_reply = requests.post(self.kodi_url + '/jsonrpc', json=request,
-                                       auth=auth, verify=False).json()
-        except requests.RequestException as exc:
-            raise RemoteKodiError(self.kodi_url) from exc
-        logger.debug('JSON-RPC reply: %s', pformat(json_reply))
+        return request
+
+    def send_json_rpc(self):
+        """
+        Send JSON-RPC to remote Kodi
+        """
+        request = self.get_request()
+        logger.debug('JSON-RPC request: %s', LoggedPayload(request))
+        json_reply = post_json_rpc(request)
+        logger.debug('JSON-RPC reply: %s', LoggedPayload(json_reply))
         return json_reply
 
     def get_params(self) -> Optional[Dict[str, Any]]:
@@ -61,39 +249,237 @@ class BaseJsonRpcApi:
         return None
 
 
+class JsonRpcBatch:
+    """
+    Sends several JSON-RPC API calls to remote Kodi in one HTTP round trip
+
+    Example::
+
+        batch = JsonRpcBatch()
+        movies_index = batch.add(GetMovies('movies'))
+        tvshows_index = batch.add(GetTVShows('tvshows'))
+        batch.send()
+        movies = batch.get_reply(movies_index)['result']['movies']
+    """
+
+    def __init__(self):
+        self._calls: List[BaseJsonRpcApi] = []
+        self._replies: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def add(self, api: BaseJsonRpcApi) -> int:
+        """
+        Add a JSON-RPC API call to the batch
+
+        :param api: JSON-RPC API instance
+        :return: the index of the call in the batch
+        """
+        self._calls.append(api)
+        return len(self._calls) - 1
+
+    def send(self) -> None:
+        """
+        Send all queued calls to remote Kodi in one request
+
+        :raises RemoteKodiError: if unable to connect to remote Kodi
+        :raises JsonRpcError: if remote Kodi has rejected the whole batch
+        """
+        if not self._calls:
+            return
+        requests = [api.get_request(str(index)) for index, api in enumerate(self._calls)]
+        logger.debug('JSON-RPC batch request: %s', LoggedPayload(requests))
+        json_reply = post_json_rpc(requests)
+        logger.debug('JSON-RPC batch reply: %s', LoggedPayload(json_reply))
+        if isinstance(json_reply, dict):
+            # A batch that cannot be processed at all results in a single error object
+            raise JsonRpcError.from_reply('batch', json_reply)
+        self._replies = {str(reply.get('id')): reply for reply in json_reply}
+
+    def get_reply(self, index: int) -> Dict[str, Any]:
+        """
+        Get a JSON-RPC reply for a call from the batch
+
+        :param index: the index of the call returned by :meth:`add`
+        :return: JSON-RPC reply
+        :raises JsonRpcError: if the call has failed
+        """
+        method = self._calls[index].method
+        try:
+            reply = self._replies[str(index)]
+        except KeyError as exc:
+            raise JsonRpcError(method, f'No reply for "{method}" call in the batch') from exc
+        if 'error' in reply:
+            raise JsonRpcError.from_reply(method, reply)
+        return reply
+
+
 class BaseMediaItemsRetriever(BaseJsonRpcApi):
     properties: List[str]
     sort = Dict[str, str]
-
-    def __init__(self, content, tvshowid=None, season=None):
+    # Properties for listings that show only basic info, None if not supported
+    lean_properties: Optional[List[str]] = None
+    # Date fields that allow to retrieve only items added or modified after a specific time
+    delta_sync_fields: Tuple[str, ...] = ()
+    # Excludes items that content handlers do not show from the number of items
+    count_filter: Optional[Dict[str, Any]] = None
+
+    def __init__(self, content, tvshowid=None, season=None, page_size=0, properties=None):
+        """
+        :param content: the content type as returned by JSON-RPC API, e.g. "movies"
+        :param tvshowid: TV show ID for seasons and episodes
+        :param season: season number for episodes
+        :param page_size: if not 0, media items are retrieved in pages of this size
+            using JSON-RPC "limits" parameter
+        :param properties: media properties to retrieve instead of the default ones
+        """
+        if properties is not None:
+            self.properties = properties
         self._content = content
         self._tvshowid = tvshowid
         self._season = season
+        self._page_size = page_size
+        self._limits = None
+        self._filter = None
+
+    @property
+    def item_id_param(self) -> str:
+        return f'{self._content[:-1]}id'
 
     def get_params(self) -> Dict[str, Any]:
-        params = {
-            'properties': self.properties,
-            'sort': self.sort,
-        }
+        params = {'properties': self.properties}
+        if self.properties:
+            # Sorting is not needed when only item IDs are requested
+            params['sort'] = self.sort
         if self._tvshowid is not None:
             params['tvshowid'] = self._tvshowid
         if self._season is not None:
             params['season'] = self._season
+        if self._limits is not None:
+            params['limits'] = self._limits
+        if self._filter is not None:
+            params['filter'] = self._filter
         return params
 
-    def get_media_items(self) -> List[Dict[str, Any]]:
+    def get_changed_items_api(self, since: str) -> 'BaseMediaItemsRetriever':
+        """
+        Get a copy of this retriever that requests only items
+        added or modified after a specific time
+
+        :param since: a date/time string in the remote Kodi format: "YYYY-MM-DD HH:MM:SS"
+        """
+        # pylint: disable=protected-access
+        if not self.delta_sync_fields:
+            raise TypeError(f'{type(self).__name__} does not support delta sync')
+        api = copy.copy(self)
+        api._page_size = 0
+        api._filter = {'or': [
+            {'field': field, 'operator': 'after', 'value': since}
+            for field in self.delta_sync_fields
+        ]}
+        return api
+
+    def get_item_ids_api(self) -> 'BaseMediaItemsRetriever':
+        """
+        Get a copy of this retriever that requests only IDs of all items
         """
-        Get the list of media items for Kodi database
-        
+        # pylint: disable=protected-access
+        api = copy.copy(self)
+        api._page_size = 0
+        api.properties = []
+        return api
+
+    def parse_item_ids(self, json_reply: Dict[str, Any]) -> Set[int]:
+        """
+        Get media item IDs from a JSON-RPC reply
+
+        :raises: NoDataError when media items are not present in the reply
+        """
+        return {item[self.item_id_param] for item in self.parse_media_items(json_reply)}
+
+    def get_media_items(self) -> Iterator[Dict[str, Any]]:
+        """
+        Get media items from Kodi database
+
+        If paging is enabled, the next page is requested only after the items
+        from the previous page have been consumed.
+
+        :raises: NoDataError when media items are not retrieved via JSON-RPC
+        """
+        for page in self.get_pages():
+            yield from page
+
+    def get_pages(self) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Get media items from Kodi database page by page
+
         :raises: NoDataError when media items are not retrieved via JSON-RPC
         """
+        if not self._page_size:
+            yield self.parse_media_items(self.send_json_rpc())
+            return
+        start = 0
+        while True:
+            self._limits = {'start': start, 'end': start + self._page_size}
+            json_reply = self.send_json_rpc()
+            page = self.parse_media_items(json_reply)
+            yield page
+            start += len(page)
+            total = json_reply['result'].get('limits', {}).get('total', 0)
+            if not page or start >= total:
+                break
+
+    def parse_media_items(self, json_reply: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Get the list of media items from a JSON-RPC reply
+
+        :raises: NoDataError when media items are not present in the reply
+        """
         try:
-            return self.send_json_rpc()['result'][self._content]
+            result = json_reply['result']
+            if result.get('limits', {}).get('total') == 0:
+                # Kodi omits the list of items if there is nothing to return
+                return result.get(self._content, [])
+            return result[self._content]
         except KeyError as exc:
             raise NoDataError(
                 f'Unable to retrieve {self._content} from remote media library') from exc
 
 
+class MediaItemsCounter(BaseJsonRpcApi):
+    """Retrieves the total number of media items without their details"""
+
+    def __init__(self, retriever_class: Type[BaseMediaItemsRetriever],
+                 tvshowid: Optional[int] = None, season: Optional[int] = None):
+        self.method = retriever_class.method
+        self._tvshowid = tvshowid
+        self._season = season
+        self._filter = retriever_class.count_filter
+
+    def get_params(self) -> Dict[str, Any]:
+        params = {'limits': {'start': 0, 'end': 1}}
+        if self._tvshowid is not None:
+            params['tvshowid'] = self._tvshowid
+        if self._season is not None:
+            params['season'] = self._season
+        if self._filter is not None:
+            params['filter'] = self._filter
+        return params
+
+    @staticmethod
+    def parse_count(json_reply: Dict[str, Any]) -> int:
+        """
+        Get the total number of media items from a JSON-RPC reply
+
+        :raises: NoDataError when the number of items is not present in the reply
+        """
+        try:
+            return json_reply['result']['limits']['total']
+        except KeyError as exc:
+            raise NoDataError('Unable to retrieve the number of media items') from exc
+
+
 class GetMovies(BaseMediaItemsRetriever):
     method = 'VideoLibrary.GetMovies'
     properties = [
@@ -122,13 +508,30 @@ class GetMovies(BaseMediaItemsRetriever):
         'dateadded',
         'art',
         'premiered',
+        'lastplayed',
+    ]
+    lean_properties = [
+        'title',
+        'genre',
+        'year',
+        'rating',
+        'playcount',
+        'file',
+        'sorttitle',
+        'resume',
+        'dateadded',
+        'lastplayed',
+        'art',
+        'premiered',
     ]
     sort = {'order': 'ascending', 'method': 'label'}
+    delta_sync_fields = ('dateadded', 'lastplayed')
 
 
 class GetRecentlyAddedMovies(GetMovies):
     method = 'VideoLibrary.GetRecentlyAddedMovies'
     sort = {'order': 'descending', 'method': 'dateadded'}
+    delta_sync_fields = ()
 
 
 class GetTVShows(BaseMediaItemsRetriever):
@@ -158,8 +561,12 @@ class GetTVShows(BaseMediaItemsRetriever):
         'ratings',
         'runtime',
         'uniqueid',
+        'lastplayed',
     ]
     sort = {'order': 'ascending', 'method': 'label'}
+    delta_sync_fields = ('dateadded', 'lastplayed')
+    # TV shows without episodes are not shown in the list of TV shows
+    count_filter = {'field': 'numepisodes', 'operator': 'greaterthan', 'value': '0'}
 
 
 class GetSeasons(BaseMediaItemsRetriever):
@@ -205,13 +612,35 @@ class GetEpisodes(BaseMediaItemsRetriever):
         'specialsortseason',
         'specialsortepisode',
         'seasonid',
+        'lastplayed',
+    ]
+    lean_properties = [
+        'title',
+        'rating',
+        'firstaired',
+        'playcount',
+        'runtime',
+        'season',
+        'episode',
+        'showtitle',
+        'file',
+        'resume',
+        'tvshowid',
+        'dateadded',
+        'lastplayed',
+        'art',
+        'specialsortseason',
+        'specialsortepisode',
+        'seasonid',
     ]
     sort = {'order': 'ascending', 'method': 'label'}
+    delta_sync_fields = ('dateadded', 'lastplayed')
 
 
 class GetRecentlyAddedEpisodes(GetEpisodes):
     method = 'VideoLibrary.GetRecentlyAddedEpisodes'
     sort = {'order': 'descending', 'method': 'dateadded'}
+    delta_sync_fields = ()
 
 
 class GetMusicVideos(BaseMediaItemsRetriever):
@@ -237,20 +666,74 @@ class GetMusicVideos(BaseMediaItemsRetriever):
             'rating',
             'premiered',
         ]
+    lean_properties = [
+        'title',
+        'playcount',
+        'runtime',
+        'year',
+        'album',
+        'artist',
+        'track',
+        'lastplayed',
+        'file',
+        'resume',
+        'dateadded',
+        'art',
+        'premiered',
+    ]
     sort = {'order': 'ascending', 'method': 'label'}
+    delta_sync_fields = ('dateadded', 'lastplayed')
 
 
 class GetRecentlyAddedMusicVideos(GetMusicVideos):
     method = 'VideoLibrary.GetRecentlyAddedMusicVideos'
     sort = {'order': 'descending', 'method': 'dateadded'}
+    delta_sync_fields = ()
+
+
+class GetMovieDetails(BaseJsonRpcApi):
+    method = 'VideoLibrary.GetMovieDetails'
+    item_id_param = 'movieid'
+    details_key = 'moviedetails'
+
+    def __init__(self, item_id: int, properties: List[str]):
+        self._item_id = item_id
+        self._properties = properties
+
+    def get_params(self) -> Dict[str, Any]:
+        return {self.item_id_param: self._item_id, 'properties': self._properties}
+
+    def parse_details(self, json_reply: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Get media item details from a JSON-RPC reply
+
+        :raises: NoDataError when details are not present in the reply
+        """
+        try:
+            return json_reply['result'][self.details_key]
+        except KeyError as exc:
+            raise NoDataError(
+                f'Unable to retrieve {self.item_id_param} {self._item_id} details') from exc
+
+
+class GetEpisodeDetails(GetMovieDetails):
+    method = 'VideoLibrary.GetEpisodeDetails'
+    item_id_param = 'episodeid'
+    details_key = 'episodedetails'
+
+
+class GetMusicVideoDetails(GetMovieDetails):
+    method = 'VideoLibrary.GetMusicVideoDetails'
+    item_id_param = 'musicvideoid'
+    details_key = 'musicvideodetails'
 
 
 class SetMovieDetails(BaseJsonRpcApi):
     method = 'VideoLibrary.SetMovieDetails'
 
-    def __init__(self):
+    def __init__(self, **kwargs):
         super().__init__()
-        self._params = None
+        self._params = kwargs or None
 
     def get_params(self) -> Dict[str, Any]:
         return self._params
@@ -264,16 +747,56 @@ class SetEpisodeDetails(SetMovieDetails):
     method = 'VideoLibrary.SetEpisodeDetails'
 
 
+class SetMusicVideoDetails(SetMovieDetails):
+    method = 'VideoLibrary.SetMusicVideoDetails'
+
+
 class VideoLibraryScan(BaseJsonRpcApi):
     method = 'VideoLibrary.Scan'
 
 
+class JsonRpcPing(BaseJsonRpcApi):
+    method = 'JSONRPC.Ping'
+
+
 SET_DETAILS_API_MAP = {
     'movieid': SetMovieDetails,
     'episodeid': SetEpisodeDetails,
+    'musicvideoid': SetMusicVideoDetails,
+}
+
+# Properties that are changed by playback and "Mark as watched/unwatched" commands
+WATCHED_STATE_PROPERTIES = ['playcount', 'resume', 'lastplayed']
+
+GET_DETAILS_API_MAP = {
+    'movieid': (GetMovieDetails, GetMovies.properties),
+    'episodeid': (GetEpisodeDetails, GetEpisodes.properties),
+    'musicvideoid': (GetMusicVideoDetails, GetMusicVideos.properties),
 }
 
 
+def get_details_batch(item_id_param: str, item_ids: Iterable[int],
+                      properties: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Get details of several media items in one request
+
+    :param item_id_param: item ID parameter name, e.g. "movieid"
+    :param item_ids: item IDs
+    :param properties: properties to retrieve. By default, full details are retrieved.
+    :return: the list of item details
+    :raises NoDataError: if unable to retrieve details
+    :raises RemoteKodiError: if unable to connect to remote Kodi
+    """
+    api_class, full_properties = GET_DETAILS_API_MAP[item_id_param]
+    properties = properties or full_properties
+    batch = JsonRpcBatch()
+    apis = [api_class(item_id, properties) for item_id in item_ids]
+    for api in apis:
+        batch.add(api)
+    batch.send()
+    return [api.parse_details(batch.get_reply(index)) for index, api in enumerate(apis)]
+
+
 def update_playcount(item_id_param, item_id, playcount):
     api_class = SET_DETAILS_API_MAP[item_id_param]
     api = api_class()
@@ -289,3 +812,37 @@ def update_resume(item_id_param, item_id, position, total):
     api_class = SET_DETAILS_API_MAP[item_id_param]
     api = api_class()
     api.set_details(**{item_id_param: item_id, 'resume': {'position': position, 'total': total}})
+
+
+def update_details_batch(updates: Iterable[Dict[str, Any]]) -> List[Optional[NoDataError]]:
+    """
+    Send several media item details updates to remote Kodi in one request
+
+    :param updates: the list of details to set. Each item must contain
+        ``'item_id_param'`` key and an item ID, e.g.
+        ``{'item_id_param': 'movieid', 'movieid': 42, 'playcount': 1}``
+    :return: the list of errors for each update, ``None`` for successful updates.
+        Updates of unsupported media types are not sent and get an error.
+    :raises RemoteKodiError: if unable to connect to remote Kodi
+    :raises JsonRpcError: if remote Kodi has rejected the whole batch
+    """
+    updates = list(updates)
+    batch = JsonRpcBatch()
+    indexes: List[Optional[int]] = []
+    for update in updates:
+        details = update.copy()
+        api_class = SET_DETAILS_API_MAP.get(details.pop('item_id_param', None))
+        indexes.append(None if api_class is None else batch.add(api_class(**details)))
+    batch.send()
+    errors: List[Optional[NoDataError]] = []
+    for update, index in zip(updates, indexes):
+        if index is None:
+            errors.append(NoDataError(f'Unsupported details update: {update}'))
+            continue
+        try:
+            batch.get_reply(index)
+        except JsonRpcError as exc:
+            errors.append(exc)
+        else:
+            errors.append(None)
+    return errors
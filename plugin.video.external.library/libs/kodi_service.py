@@ -14,11 +14,11 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 """Classes and functions to interact with Kodi API"""
-import hashlib
 import json
 import logging
 import re
 from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional
 from urllib.parse import urlencode
 
 import xbmc
@@ -26,6 +26,7 @@ from xbmcaddon import Addon
 from xbmcvfs import translatePath
 
 from libs.exception_logger import format_trace, format_exception
+from libs.instrumentation import measure
 
 ADDON = Addon()
 ADDON_ID = ADDON.getAddonInfo('id')
@@ -39,6 +40,10 @@ ADDON_PROFILE_DIR = Path(translatePath(ADDON.getAddonInfo('profile')))
 PLUGIN_URL = f'plugin://{ADDON_ID}/'
 
 LOG_FORMAT = '[{addon_id} v.{addon_version}] {filename}:{lineno} - {message}'
+# "log_level" setting values
+LOG_LEVELS = [logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR]
+
+logger = logging.getLogger(__name__)
 
 
 class KodiLogHandler(logging.Handler):
@@ -74,6 +79,11 @@ class KodiLogHandler(logging.Handler):
 class GettextEmulator:
     """
     Emulate GNU Gettext by mapping resource.language.en_gb UI strings to their numeric string IDs
+
+    The mapping is loaded on the first lookup and is validated by the modification time
+    and the size of resource.language.en_gb strings.po file. Localized strings are memoized
+    per UI language, so they are retrieved from Kodi only once while the language invoker
+    is reused.
     """
     _instance = None
 
@@ -86,15 +96,30 @@ class GettextEmulator:
         return cls._instance
 
     def __init__(self):
+        if hasattr(self, '_localized_strings'):
+            return  # The singleton has already been initialized
         self._en_gb_string_po_path = (ADDON_DIR / 'resources' / 'language' /
                                       'resource.language.en_gb' / 'strings.po')
-        if not self._en_gb_string_po_path.exists():
-            raise self.LocalizationError(
-                'Missing resource.language.en_gb strings.po localization file')
-        if not ADDON_PROFILE_DIR.exists():
-            ADDON_PROFILE_DIR.mkdir()
         self._string_mapping_path = ADDON_PROFILE_DIR / 'strings-map.json'
-        self.strings_mapping = self._load_strings_mapping()
+        self._strings_mapping = None
+        self._localized_strings = {}
+
+    @property
+    def strings_mapping(self):
+        if self._strings_mapping is None:
+            self._strings_mapping = self._load_strings_mapping()
+        return self._strings_mapping
+
+    def _get_strings_po_stamp(self):
+        """
+        Get a stamp that changes when resource.language.en_gb strings.po file is updated
+        """
+        try:
+            stat = self._en_gb_string_po_path.stat()
+        except FileNotFoundError as exc:
+            raise self.LocalizationError(
+                'Missing resource.language.en_gb strings.po localization file') from exc
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
 
     def _load_strings_po(self):  # pylint: disable=missing-docstring
         with self._en_gb_string_po_path.open('r', encoding='utf-8') as fo:
@@ -109,19 +134,19 @@ class GettextEmulator:
 
         :return: UI strings mapping
         """
-        strings_po = self._load_strings_po()
-        strings_po_md5 = hashlib.md5(strings_po.encode('utf-8')).hexdigest()
+        strings_po_stamp = self._get_strings_po_stamp()
         try:
             with self._string_mapping_path.open('r', encoding='utf-8') as fo:
                 mapping = json.load(fo)
-            if mapping['md5'] != strings_po_md5:
+            if mapping.get('stamp') != strings_po_stamp:
                 raise IOError('resource.language.en_gb strings.po has been updated')
         except (IOError, ValueError):
-            strings_mapping = self._parse_strings_po(strings_po)
+            strings_mapping = self._parse_strings_po(self._load_strings_po())
             mapping = {
                 'strings': strings_mapping,
-                'md5': strings_po_md5,
+                'stamp': strings_po_stamp,
             }
+            ADDON_PROFILE_DIR.mkdir(parents=True, exist_ok=True)
             with self._string_mapping_path.open('w', encoding='utf-8') as fo:
                 json.dump(mapping, fo)
         return mapping['strings']
@@ -146,14 +171,41 @@ class GettextEmulator:
         :param en_string: resource.language.en_gb UI string
         :return: localized UI string
         """
-        emulator = cls()
+        return cls().get_localized_string(en_string)
+
+    def get_localized_string(self, en_string: str) -> str:
+        """
+        Return a localized UI string by a resource.language.en_gb source string
+
+        :param en_string: resource.language.en_gb UI string
+        :return: localized UI string
+        """
+        localized_strings = self._localized_strings.setdefault(
+            xbmc.getLanguage(xbmc.ISO_639_1), {})
+        try:
+            return localized_strings[en_string]
+        except KeyError:
+            pass
         try:
-            string_id = emulator.strings_mapping[en_string]
+            string_id = self.strings_mapping[en_string]
         except KeyError as exc:
-            raise cls.LocalizationError(
+            raise self.LocalizationError(
                 f'Unable to find "{en_string}" string in resource.language.en_gb/strings.po'
             ) from exc
-        return ADDON.getLocalizedString(string_id)
+        localized_string = localized_strings[en_string] = ADDON.getLocalizedString(string_id)
+        return localized_string
+
+
+def get_log_level() -> int:
+    """Get the log level from the addon settings"""
+    try:
+        return LOG_LEVELS[ADDON_SETTINGS.get().log_level]
+    except (IndexError, TypeError):
+        return logging.INFO
+
+
+def update_log_level() -> None:
+    logging.getLogger().setLevel(get_log_level())
 
 
 def initialize_logging(extended_trace_info=True):
@@ -161,6 +213,7 @@ def initialize_logging(extended_trace_info=True):
     Initialize the root logger that writes to the Kodi log
 
     After initialization, you can use Python logging facilities as usual.
+    The log level is set in the addon settings.
 
     :param extended_trace_info: write extended trace info when exc_info=True
         or stack_info=True parameters are passed to logging methods.
@@ -171,23 +224,131 @@ def initialize_logging(extended_trace_info=True):
     logging.basicConfig(
         format=LOG_FORMAT,
         style='{',
-        level=logging.DEBUG,
+        level=get_log_level(),
         handlers=[handler],
         force=True
     )
 
 
+class Settings(NamedTuple):
+    """
+    A snapshot of the addon settings
+
+    Field names are setting IDs and field types define how settings are read.
+    """
+    kodi_host: str
+    kodi_port: int
+    use_https: bool
+    remote_notifications: bool
+    kodi_tcp_port: int
+    kodi_login: str
+    kodi_password: str
+    show_movies: bool
+    show_recent_movies: bool
+    show_tvshows: bool
+    show_recent_episodes: bool
+    flatten_seasons: int
+    show_music_videos: bool
+    show_recent_music_videos: bool
+    show_item_counts: bool
+    files_on_shares: bool
+    playtime_to_skip: int
+    watched_threshold_percent: int
+    page_size: int
+    cache_ttl: int
+    recent_cache_ttl: int
+    delta_sync: bool
+    movies_listing_profile: int
+    episodes_listing_profile: int
+    musicvideos_listing_profile: int
+    lean_listing_threshold: int
+    background_details_fill: bool
+    max_cast_members: int
+    fetch_daemon: bool
+    log_level: int
+    collect_stats: bool
+
+    @classmethod
+    def load(cls) -> 'Settings':
+        getters = {
+            str: ADDON.getSettingString,
+            int: ADDON.getSettingInt,
+            bool: ADDON.getSettingBool,
+        }
+        return cls(*(getters[setting_type](setting_id)
+                     for setting_id, setting_type in cls.__annotations__.items()))
+
+
+class AddonSettings:
+    """
+    Provides a snapshot of the addon settings
+
+    Reading settings through the Kodi addon API is relatively slow, so settings
+    are read once and the snapshot is reused until settings.xml in the addon
+    profile directory is changed or :meth:`refresh` is called, e.g. from
+    ``xbmc.Monitor.onSettingsChanged``. Listeners are called when settings
+    have been changed, so values computed from settings can be updated.
+    """
+
+    def __init__(self):
+        self._settings_path = ADDON_PROFILE_DIR / 'settings.xml'
+        self._settings: Optional[Settings] = None
+        self._stamp: Optional[str] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    def _get_stamp(self) -> Optional[str]:
+        try:
+            stat = self._settings_path.stat()
+        except OSError:
+            return None  # Default settings are used
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    def get(self) -> Settings:
+        """Get the current settings snapshot"""
+        stamp = self._get_stamp()
+        if self._settings is None or stamp != self._stamp:
+            self._refresh(stamp)
+        return self._settings
+
+    def refresh(self) -> Settings:
+        """Read settings again"""
+        self._refresh(self._get_stamp())
+        return self._settings
+
+    def _refresh(self, stamp: Optional[str]) -> None:
+        old_settings = self._settings
+        with measure('settings_load'):
+            self._settings = Settings.load()
+        self._stamp = stamp
+        if old_settings is not None and self._settings != old_settings:
+            logger.debug('Addon settings have been changed')
+            for listener in self._listeners:
+                listener()
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Add a callable that is called without arguments when settings have been changed
+        """
+        self._listeners.append(listener)
+
+
+ADDON_SETTINGS = AddonSettings()
+
+
 def get_plugin_url(**kwargs):
     return f'{PLUGIN_URL}?{urlencode(kwargs)}'
 
 
 def get_remote_kodi_url(with_credentials=False):
-    host = ADDON.getSetting('kodi_host')
-    port = ADDON.getSetting('kodi_port')
-    login = ADDON.getSetting('kodi_login')
-    password = ADDON.getSetting('kodi_password')
-    use_https = ADDON.getSettingBool('use_https')
-    protocol = 'https' if use_https else 'http'
+    settings = ADDON_SETTINGS.get()
+    host = settings.kodi_host
+    port = settings.kodi_port
+    login = settings.kodi_login
+    password = settings.kodi_password
+    protocol = 'https' if settings.use_https else 'http'
     if not with_credentials or not login:
         return f'{protocol}://{host}:{port}'
     return f'{protocol}://{login}:{password}@{host}:{port}'
+
+
+ADDON_SETTINGS.add_listener(update_log_level)
@@ -0,0 +1,416 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Persistent on-disk cache for media items retrieved from the remote Kodi library"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from libs.instrumentation import count
+from libs.kodi_service import ADDON_PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Increment this when the schema changes. The cache is re-created on version mismatch.
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+DROP TABLE IF EXISTS listings;
+DROP TABLE IF EXISTS listing_items;
+CREATE TABLE listings (
+    cache_key TEXT PRIMARY KEY,
+    server TEXT NOT NULL,
+    handler TEXT NOT NULL,
+    mediatype TEXT NOT NULL,
+    tvshowid INTEGER,
+    season INTEGER,
+    updated_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL,
+    watermark TEXT NOT NULL DEFAULT '',
+    is_complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE listing_items (
+    cache_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    item_id INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (cache_key, position)
+);
+CREATE INDEX listing_items_item_id ON listing_items (item_id);
+"""
+
+# How many items are written to the database at once
+WRITE_CHUNK_SIZE = 250
+
+
+class ListingKey(NamedTuple):
+    """Identifies a list of media items in the cache"""
+    server: str
+    handler: str
+    mediatype: str
+    tvshowid: Optional[int]
+    season: Optional[int]
+    properties: Tuple[str, ...]
+
+    @property
+    def cache_key(self) -> str:
+        properties_hash = hashlib.md5(','.join(self.properties).encode('utf-8')).hexdigest()
+        return (f'{self.server}/{self.handler}/{self.tvshowid}/{self.season}/'
+                f'{properties_hash[:12]}')
+
+
+class SyncState(NamedTuple):
+    """The state of a cached listing for incremental updates"""
+    watermark: str
+    full_synced_at: float
+
+
+class LibraryCache:
+    """
+    Stores lists of media items in an SQLite database in the addon profile directory
+
+    The cache is shared between the plugin and the service and survives Kodi restarts.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self._db_path = db_path or ADDON_PROFILE_DIR / 'library-cache.sqlite3'
+        self._is_initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._is_initialized:
+            self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Listing generators may be resumed by another thread when they are shared
+        # between concurrent requests, but a connection is never used concurrently.
+        connection = sqlite3.connect(str(self._db_path), timeout=10.0, check_same_thread=False)
+        if not self._is_initialized:
+            connection.execute('PRAGMA journal_mode=WAL')
+            if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                connection.executescript(SCHEMA)
+                connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._is_initialized = True
+        return connection
+
+    def get_listing(self, key: ListingKey, ttl: float) -> Optional[Iterator[Dict[str, Any]]]:
+        """
+        Get cached media items
+
+        :param key: listing key
+        :param ttl: cache time-to-live in seconds
+        :return: an iterator over cached media items or ``None``
+            if the listing is not cached or has expired
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT updated_at FROM listings WHERE cache_key = ? AND is_complete = 1',
+                (key.cache_key,)
+            ).fetchone()
+        if row is None or time.time() - row[0] > ttl:
+            count('cache_misses')
+            return None
+        count('cache_hits')
+        logger.debug('Using cached %s', key)
+        return self._iter_items(key.cache_key)
+
+    def _iter_items(self, cache_key: str) -> Iterator[Dict[str, Any]]:
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                'SELECT data FROM listing_items WHERE cache_key = ? ORDER BY position',
+                (cache_key,)
+            )
+            for (data,) in cursor:
+                yield json.loads(data)
+
+    def store_listing(self, key: ListingKey, media_items: Iterable[Dict[str, Any]],
+                      watermark_fields: Tuple[str, ...] = ()) -> Iterator[Dict[str, Any]]:
+        """
+        Store media items in the cache while passing them through
+
+        Items are written under a staging key and replace the previous listing
+        in one transaction after all items have been consumed, so a partially
+        retrieved listing is never used, and the previous listing can still be
+        shown if the remote Kodi fails in the middle of a listing. A listing that
+        has been invalidated while it was being retrieved is not stored.
+
+        :param key: listing key
+        :param media_items: media items retrieved from the remote Kodi
+        :param watermark_fields: date fields of media items, the latest value of which
+            is stored as a watermark for incremental updates
+        :return: an iterator over the same media items
+        """
+        cache_key = key.cache_key
+        # A unique key, so concurrent retrievals of the same listing do not mix their items
+        staging_key = f'{cache_key}#{uuid.uuid4().hex}'
+        item_id_param = f'{key.mediatype}id'
+        watermark = ''
+        is_stored = False
+        with closing(self._connect()) as connection:
+            try:
+                with connection:
+                    now = time.time()
+                    connection.execute(
+                        'INSERT INTO listings (cache_key, server, handler, mediatype, tvshowid, '
+                        'season, updated_at, full_synced_at, is_complete) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)',
+                        (staging_key, key.server, key.handler, key.mediatype, key.tvshowid,
+                         key.season, now, now)
+                    )
+                rows = []
+                for position, media_item in enumerate(media_items):
+                    rows.append((staging_key, position, media_item.get(item_id_param),
+                                 json.dumps(media_item)))
+                    if len(rows) >= WRITE_CHUNK_SIZE:
+                        with connection:
+                            self._write_rows(connection, rows)
+                        rows = []
+                    for field in watermark_fields:
+                        watermark = max(watermark, media_item.get(field) or '')
+                    yield media_item
+                with connection:
+                    if connection.execute('SELECT 1 FROM listings WHERE cache_key = ?',
+                                          (staging_key,)).fetchone() is None:
+                        logger.debug('%s has been invalidated while it was being retrieved', key)
+                        return
+                    self._write_rows(connection, rows)
+                    connection.execute('DELETE FROM listing_items WHERE cache_key = ?',
+                                       (cache_key,))
+                    connection.execute('UPDATE listing_items SET cache_key = ? WHERE cache_key = ?',
+                                       (cache_key, staging_key))
+                    connection.execute('DELETE FROM listings WHERE cache_key = ?', (cache_key,))
+                    connection.execute(
+                        'UPDATE listings SET cache_key = ?, updated_at = ?, watermark = ?, '
+                        'is_complete = 1 WHERE cache_key = ?',
+                        (cache_key, time.time(), watermark, staging_key)
+                    )
+                is_stored = True
+            finally:
+                if not is_stored:
+                    with connection:
+                        connection.execute('DELETE FROM listing_items WHERE cache_key = ?',
+                                           (staging_key,))
+                        connection.execute('DELETE FROM listings WHERE cache_key = ?',
+                                           (staging_key,))
+        logger.debug('Stored %s in the cache', key)
+
+    def get_listing_size(self, server: str, handler: str, tvshowid: Optional[int],
+                         season: Optional[int]) -> Optional[int]:
+        """
+        Get the number of items in the most recent cached listing
+        of a content handler, regardless of its properties
+
+        :return: the number of items or ``None`` if the listing has never been cached
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT COUNT(listing_items.position) FROM listings '
+                'JOIN listing_items ON listing_items.cache_key = listings.cache_key '
+                'WHERE server = ? AND handler = ? AND tvshowid IS ? AND season IS ? '
+                'AND is_complete = 1 '
+                'GROUP BY listings.cache_key ORDER BY updated_at DESC LIMIT 1',
+                (server, handler, tvshowid, season)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def get_sync_state(self, key: ListingKey) -> Optional[SyncState]:
+        """
+        Get the state of a cached listing for incremental updates
+
+        :param key: listing key
+        :return: sync state or ``None`` if the listing is not cached
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT watermark, full_synced_at FROM listings '
+                'WHERE cache_key = ? AND is_complete = 1',
+                (key.cache_key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return SyncState(*row)
+
+    def get_item_ids(self, key: ListingKey) -> Set[int]:
+        """
+        Get IDs of media items in a cached listing
+
+        :param key: listing key
+        """
+        with closing(self._connect()) as connection:
+            return {row[0] for row in connection.execute(
+                'SELECT item_id FROM listing_items WHERE cache_key = ?', (key.cache_key,)
+            )}
+
+    def merge_listing(self, key: ListingKey, changed_items: List[Dict[str, Any]],
+                      item_ids: Set[int], watermark_fields: Tuple[str, ...] = ()) -> None:
+        """
+        Merge changes from the remote library into a cached listing
+
+        :param key: listing key
+        :param changed_items: media items added or modified since the last sync
+        :param item_ids: IDs of all media items currently present in the remote listing.
+            Cached items with other IDs are removed.
+        :param watermark_fields: see :meth:`store_listing`
+        """
+        cache_key = key.cache_key
+        item_id_param = f'{key.mediatype}id'
+        with closing(self._connect()) as connection:
+            with connection:
+                watermark, = connection.execute(
+                    'SELECT watermark FROM listings WHERE cache_key = ?', (cache_key,)
+                ).fetchone()
+                positions = dict(connection.execute(
+                    'SELECT item_id, position FROM listing_items WHERE cache_key = ?',
+                    (cache_key,)
+                ))
+                removed_ids = [(cache_key, item_id) for item_id in positions
+                               if item_id not in item_ids]
+                connection.executemany(
+                    'DELETE FROM listing_items WHERE cache_key = ? AND item_id = ?', removed_ids
+                )
+                # New items are appended to the end of the listing.
+                # Kodi sorts directory items by the first added sort method anyway.
+                next_position = max(positions.values(), default=-1) + 1
+                rows = []
+                for media_item in changed_items:
+                    item_id = media_item[item_id_param]
+                    if (position := positions.get(item_id)) is None:
+                        position = next_position
+                        next_position += 1
+                    rows.append((cache_key, position, item_id, json.dumps(media_item)))
+                    for field in watermark_fields:
+                        watermark = max(watermark, media_item.get(field) or '')
+                self._write_rows(connection, rows)
+                connection.execute(
+                    'UPDATE listings SET updated_at = ?, watermark = ? WHERE cache_key = ?',
+                    (time.time(), watermark, cache_key)
+                )
+        logger.debug('Merged %s changed and %s removed items into %s',
+                     len(changed_items), len(removed_ids), key)
+
+    @staticmethod
+    def _write_rows(connection: sqlite3.Connection, rows) -> None:
+        connection.executemany(
+            'INSERT OR REPLACE INTO listing_items (cache_key, position, item_id, data) '
+            'VALUES (?, ?, ?, ?)',
+            rows
+        )
+
+    def invalidate(self, mediatype: Optional[str] = None,
+                   tvshowid: Optional[int] = None) -> None:
+        """
+        Remove cached listings
+
+        :param mediatype: remove only listings of this mediatype
+        :param tvshowid: remove only listings of seasons or episodes of this TV show
+        """
+        conditions = []
+        params = []
+        if mediatype is not None:
+            conditions.append('mediatype = ?')
+            params.append(mediatype)
+        if tvshowid is not None:
+            conditions.append('tvshowid = ?')
+            params.append(tvshowid)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.execute(
+                    'DELETE FROM listing_items WHERE cache_key IN '
+                    f'(SELECT cache_key FROM listings{where})',
+                    params
+                )
+                connection.execute(f'DELETE FROM listings{where}', params)
+        logger.debug('Invalidated cached listings: mediatype=%s, tvshowid=%s',
+                     mediatype, tvshowid)
+
+    def invalidate_item(self, mediatype: str, item_id: int) -> None:
+        """
+        Remove cached listings that contain a media item
+
+        :param mediatype: item mediatype, e.g. "movie"
+        :param item_id: item ID in the remote Kodi library
+        """
+        with closing(self._connect()) as connection:
+            with connection:
+                cache_keys = [row[0] for row in connection.execute(
+                    'SELECT listing_items.cache_key FROM listing_items '
+                    'JOIN listings ON listings.cache_key = listing_items.cache_key '
+                    'WHERE listing_items.item_id = ? AND listings.mediatype = ?',
+                    (item_id, mediatype)
+                )]
+                for cache_key in cache_keys:
+                    connection.execute('DELETE FROM listing_items WHERE cache_key = ?',
+                                       (cache_key,))
+                    connection.execute('DELETE FROM listings WHERE cache_key = ?', (cache_key,))
+        logger.debug('Invalidated cached listings with %s %s', mediatype, item_id)
+
+    def invalidate_watched_state(self, item_id_param: str, item_id: int) -> None:
+        """
+        Remove cached listings affected by a playcount or resume point change
+
+        :param item_id_param: item ID parameter name, e.g. "movieid"
+        :param item_id: item ID in the remote Kodi library
+        """
+        mediatype = item_id_param[:-len('id')]
+        self.invalidate_item(mediatype, item_id)
+        if mediatype == 'episode':
+            # Watched episode counters of TV shows and seasons have changed
+            self.invalidate('tvshow')
+            self.invalidate('season')
+
+    def patch_item(self, item_id_param: str, item_id: int, details: Dict[str, Any]) -> bool:
+        """
+        Update details of a media item, e.g. a playcount or a resume point, in cached listings
+
+        Only properties that are present in cached items are updated,
+        so a listing is not re-fetched from the remote Kodi after a watched
+        status change or an edit of a single item.
+
+        :param item_id_param: item ID parameter name, e.g. "movieid"
+        :param item_id: item ID in the remote Kodi library
+        :param details: new item details, e.g. ``{'playcount': 1}``
+        :return: ``True`` if any cached item has been changed
+        """
+        mediatype = item_id_param[:-len('id')]
+        is_changed = False
+        with closing(self._connect()) as connection:
+            with connection:
+                rows = []
+                for cache_key, position, data in connection.execute(
+                        'SELECT listing_items.cache_key, position, data FROM listing_items '
+                        'JOIN listings ON listings.cache_key = listing_items.cache_key '
+                        'WHERE listing_items.item_id = ? AND listings.mediatype = ?',
+                        (item_id, mediatype)):
+                    media_item = json.loads(data)
+                    patch = {key: value for key, value in details.items()
+                             if key in media_item and media_item[key] != value}
+                    if patch:
+                        media_item.update(patch)
+                        rows.append((cache_key, position, item_id, json.dumps(media_item)))
+                self._write_rows(connection, rows)
+                is_changed = bool(rows)
+        if is_changed and mediatype == 'episode' and 'playcount' in details:
+            # Watched episode counters of TV shows and seasons may have changed
+            self.invalidate('tvshow')
+            self.invalidate('season')
+        logger.debug('Patched cached %s %s with %s: %s', mediatype, item_id, details, is_changed)
+        return is_changed
+
+
+LIBRARY_CACHE = LibraryCache()
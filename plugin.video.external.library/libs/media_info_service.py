@@ -16,73 +16,111 @@
 Classes and functions that process data from JSON-RPC API and assign them to ListItem instances
 """
 
-from typing import Dict, Any, List, Tuple, Type, Iterable, Union
+import functools
+from typing import Dict, Any, Callable, List, Tuple, Type, Iterable
 from urllib.parse import urljoin, quote
 
 import xbmc
 from xbmc import InfoTagVideo, Actor
 from xbmcgui import ListItem
 
-from libs.kodi_service import get_remote_kodi_url
+from libs.kodi_service import ADDON_SETTINGS, get_remote_kodi_url
 
-__all__ = ['set_info', 'set_art']
+__all__ = ['InfoTagFiller', 'get_info_tag_filler', 'set_info', 'set_art']
 
-REMOTE_KODI_URL = get_remote_kodi_url(with_credentials=True)
-IMAGE_URL = urljoin(REMOTE_KODI_URL, 'image')
 
-StreamDetailsType = Union[xbmc.VideoStreamDetail, xbmc.AudioStreamDetail, xbmc.SubtitleStreamDetail]
+@functools.lru_cache(maxsize=None)
+def get_image_url() -> str:
+    """Get the base URL of images on the remote Kodi. Settings are read on first use."""
+    return urljoin(get_remote_kodi_url(with_credentials=True), 'image')
 
 
 class SimpleMediaPropertySetter:
     """
     Sets a media property from a dictionary returned by JSON-RPC API to
     xbmc.InfoTagVideo class instance
-    """
 
-    def __init__(self, media_property: str, media_info: Dict[str, Any], info_tag_method: str):
-        self._property_value = media_info.get(media_property)
-        self._info_tag_method = info_tag_method
+    Setters are stateless: a property value and an unbound xbmc.InfoTagVideo method
+    are passed to their methods, so no objects are created for each media item.
+    """
 
-    def should_set(self) -> bool:
-        return bool(self._property_value)
+    @staticmethod
+    def should_set(property_value: Any) -> bool:
+        return bool(property_value)
 
-    def get_method_args(self) -> Iterable[Any]:
-        return (self._property_value,)
+    @staticmethod
+    def get_method_args(property_value: Any) -> Iterable[Any]:
+        return (property_value,)
 
-    def set_info_tag_property(self, info_tag: InfoTagVideo) -> None:
-        args = self.get_method_args()
-        method = getattr(info_tag, self._info_tag_method)
-        method(*args)
+    @classmethod
+    def set_info_tag_property(cls, info_tag_method: Callable[..., None],
+                              info_tag: InfoTagVideo, property_value: Any) -> None:
+        info_tag_method(info_tag, *cls.get_method_args(property_value))
 
 
 class NotNoneValueSetter(SimpleMediaPropertySetter):
 
-    def should_set(self) -> bool:
-        return self._property_value is not None
+    @staticmethod
+    def should_set(property_value: Any) -> bool:
+        return property_value is not None
+
+
+# The same actors appear in many movies and in every episode of a TV show
+ACTORS_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=ACTORS_CACHE_SIZE)
+def get_thumbnail_url(raw_url: str) -> str:
+    return f'{get_image_url()}/{quote(raw_url)}' if raw_url else ''
+
+
+@functools.lru_cache(maxsize=ACTORS_CACHE_SIZE)
+def get_actor(name: str, role: str, order: int, thumbnail: str) -> Actor:
+    """
+    Get an interned Actor instance
+
+    Actor info is copied to a ListItem by InfoTagVideo.setCast,
+    so the same instance can be shared between ListItems.
+    """
+    return Actor(name=name, role=role, order=order, thumbnail=get_thumbnail_url(thumbnail))
+
+
+def clear_url_caches() -> None:
+    """Clear cached values that contain the remote Kodi URL"""
+    get_image_url.cache_clear()
+    get_thumbnail_url.cache_clear()
+    get_actor.cache_clear()
+
+
+ADDON_SETTINGS.add_listener(clear_url_caches)
 
 
 class CastSetter(SimpleMediaPropertySetter):
 
-    def get_method_args(self) -> Iterable[Any]:
-        actors = []
-        for actor_info in self._property_value:
-            actor_thumbnail = actor_info.get('thumbnail', '')
-            if actor_thumbnail:
-                actor_thumbnail = f'{IMAGE_URL}/{quote(actor_thumbnail)}'
-            actors.append(Actor(
-                name=actor_info.get('name', ''),
-                role=actor_info.get('role', ''),
-                order=actor_info.get('order') or -1,
-                thumbnail=actor_thumbnail
-            ))
+    @staticmethod
+    def get_method_args(property_value: Any) -> Iterable[Any]:
+        actors = [
+            get_actor(actor_info.get('name', ''),
+                      actor_info.get('role', ''),
+                      actor_info.get('order') or -1,
+                      actor_info.get('thumbnail', ''))
+            for actor_info in property_value
+        ]
         return (actors,)
 
+    @classmethod
+    def set_limited_cast(cls, max_cast_members: int, info_tag_method: Callable[..., None],
+                         info_tag: InfoTagVideo, property_value: Any) -> None:
+        """Set only the first max_cast_members cast members"""
+        cls.set_info_tag_property(info_tag_method, info_tag, property_value[:max_cast_members])
+
 
 class ResumePointSetter(SimpleMediaPropertySetter):
 
-    def get_method_args(self) -> Iterable[Any]:
-        time = self._property_value.get('position', 0.0)
-        totaltime = self._property_value.get('total', 0.0)
+    @staticmethod
+    def get_method_args(property_value: Any) -> Iterable[Any]:
+        time = property_value.get('position', 0.0)
+        totaltime = property_value.get('total', 0.0)
         return time, totaltime
 
 
@@ -90,8 +128,9 @@ class VideoStreamSetter(SimpleMediaPropertySetter):
     stream_type = 'video'
     stream_type_class = xbmc.VideoStreamDetail
 
-    def should_set(self) -> bool:
-        return bool(self._property_value and self._property_value.get(self.stream_type))
+    @classmethod
+    def should_set(cls, property_value: Any) -> bool:  # pylint: disable=arguments-differ
+        return bool(property_value and property_value.get(cls.stream_type))
 
     @staticmethod
     def get_stream_type_args(stream_dict: Dict[str, Any]) -> Iterable[Any,]:
@@ -106,22 +145,12 @@ class VideoStreamSetter(SimpleMediaPropertySetter):
             stream_dict['hdrtype'],
         )
 
-    def _get_stream_type_object(self, stream_dict) -> StreamDetailsType:
-        args = self.get_stream_type_args(stream_dict)
-        return self.stream_type_class(*args)
-
-    def get_method_args(self) -> Iterable[Any]:
-        args_list = []
-        for stream_dict in self._property_value[self.stream_type]:
-            stream_type_obj = self._get_stream_type_object(stream_dict)
-            args_list.append(stream_type_obj)
-        return args_list
-
-    def set_info_tag_property(self, info_tag: InfoTagVideo) -> None:
-        method = getattr(info_tag, self._info_tag_method)
-        args_list = self.get_method_args()
-        for arg in args_list:
-            method(arg)
+    @classmethod
+    def set_info_tag_property(cls, info_tag_method: Callable[..., None],
+                              info_tag: InfoTagVideo, property_value: Any) -> None:
+        for stream_dict in property_value[cls.stream_type]:
+            info_tag_method(info_tag,
+                            cls.stream_type_class(*cls.get_stream_type_args(stream_dict)))
 
 
 class AudioStreamSetter(VideoStreamSetter):
@@ -148,19 +177,22 @@ class SubtitleStreamSetter(VideoStreamSetter):
 
 class NonNegativeValueSetter(SimpleMediaPropertySetter):
 
-    def should_set(self) -> bool:
-        return self._property_value is not None and self._property_value >= 0
+    @staticmethod
+    def should_set(property_value: Any) -> bool:
+        return property_value is not None and property_value >= 0
 
 
 class IntAsStringValueSetter(SimpleMediaPropertySetter):
 
-    def should_set(self) -> bool:
-        return bool(self._property_value
-                    and self._property_value.isdigit()
-                    and int(self._property_value))
+    @staticmethod
+    def should_set(property_value: Any) -> bool:
+        return bool(property_value
+                    and property_value.isdigit()
+                    and int(property_value))
 
-    def get_method_args(self) -> Iterable[Any]:
-        return (int(self._property_value),)
+    @staticmethod
+    def get_method_args(property_value: Any) -> Iterable[Any]:
+        return (int(property_value),)
 
 
 # The list of 3 element tuples: (
@@ -205,14 +237,72 @@ MEDIA_PROPERTIES: List[Tuple[str, str, Type[SimpleMediaPropertySetter]]] = [
 ]
 
 
+# (media property name, should set a property value, set a property value to an info tag)
+InfoTagSetter = Tuple[str, Callable[[Any], bool], Callable[[InfoTagVideo, Any], None]]
+
+
+class InfoTagFiller:  # pylint: disable=too-few-public-methods
+    """
+    Fills xbmc.InfoTagVideo instances with media info of a specific mediatype
+
+    Only setters for media properties that are actually requested from the remote
+    Kodi are included, and they are prepared once for all items in a listing.
+
+    :param mediatype: Kodi mediatype, e.g. "movie"
+    :param properties: media properties as requested from JSON-RPC API
+    :param max_cast_members: if not 0, only this number of cast members is set
+    """
+
+    def __init__(self, mediatype: str, properties: Iterable[str], max_cast_members: int = 0):
+        self.mediatype = mediatype
+        requested_properties = set(properties)
+        setters: List[InfoTagSetter] = []
+        for media_property, info_tag_method, setter_class in MEDIA_PROPERTIES:
+            if media_property not in requested_properties:
+                continue
+            if (unbound_method := getattr(InfoTagVideo, info_tag_method, None)) is None:
+                # Not supported by this Kodi version
+                continue
+            if setter_class is SimpleMediaPropertySetter:
+                set_value = unbound_method
+            elif setter_class is CastSetter and max_cast_members:
+                set_value = functools.partial(CastSetter.set_limited_cast, max_cast_members,
+                                              unbound_method)
+            else:
+                set_value = functools.partial(setter_class.set_info_tag_property, unbound_method)
+            setters.append((media_property, setter_class.should_set, set_value))
+        self._setters = tuple(setters)
+
+    def fill(self, info_tag: InfoTagVideo, media_info: Dict[str, Any]) -> None:
+        info_tag.setMediaType(self.mediatype)
+        get_value = media_info.get
+        for media_property, should_set, set_value in self._setters:
+            property_value = get_value(media_property)
+            if should_set(property_value):
+                set_value(info_tag, property_value)
+
+
+@functools.lru_cache(maxsize=32)
+def get_info_tag_filler(mediatype: str, properties: Tuple[str, ...],
+                        max_cast_members: int = 0) -> InfoTagFiller:
+    """
+    Get a cached info tag filler for a mediatype and a set of media properties
+
+    :param mediatype: Kodi mediatype, e.g. "movie"
+    :param properties: media properties as requested from JSON-RPC API
+    :param max_cast_members: if not 0, only this number of cast members is set
+    """
+    return InfoTagFiller(mediatype, properties, max_cast_members)
+
+
+ALL_PROPERTIES = tuple(media_property for media_property, _, _ in MEDIA_PROPERTIES)
+
+
 def set_info(info_tag: InfoTagVideo, media_info: Dict[str, Any], mediatype: str) -> None:
-    info_tag.setMediaType(mediatype)
-    for media_property, info_tag_method, setter_class in MEDIA_PROPERTIES:
-        setter = setter_class(media_property, media_info, info_tag_method)
-        if setter.should_set():
-            setter.set_info_tag_property(info_tag)
+    get_info_tag_filler(mediatype, ALL_PROPERTIES).fill(info_tag, media_info)
 
 
 def set_art(list_item: ListItem, raw_art: Dict[str, str]) -> None:
-    art = {art_type: f'{IMAGE_URL}/{quote(raw_url)}' for art_type, raw_url in raw_art.items()}
+    image_url = get_image_url()
+    art = {art_type: f'{image_url}/{quote(raw_url)}' for art_type, raw_url in raw_art.items()}
     list_item.setArt(art)
@@ -18,6 +18,8 @@ import json
 
 import xbmcgui
 
+from libs.instrumentation import count, measure
+
 
 class MemStorage:
     """
@@ -30,17 +32,23 @@ class MemStorage:
 
     def __getitem__(self, key):
         try:
-            json_string = self._window.getProperty(key)
-            return json.loads(json_string)
+            with measure('mem_storage_read'):
+                json_string = self._window.getProperty(key)
+                return json.loads(json_string)
         except ValueError as exc:
             raise KeyError(f'Item "{key}" cannot be retrieved from MemStorage') from exc
 
     def __setitem__(self, key, value):
-        try:
-            json_string = json.dumps(value)
-        except (TypeError, ValueError) as exc:
-            raise ValueError(f'Item {key}:{value} cannot be stored in MemStorage') from exc
-        self._window.setProperty(key, json_string)
+        with measure('mem_storage_write'):
+            try:
+                json_string = json.dumps(value)
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f'Item {key}:{value} cannot be stored in MemStorage') from exc
+            self._window.setProperty(key, json_string)
+        count('mem_storage_bytes_written', len(json_string))
+
+    def __delitem__(self, key):
+        self._window.clearProperty(key)
 
     def get(self, key, default=None):
         try:
@@ -16,109 +16,239 @@
 """Playback progress monitor"""
 
 import logging
-from urllib.parse import quote
+import threading
+from time import monotonic
+from typing import NamedTuple
 
 import xbmc
 
-from libs import json_rpc_api
-from libs.kodi_service import ADDON, ADDON_ID
-from libs.mem_storage import MemStorage
+from libs.instrumentation import discard_record, finish_record, measure, start_record
+from libs.kodi_service import ADDON_PROFILE_DIR, ADDON_SETTINGS, Settings
+from libs.playback_map import PlaybackMap
 
 logger = logging.getLogger(__name__)
 
 
+class PlaybackPosition(NamedTuple):
+    """A playback position sample. Times are in seconds, -1.0 if unknown."""
+    current_time: float = -1.0
+    total_time: float = -1.0
+    # Monotonic clock time of the sample
+    sampled_at: float = 0.0
+
+
+class PlaybackSampler(threading.Thread):
+    """
+    Samples the playback position of a file from an external library
+
+    The sampling interval adapts to the playback position: it is shorter near
+    the watched threshold and the end of a file, when the final state matters,
+    and longer elsewhere. The position between samples is extrapolated
+    using a monotonic clock.
+    """
+    min_interval = 1.0
+    max_interval = 10.0
+
+    def __init__(self, player: xbmc.Player, settings: Settings):
+        super().__init__(name='PlaybackSampler', daemon=True)
+        self._player = player
+        self._watched_threshold = settings.watched_threshold_percent / 100
+        # Replaced as a whole, so the monitor thread never sees a half-updated sample
+        self._position = PlaybackPosition()
+        self.is_paused = False
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    @property
+    def current_time(self) -> float:
+        return self._position.current_time
+
+    @property
+    def total_time(self) -> float:
+        return self._position.total_time
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if not self.is_paused:
+                self.sample()
+            self._wake_event.wait(self._get_interval())
+            self._wake_event.clear()
+
+    def sample(self):
+        try:
+            current_time = self._player.getTime()
+        except Exception:
+            current_time = -1.0
+        total_time = self.total_time
+        if total_time <= 0:
+            try:
+                total_time = self._player.getTotalTime()
+            except Exception:
+                total_time = -1.0
+        self._position = PlaybackPosition(current_time, total_time, monotonic())
+
+    def _get_interval(self) -> float:
+        if self.is_paused:
+            return self.max_interval
+        if self.current_time < 0 or self.total_time <= 0:
+            return self.min_interval
+        watched_at = self.total_time * self._watched_threshold
+        remaining_times = [point - self.current_time for point in (watched_at, self.total_time)
+                           if point > self.current_time]
+        if not remaining_times:
+            return self.max_interval
+        return max(self.min_interval, min(self.max_interval, min(remaining_times) / 2))
+
+    def wake(self):
+        """Take a sample immediately, e.g. after seeking"""
+        self._wake_event.set()
+
+    def pause(self):
+        self.sample()
+        self.is_paused = True
+
+    def resume(self):
+        self.is_paused = False
+        self.wake()
+
+    def stop(self, is_ended=False):
+        """
+        Stop sampling and extrapolate the final playback position
+
+        :param is_ended: ``True`` if a file has been played to the end
+        """
+        self._stop_event.set()
+        self.wake()
+        self.join()
+        position = self._position
+        if is_ended and position.total_time > 0:
+            current_time = position.total_time
+        elif not self.is_paused and position.current_time >= 0:
+            current_time = position.current_time + monotonic() - position.sampled_at
+            if position.total_time > 0:
+                current_time = min(current_time, position.total_time)
+        else:
+            return
+        self._position = position._replace(current_time=current_time)
+
+
 class PlayMonitor(xbmc.Player):
     """
     Monitors playback status and updates watches status
     for an episode or a movie from an external library
+
+    The playback position is sampled only while a file from the external library
+    is being played. Watched status updates are sent to the remote Kodi
+    by the write-behind queue, so stopping playback is not delayed by the network.
+    If statistics collection is enabled, playback map lookups and watched status
+    writes of each played file are saved as a "playback" invocation record.
+
+    :param write_queue: the write-behind queue for watched status updates
     """
-    def __init__(self):
+    def __init__(self, write_queue):
         super().__init__()
-        self._mem_storage = MemStorage()
+        self._write_queue = write_queue
+        self._playback_map = PlaybackMap()
         self._clear_state()
 
     def _clear_state(self):
-        self.is_monitoring = False
-        self._current_time = -1
-        self._total_time = -1
+        self._settings = None
+        self._sampler = None
         self._playing_file = None
         self._item_info = None
 
     def onPlayBackStarted(self):
+        if self._sampler is not None:
+            # Another file has been started without stopping the previous one
+            self._stop_monitoring(is_ended=False)
         self._playing_file = self.getPlayingFile()
+        # Settings are refreshed by the service monitor when they are changed
+        settings = ADDON_SETTINGS.get()
+        if settings.collect_stats:
+            start_record('playback')
         self._item_info = self._get_item_info()
         if self._item_info is None:
+            discard_record()
             self._clear_state()
             return
-        self.is_monitoring = True
-        try:
-            self._total_time = self.getTotalTime()
-        except Exception:
-            self._total_time = -1
+        self._settings = settings
+        self._sampler = PlaybackSampler(self, self._settings)
+        self._sampler.start()
         logger.debug('Started monitoring %s', self._playing_file)
 
     def onPlayBackStopped(self):
-        self._send_played_file_state(refresh_list=True)
-        logger.debug('Stopped monitoring %s. Playback stopped.', self._playing_file)
-        self._clear_state()
+        if self._sampler is not None:
+            self._stop_monitoring(is_ended=False)
+            logger.debug('Stopped monitoring %s. Playback stopped.', self._playing_file)
+            self._clear_state()
 
     def onPlayBackEnded(self):
-        self._send_played_file_state(refresh_list=True)
-        logger.debug('Stopped monitoring %s. Playback ended.', self._playing_file)
-        self._clear_state()
+        if self._sampler is not None:
+            self._stop_monitoring(is_ended=True)
+            logger.debug('Stopped monitoring %s. Playback ended.', self._playing_file)
+            self._clear_state()
 
     def onPlayBackPaused(self):
-        if self._should_send_resume():
-            self._send_resume()
-        logger.debug('Paused monitoring %s', self._playing_file)
-
-    def update_time(self):
-        try:
-            self._current_time = self.getTime()
-        except Exception:
-            self._current_time = -1
-        if self._total_time <= 0:
-            try:
-                self._total_time = self.getTotalTime()
-            except Exception:
-                self._total_time = -1
+        if self._sampler is not None:
+            self._sampler.pause()
+            if self._should_send_resume():
+                with measure('watched_state_write'):
+                    self._send_resume()
+            logger.debug('Paused monitoring %s', self._playing_file)
+
+    def onPlayBackResumed(self):
+        if self._sampler is not None:
+            self._sampler.resume()
+
+    def onPlayBackSeek(self, time, seekOffset):
+        if self._sampler is not None:
+            self._sampler.wake()
+
+    def onPlayBackSpeedChanged(self, speed):
+        if self._sampler is not None:
+            self._sampler.wake()
+
+    def _stop_monitoring(self, is_ended):
+        self._sampler.stop(is_ended)
+        with measure('watched_state_write'):
+            self._send_played_file_state()
+        finish_record(ADDON_PROFILE_DIR)
 
     def _get_item_info(self):
-        if listing := self._mem_storage.get(f'__{ADDON_ID}_media_list__'):
-            files_on_shares = ADDON.getSettingBool('files_on_shares')
-            for item in listing:
-                if files_on_shares and item['file'] == self._playing_file:
-                    return item
-                if quote(item['file']) in self._playing_file:
-                    return item
-        return None
+        with measure('playback_map_lookup'):
+            return self._playback_map.get(self._playing_file)
 
     def _should_send_playcount(self):
-        watched_threshold = ADDON.getSettingInt('watched_threshold_percent') / 100
-        return (self._current_time != -1 and self._total_time > 0
-                and (self._current_time / self._total_time) >= watched_threshold)
+        watched_threshold = self._settings.watched_threshold_percent / 100
+        current_time = self._sampler.current_time
+        total_time = self._sampler.total_time
+        return (current_time != -1 and total_time > 0
+                and (current_time / total_time) >= watched_threshold)
 
     def _send_playcount(self):
         logger.debug('Updating playcount for %s %s', self._item_info, self._playing_file)
         item_id_param = self._item_info['item_id_param']
         new_playcount = self._item_info['playcount'] + 1
-        json_rpc_api.update_playcount(item_id_param, self._item_info[item_id_param], new_playcount)
+        self._write_queue.update_playcount(item_id_param, self._item_info[item_id_param],
+                                           new_playcount)
+        with measure('playback_map_write'):
+            self._playback_map.set_playcount(item_id_param, self._item_info[item_id_param],
+                                             new_playcount)
 
     def _should_send_resume(self):
-        return (self._current_time != -1
-                and self._total_time != -1
-                and self._current_time > ADDON.getSettingInt('playtime_to_skip'))
+        return (self._sampler.current_time != -1
+                and self._sampler.total_time != -1
+                and self._sampler.current_time > self._settings.playtime_to_skip)
 
     def _send_resume(self):
         logger.debug('Updating resume for %s %s', self._item_info, self._playing_file)
         item_id_param = self._item_info['item_id_param']
-        json_rpc_api.update_resume(item_id_param, self._item_info[item_id_param],
-                                   self._current_time, self._total_time)
+        self._write_queue.update_resume(item_id_param, self._item_info[item_id_param],
+                                        self._sampler.current_time, self._sampler.total_time)
 
-    def _send_played_file_state(self, refresh_list=False):
+    def _send_played_file_state(self):
+        # The write-behind queue patches cached listings and refreshes the current one
         if self._should_send_playcount():
             self._send_playcount()
         elif self._should_send_resume():
             self._send_resume()
-        if refresh_list:
-            xbmc.executebuiltin('Container.Refresh')
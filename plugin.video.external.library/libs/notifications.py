@@ -0,0 +1,196 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Listener for library change notifications from the remote Kodi"""
+
+import codecs
+import json
+import logging
+import socket
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import xbmc
+
+from libs.exceptions import NoDataError, RemoteKodiError
+from libs.json_rpc_api import GET_DETAILS_API_MAP, get_details_batch
+from libs.kodi_service import PLUGIN_URL
+from libs.library_cache import LIBRARY_CACHE
+from libs.playback_map import PlaybackMap
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationListener(threading.Thread):
+    """
+    Receives notifications from the remote Kodi JSON-RPC TCP interface
+    and invalidates cached data affected by library changes
+
+    The listener reconnects automatically with exponential backoff
+    if the connection is lost or cannot be established.
+
+    :param host: remote Kodi host
+    :param port: remote Kodi JSON-RPC TCP port
+    :param on_connected: a callable that is called every time the connection
+        is established, that is, when the remote Kodi is online
+    """
+    connect_timeout = 10.0
+    initial_backoff = 1.0
+    max_backoff = 60.0
+    # How often the connection thread checks if it should stop
+    poll_interval = 1.0
+
+    def __init__(self, host: str, port: int,
+                 on_connected: Optional[Callable[[], None]] = None):
+        super().__init__(name='NotificationListener', daemon=True)
+        self.address = (host, port)
+        self._on_connected = on_connected
+        self._stop_event = threading.Event()
+        self._refresh_event = threading.Event()
+        self._is_scanning = False
+        self._playback_map = PlaybackMap()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        backoff = self.initial_backoff
+        while not self._stop_event.is_set():
+            try:
+                with socket.create_connection(self.address, self.connect_timeout) as sock:
+                    logger.debug('Connected to remote Kodi notifications at %s:%s',
+                                 *self.address)
+                    backoff = self.initial_backoff
+                    self._is_scanning = False
+                    if self._on_connected is not None:
+                        self._on_connected()
+                    self._receive(sock)
+            except (OSError, ValueError) as exc:
+                logger.debug('Remote Kodi notifications connection error: %s. '
+                             'Reconnecting in %s s.', exc, backoff)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        logger.debug('Stopped listening to remote Kodi notifications.')
+
+    def _receive(self, sock: socket.socket) -> None:
+        sock.settimeout(self.poll_interval)
+        decoder = json.JSONDecoder()
+        utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        buffer = ''
+        while not self._stop_event.is_set():
+            try:
+                chunk = sock.recv(65536)
+            except socket.timeout:
+                continue
+            if not chunk:
+                raise ConnectionError('connection closed by the remote host')
+            # The TCP interface sends JSON objects one after another without delimiters
+            buffer += utf8_decoder.decode(chunk)
+            while buffer := buffer.lstrip():
+                try:
+                    message, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    break  # An incomplete message
+                buffer = buffer[end:]
+                if isinstance(message, dict) and 'method' in message:
+                    self.handle_notification(message['method'],
+                                             message.get('params', {}).get('data'))
+            self.refresh_container()
+
+    def handle_notification(self, method: str, data: Optional[Dict[str, Any]]) -> None:
+        """
+        Invalidate cached data affected by a remote library change
+
+        :param method: notification method, e.g. "VideoLibrary.OnUpdate"
+        :param data: notification data
+        """
+        if method in ('VideoLibrary.OnScanStarted', 'VideoLibrary.OnCleanStarted'):
+            logger.debug('Remote notification: %s', method)
+            self._is_scanning = True
+        elif method in ('VideoLibrary.OnScanFinished', 'VideoLibrary.OnCleanFinished'):
+            logger.debug('Remote notification: %s', method)
+            self._is_scanning = False
+            LIBRARY_CACHE.invalidate()
+            self._refresh_event.set()
+        elif method == 'VideoLibrary.OnUpdate' and data:
+            item = data.get('item', {})
+            if 'type' in item and 'id' in item:
+                self._on_update(item['type'], item['id'], data)
+        elif method == 'VideoLibrary.OnRemove' and data:
+            if 'type' in data and 'id' in data:
+                self._on_remove(data['type'], data['id'])
+
+    def _on_update(self, mediatype: str, item_id: int, data: Dict[str, Any]) -> None:
+        logger.debug('Remote notification: %s %s updated', mediatype, item_id)
+        if data.get('added'):
+            LIBRARY_CACHE.invalidate(mediatype)
+            if mediatype == 'episode':
+                LIBRARY_CACHE.invalidate('tvshow')
+                LIBRARY_CACHE.invalidate('season')
+        elif 'playcount' in data:
+            self._playback_map.set_playcount(f'{mediatype}id', item_id, data['playcount'])
+            # Our own updates have already been patched into the cache
+            if not LIBRARY_CACHE.patch_item(f'{mediatype}id', item_id,
+                                            {'playcount': data['playcount']}):
+                return
+        elif self._is_scanning:
+            # All cached listings are invalidated when the scan is finished
+            return
+        elif not self._patch_item(mediatype, item_id):
+            return
+        self._refresh_event.set()
+
+    @staticmethod
+    def _patch_item(mediatype: str, item_id: int) -> bool:
+        """
+        Update a cached item with its current details from the remote library
+
+        A resume point change or an edit of a single item does not require
+        re-fetching whole listings. Echoes of our own updates, that have already
+        been patched into the cache, do not change anything.
+
+        :return: ``True`` if cached data have been changed
+        """
+        item_id_param = f'{mediatype}id'
+        if item_id_param in GET_DETAILS_API_MAP:
+            try:
+                details = get_details_batch(item_id_param, [item_id])[0]
+            except (NoDataError, RemoteKodiError) as exc:
+                logger.warning('Unable to retrieve details of %s %s: %s',
+                               mediatype, item_id, exc)
+            else:
+                return LIBRARY_CACHE.patch_item(item_id_param, item_id, details)
+        # E.g. a TV show that cannot be patched with episode details
+        LIBRARY_CACHE.invalidate_item(mediatype, item_id)
+        return True
+
+    def _on_remove(self, mediatype: str, item_id: int) -> None:
+        logger.debug('Remote notification: %s %s removed', mediatype, item_id)
+        LIBRARY_CACHE.invalidate_item(mediatype, item_id)
+        if mediatype == 'episode':
+            LIBRARY_CACHE.invalidate('tvshow')
+            LIBRARY_CACHE.invalidate('season')
+        self._playback_map.remove(f'{mediatype}id', item_id)
+        self._refresh_event.set()
+
+    def refresh_container(self) -> None:
+        """
+        Refresh the current addon listing if cached data have been changed
+        """
+        # A library scan produces a stream of updates, so refresh when it is finished
+        if self._is_scanning or not self._refresh_event.is_set():
+            return
+        self._refresh_event.clear()
+        if xbmc.getInfoLabel('Container.FolderPath').startswith(PLUGIN_URL):
+            xbmc.executebuiltin('Container.Refresh')
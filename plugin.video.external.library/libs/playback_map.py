@@ -0,0 +1,195 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Mapping of playable files to remote library items shared between addon processes
+
+The playback monitor uses it to find which remote library item is being played.
+Entries are stored in MemStorage in several shards keyed by a normalized file path,
+so a lookup decodes only one shard and a listing update re-writes only shards
+that have actually changed. Plugin invocations and the service update shards
+concurrently, so updates are serialized with a lock file.
+"""
+
+import logging
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote
+
+from libs.kodi_service import ADDON_ID, ADDON_PROFILE_DIR
+from libs.mem_storage import MemStorage
+
+logger = logging.getLogger(__name__)
+
+PlaybackMapEntry = Dict[str, Any]
+
+LOCK_PATH = ADDON_PROFILE_DIR / 'playback-map.lock'
+LOCK_TIMEOUT = 2.0
+# A lock file of a process that has crashed while holding the lock is removed after this time
+STALE_LOCK_AGE = 10.0
+
+
+@contextmanager
+def _lock_file(lock_path: Path):
+    """
+    Serialize read-modify-write updates between addon processes and threads
+
+    MemStorage has no atomic compare-and-set, but exclusive file creation is atomic
+    on all platforms. If the lock cannot be acquired in time, the update is made
+    without it, because a lost entry is less harmful than a blocked listing.
+    """
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    fd = None
+    while fd is None:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime > STALE_LOCK_AGE:
+                    lock_path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue  # The lock has just been released
+            if time.monotonic() > deadline:
+                logger.warning('Playback map: unable to acquire %s', lock_path)
+                break
+            time.sleep(0.005)
+        except FileNotFoundError:
+            lock_path.parent.mkdir(parents=True, exist_ok=True)
+        except OSError as exc:
+            logger.warning('Playback map: unable to create %s: %s', lock_path, exc)
+            break
+    try:
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+            lock_path.unlink(missing_ok=True)
+
+
+def normalize_path(path: str) -> str:
+    """
+    Get a playback map key from a remote library file path or a URL being played
+
+    Items are played either directly from network shares or via the remote Kodi
+    HTTP server as "<remote Kodi URL>/vfs/<quoted file path>".
+    """
+    path = path.split('|', 1)[0]  # Kodi URL options, e.g. HTTP headers
+    if '/vfs/' in path:
+        path = unquote(path.split('/vfs/', 1)[1])
+    return path
+
+
+class PlaybackMap:
+    """
+    Maps playable files to remote library items
+
+    Each shard holds entries in the order of their last update, and the oldest
+    entries are evicted when a shard exceeds its maximum size. Shards are selected
+    by CRC32 of a key because it is the same in all Python processes.
+    """
+    shard_count = 16
+    max_shard_size = 512
+
+    def __init__(self):
+        self._mem_storage = MemStorage()
+
+    @staticmethod
+    def _get_shard_key(shard_index: int) -> str:
+        return f'__{ADDON_ID}_playback_map_{shard_index}__'
+
+    def _get_path_shard_key(self, path: str) -> str:
+        return self._get_shard_key(zlib.crc32(path.encode('utf-8')) % self.shard_count)
+
+    def _get_shard(self, shard_key: str) -> Dict[str, PlaybackMapEntry]:
+        return self._mem_storage.get(shard_key) or {}
+
+    def get(self, file_path: str) -> Optional[PlaybackMapEntry]:
+        """
+        Get a library item by its file path or a URL being played
+
+        :param file_path: remote file path or playback URL
+        :return: a playback map entry with "item_id_param", item ID
+            and "playcount" keys or ``None``
+        """
+        path = normalize_path(file_path)
+        return self._get_shard(self._get_path_shard_key(path)).get(path)
+
+    def update(self, media_items: Iterable[Dict[str, Any]], item_id_param: str) -> None:
+        """
+        Add or update items from a listing
+
+        :param media_items: media items with "file", "playcount" and item ID properties
+        :param item_id_param: item ID parameter name, e.g. "movieid"
+        """
+        updates_by_shard: Dict[str, List[Tuple[str, PlaybackMapEntry]]] = {}
+        for media_info in media_items:
+            path = normalize_path(media_info['file'])
+            entry = {
+                'item_id_param': item_id_param,
+                item_id_param: media_info[item_id_param],
+                'playcount': media_info.get('playcount', 0),
+            }
+            updates_by_shard.setdefault(self._get_path_shard_key(path), []).append((path, entry))
+        changed_shards = 0
+        with _lock_file(LOCK_PATH):
+            for shard_key, updates in updates_by_shard.items():
+                shard = self._get_shard(shard_key)
+                is_changed = False
+                for path, entry in updates:
+                    if shard.get(path) != entry:
+                        # Updated entries are moved to the end to be evicted last
+                        shard.pop(path, None)
+                        shard[path] = entry
+                        is_changed = True
+                if is_changed:
+                    self._save_shard(shard_key, shard)
+                    changed_shards += 1
+        logger.debug('Playback map: %s of %s shards updated',
+                     changed_shards, len(updates_by_shard))
+
+    def _save_shard(self, shard_key: str, shard: Dict[str, PlaybackMapEntry]) -> None:
+        if len(shard) > self.max_shard_size:
+            shard = dict(list(shard.items())[-self.max_shard_size:])
+        self._mem_storage[shard_key] = shard
+
+    def _update_item(self, item_id_param: str, item_id: int,
+                     playcount: Optional[int] = None) -> None:
+        with _lock_file(LOCK_PATH):
+            for shard_index in range(self.shard_count):
+                shard_key = self._get_shard_key(shard_index)
+                shard = self._get_shard(shard_key)
+                paths = [path for path, entry in shard.items()
+                         if entry['item_id_param'] == item_id_param
+                         and entry[item_id_param] == item_id]
+                if not paths:
+                    continue
+                for path in paths:
+                    if playcount is None:
+                        del shard[path]
+                    else:
+                        shard[path]['playcount'] = playcount
+                self._save_shard(shard_key, shard)
+
+    def set_playcount(self, item_id_param: str, item_id: int, playcount: int) -> None:
+        """Update the playcount of a library item"""
+        self._update_item(item_id_param, item_id, playcount)
+
+    def remove(self, item_id_param: str, item_id: int) -> None:
+        """Remove a library item"""
+        self._update_item(item_id_param, item_id)
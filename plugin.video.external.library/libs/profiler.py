@@ -0,0 +1,158 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# pylint: disable=import-outside-toplevel
+"""
+Opt-in profiling of addon invocations
+
+The number of invocations to profile is requested with "profile_next" command
+and is stored in MemStorage, so it is shared by plugin invocations and the service.
+Each profiled invocation writes a .prof file that can be opened with pstats,
+snakeviz or converted to a flame graph with flameprof, and a plain text report
+of the most expensive functions that can be read on the client box.
+
+A listing that a profiled plugin invocation requests from the fetch daemon is
+profiled in the service process too. Both dumps have the same profile ID in their
+file names, so they can be merged with :meth:`pstats.Stats.add`.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from libs.kodi_service import ADDON_ID, ADDON_PROFILE_DIR
+from libs.mem_storage import MemStorage
+
+logger = logging.getLogger(__name__)
+
+PROFILE_COUNTER_KEY = f'__{ADDON_ID}_profile_invocations__'
+PROFILES_DIR = ADDON_PROFILE_DIR / 'profiles'
+# The oldest dumps are deleted when this number is exceeded
+MAX_PROFILE_DUMPS = 20
+REPORT_FUNCTIONS = 40
+
+_LOCAL = threading.local()
+
+
+def request_profiling(invocations: int) -> None:
+    """
+    Profile the next plugin invocations or fetch daemon requests
+
+    :param invocations: the number of invocations to profile, 0 cancels profiling
+    """
+    mem_storage = MemStorage()
+    if invocations > 0:
+        mem_storage[PROFILE_COUNTER_KEY] = invocations
+    else:
+        del mem_storage[PROFILE_COUNTER_KEY]
+
+
+def _take_invocation() -> bool:
+    # Concurrent invocations may both take the last one, which is harmless
+    mem_storage = MemStorage()
+    remaining = mem_storage.get(PROFILE_COUNTER_KEY)
+    if not remaining:
+        return False
+    if remaining > 1:
+        mem_storage[PROFILE_COUNTER_KEY] = remaining - 1
+    else:
+        del mem_storage[PROFILE_COUNTER_KEY]
+    return True
+
+
+@contextmanager
+def profile_invocation(label: str, description: str = ''):
+    """
+    Profile a block of code if profiling of the next invocations has been requested
+
+    :param label: a short invocation label for dump file names, e.g. "plugin"
+    :param description: additional information for the text report, e.g. plugin URL
+    """
+    if not _take_invocation():
+        yield
+        return
+    with _profile(label, description, uuid.uuid4().hex[:8]):
+        yield
+
+
+@contextmanager
+def profile_request(profile_id: Optional[str], label: str, description: str = ''):
+    """
+    Profile a block of code that serves a request from a profiled invocation
+
+    The number of invocations to profile is not changed, because the request
+    is a part of an invocation that has already been counted.
+
+    :param profile_id: the profile ID of the invocation that has sent the request
+        or ``None`` if the invocation is not profiled
+    :param label: a short request label for dump file names, e.g. "fetch_daemon"
+    :param description: additional information for the text report
+    """
+    if profile_id is None:
+        yield
+        return
+    with _profile(label, description, profile_id):
+        yield
+
+
+def get_profile_id() -> Optional[str]:
+    """Get the profile ID of the invocation that is profiled in the current thread or ``None``"""
+    return getattr(_LOCAL, 'profile_id', None)
+
+
+@contextmanager
+def _profile(label: str, description: str, profile_id: str):
+    import cProfile
+    profiler = cProfile.Profile()
+    _LOCAL.profile_id = profile_id
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _LOCAL.profile_id = None
+        _save_profile(profiler, label, description, profile_id)
+
+
+def _save_profile(profiler, label: str, description: str, profile_id: str) -> None:
+    import pstats
+    safe_label = re.sub(r'[^\w-]', '_', f'{profile_id}-{label}')
+    base_name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{safe_label}'
+    prof_path = PROFILES_DIR / f'{base_name}.prof'
+    try:
+        PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(prof_path))
+        with (PROFILES_DIR / f'{base_name}.txt').open('w', encoding='utf-8') as fo:
+            fo.write(f'{label} {description}\nprofile ID: {profile_id}\n')
+            stats = pstats.Stats(profiler, stream=fo)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_FUNCTIONS)
+        _remove_old_dumps(PROFILES_DIR)
+    except OSError as exc:
+        logger.warning('Unable to save the profile of %s: %s', label, exc)
+        return
+    logger.info('The profile of %s has been saved to %s', label, prof_path)
+
+
+def _remove_old_dumps(profiles_dir: Path) -> None:
+    # Dump names start with a timestamp, so the oldest dumps are sorted first
+    dumps = sorted(profiles_dir.glob('*.prof'))
+    for prof_path in dumps[:-MAX_PROFILE_DUMPS]:
+        prof_path.unlink()
+        prof_path.with_suffix('.txt').unlink(missing_ok=True)
@@ -0,0 +1,235 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Coalescing of concurrent identical requests"""
+
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SharedIterator:
+    """
+    An iterator that can be consumed by several threads at the same time
+
+    Each consumer reads items through its own :class:`SharedIteratorConsumer`
+    and receives all items from the beginning. Items are pulled from the source
+    iterator only once by whichever consumer needs the next item first, while
+    other consumers wait for it. The source is advanced without holding the lock,
+    so consumers can join and read already retrieved items while the next item
+    is being retrieved, e.g. while a page is downloaded.
+
+    New consumers can be added until the source is exhausted. After that,
+    items are dropped as soon as all consumers have read them. When the last
+    consumer is closed before the source is exhausted, the source is closed too.
+    """
+
+    def __init__(self, source: Iterator[Any], on_finished: Optional[Callable[[], None]] = None):
+        self._source = source
+        self._on_finished = on_finished
+        self._items: Deque[Any] = deque()
+        # Consumer to the index of its next item in the items deque
+        self._positions: Dict['SharedIteratorConsumer', int] = {}
+        # StopIteration if the source is exhausted or closed, or the error of the source
+        self._end: Optional[BaseException] = None
+        self._is_fetching = False
+        self._condition = threading.Condition()
+
+    def open(self) -> Optional['SharedIteratorConsumer']:
+        """
+        Add a consumer that receives all items from the beginning
+
+        :return: a new consumer or ``None`` if the iterator is finished
+        """
+        with self._condition:
+            if self._end is not None:
+                return None
+            consumer = SharedIteratorConsumer(self)
+            self._positions[consumer] = 0
+        return consumer
+
+    def _drop_read_items(self) -> None:
+        """Must be called with the lock acquired"""
+        # Items are kept for consumers that may join until the source is exhausted
+        if self._end is None or not self._positions:
+            return
+        read_count = min(self._positions.values())
+        if not read_count:
+            return
+        for _ in range(read_count):
+            self._items.popleft()
+        for consumer in self._positions:
+            self._positions[consumer] -= read_count
+
+    def _finish(self) -> None:
+        """Must be called without the lock acquired to avoid a lock order inversion"""
+        if self._on_finished is not None:
+            self._on_finished()
+
+    def _fetch_next(self) -> None:
+        """Retrieve the next item from the source. Must be called without the lock acquired"""
+        item = None
+        # Consumers must not wait forever if e.g. SystemExit is raised by the source
+        end: Optional[BaseException] = RuntimeError('Retrieving items has been interrupted')
+        try:
+            item = next(self._source)
+            end = None
+        except StopIteration as exc:
+            end = exc
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            # The error is re-raised to each consumer
+            end = exc
+        finally:
+            with self._condition:
+                if end is None:
+                    self._items.append(item)
+                else:
+                    self._end = end
+                    self._drop_read_items()
+                self._is_fetching = False
+                self._condition.notify_all()
+            if end is not None:
+                self._finish()
+
+    def get_item(self, consumer: 'SharedIteratorConsumer') -> Tuple[bool, Any]:
+        """
+        Get the next item for a consumer
+
+        :return: (has item, item) tuple
+        """
+        while True:
+            with self._condition:
+                while True:
+                    index = self._positions[consumer]
+                    if index < len(self._items):
+                        self._positions[consumer] = index + 1
+                        item = self._items[index]
+                        self._drop_read_items()
+                        return True, item
+                    if isinstance(self._end, StopIteration):
+                        return False, None
+                    if self._end is not None:
+                        raise self._end
+                    if not self._is_fetching:
+                        break
+                    # Another consumer is retrieving the next item
+                    self._condition.wait()
+                self._is_fetching = True
+            self._fetch_next()
+
+    def release(self, consumer: 'SharedIteratorConsumer') -> None:
+        """Remove a consumer, e.g. when it has stopped reading items"""
+        with self._condition:
+            if self._positions.pop(consumer, None) is None:
+                return
+            if self._positions or self._end is not None:
+                self._drop_read_items()
+                return
+            # The last consumer has stopped before the source is exhausted
+            self._end = StopIteration()
+            self._items.clear()
+            while self._is_fetching:
+                self._condition.wait()
+            if (close := getattr(self._source, 'close', None)) is not None:
+                close()
+        self._finish()
+
+
+class SharedIteratorConsumer:
+    """
+    Reads items of a :class:`SharedIterator` for one consumer
+
+    A consumer that stops reading before all items are received must be closed.
+    """
+
+    def __init__(self, shared_iterator: SharedIterator):
+        self._shared_iterator = shared_iterator
+        self._is_closed = False
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        if self._is_closed:
+            raise StopIteration
+        try:
+            has_item, item = self._shared_iterator.get_item(self)
+        except Exception:
+            self.close()
+            raise
+        if not has_item:
+            self.close()
+            raise StopIteration
+        return item
+
+    def close(self) -> None:
+        if not self._is_closed:
+            self._is_closed = True
+            self._shared_iterator.release(self)
+
+
+class SingleFlight:
+    """
+    Shares one in-flight request between concurrent callers with the same key
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = 0
+        self.suppressed = 0
+        self._flights: Dict[Hashable, Tuple[SharedIterator, Any]] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: Hashable, source_factory: Callable[[], Iterator[Any]],
+             leader: Any = None) -> Tuple[SharedIteratorConsumer, Any]:
+        """
+        Join an in-flight request or start a new one
+
+        :param key: request key
+        :param source_factory: a callable that starts a request and returns an iterator
+            of its results. It is called only if there is no in-flight request with the key.
+        :param leader: an object that has started the request, e.g. a content handler
+        :return: (results iterator, the leader of the in-flight request) tuple.
+            The iterator must be closed if it is not consumed to the end.
+        """
+        while True:
+            with self._lock:
+                if (flight := self._flights.get(key)) is None:
+                    self.started += 1
+                    shared_iterator = SharedIterator(
+                        source_factory(), lambda: self._remove(key, shared_iterator))
+                    consumer = shared_iterator.open()
+                    self._flights[key] = (shared_iterator, leader)
+                    return consumer, leader
+            # The registry lock is not held, so requests with other keys are not blocked
+            shared_iterator, flight_leader = flight
+            if (consumer := shared_iterator.open()) is not None:
+                with self._lock:
+                    self.suppressed += 1
+                logger.debug('%s: joined an in-flight request %s. %s', self.name, key, self)
+                return consumer, flight_leader
+            # The request has just finished
+            self._remove(key, shared_iterator)
+
+    def _remove(self, key: Hashable, shared_iterator: SharedIterator) -> None:
+        with self._lock:
+            # A new request with the same key might have replaced a finished one
+            if (flight := self._flights.get(key)) is not None and flight[0] is shared_iterator:
+                del self._flights[key]
+
+    def __str__(self):
+        return f'requests started: {self.started}, duplicates suppressed: {self.suppressed}'
@@ -0,0 +1,225 @@
+# Copyright (C) 2023, Roman Miroshnychenko aka Roman V.M.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Background queue for watched status updates of remote library items"""
+
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import xbmc
+
+from libs.delta_sync import reconcile_watched_state
+from libs.exceptions import NoDataError, RemoteKodiError
+from libs.json_rpc_api import SET_DETAILS_API_MAP, update_details_batch
+from libs.kodi_service import ADDON_PROFILE_DIR, PLUGIN_URL
+from libs.library_cache import LIBRARY_CACHE
+
+logger = logging.getLogger(__name__)
+
+ItemKey = Tuple[str, int]
+
+
+def refresh_container() -> None:
+    """Refresh the current listing if it belongs to this addon"""
+    if xbmc.getInfoLabel('Container.FolderPath').startswith(PLUGIN_URL):
+        xbmc.executebuiltin('Container.Refresh')
+
+
+class WriteBehindQueue(threading.Thread):
+    """
+    Sends playcount and resume point updates to the remote Kodi in background
+
+    Pending updates for the same item are merged, so only the latest values
+    are sent, and all pending updates are sent in one JSON-RPC batch request.
+    Unsent updates are saved to a journal file and are sent again
+    with exponential backoff, including after Kodi restart.
+
+    Cached listings are patched with new values immediately, so the current
+    listing is refreshed without waiting for the remote Kodi. After updates
+    are sent, cached values are reconciled with the remote library.
+    """
+    initial_backoff = 5.0
+    max_backoff = 300.0
+
+    def __init__(self, journal_path: Optional[Path] = None):
+        super().__init__(name='WriteBehindQueue', daemon=True)
+        self._journal_path = journal_path or ADDON_PROFILE_DIR / 'pending-updates.json'
+        self._pending: Dict[ItemKey, Dict[str, Any]] = {}
+        # Items that are not in cached listings, e.g. if the cache is disabled
+        self._unpatched: Set[ItemKey] = set()
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._load_journal()
+
+    def _load_journal(self) -> None:
+        try:
+            with self._journal_path.open('r', encoding='utf-8') as fo:
+                updates = json.load(fo)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            logger.exception('Unable to read pending updates from %s', self._journal_path)
+            return
+        for update in updates:
+            try:
+                item_key = (update['item_id_param'], update[update['item_id_param']])
+            except (KeyError, TypeError):
+                logger.error('Invalid pending update in the journal: %s', update)
+                continue
+            self._pending[item_key] = update
+        logger.debug('Loaded %s pending updates from the journal', len(self._pending))
+
+    def _save_journal(self) -> None:
+        """Save pending updates. Must be called with the lock acquired"""
+        try:
+            if not self._pending:
+                self._journal_path.unlink(missing_ok=True)
+                return
+            self._journal_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self._journal_path.with_suffix('.tmp')
+            with temp_path.open('w', encoding='utf-8') as fo:
+                json.dump(list(self._pending.values()), fo)
+            temp_path.replace(self._journal_path)
+        except OSError:
+            logger.exception('Unable to save pending updates to %s', self._journal_path)
+
+    def enqueue(self, item_id_param: str, item_id: int, **details) -> None:
+        """
+        Add an update of an item's details to the queue
+
+        :param item_id_param: item ID parameter name, e.g. "movieid"
+        :param item_id: item ID
+        :param details: details to set, e.g. playcount=1
+        """
+        if item_id_param not in SET_DETAILS_API_MAP:
+            logger.error('Unable to update %s %s: unsupported media type', item_id_param, item_id)
+            return
+        with self._lock:
+            update = self._pending.setdefault(
+                (item_id_param, item_id),
+                {'item_id_param': item_id_param, item_id_param: item_id}
+            )
+            update.update(details)
+            self._save_journal()
+        if LIBRARY_CACHE.patch_item(item_id_param, item_id, details):
+            refresh_container()
+        else:
+            with self._lock:
+                self._unpatched.add((item_id_param, item_id))
+        self.wake()
+
+    def update_playcount(self, item_id_param: str, item_id: int, playcount: int) -> None:
+        self.enqueue(item_id_param, item_id, playcount=playcount,
+                     resume={'position': 0.0, 'total': 0.0})
+
+    def update_resume(self, item_id_param: str, item_id: int,
+                      position: float, total: float) -> None:
+        self.enqueue(item_id_param, item_id, resume={'position': position, 'total': total})
+
+    def wake(self) -> None:
+        """Send pending updates now, e.g. when the remote Kodi is back online"""
+        self._wake_event.set()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.wake()
+        self.join()
+
+    def run(self) -> None:
+        backoff = self.initial_backoff
+        while not self._stop_event.is_set():
+            timeout = None
+            if self._pending:
+                try:
+                    is_sent = self.flush()
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # An unexpected error must not stop sending watched status updates
+                    logger.exception('Unable to send pending updates')
+                    is_sent = False
+                if is_sent:
+                    backoff = self.initial_backoff
+                else:
+                    timeout = backoff
+                    backoff = min(backoff * 2, self.max_backoff)
+            self._wake_event.wait(timeout)
+            self._wake_event.clear()
+        self.flush()
+
+    def flush(self) -> bool:
+        """
+        Send all pending updates in one request
+
+        :return: ``False`` if the remote Kodi is not available
+        """
+        with self._lock:
+            updates = [update.copy() for update in self._pending.values()]
+        if not updates:
+            return True
+        try:
+            errors = self._send(updates)
+        except RemoteKodiError as exc:
+            logger.warning('Unable to send %s pending updates: %s', len(updates), exc)
+            return False
+        item_keys = []
+        failed_item_keys = []
+        with self._lock:
+            for update, error in zip(updates, errors):
+                item_id_param = update['item_id_param']
+                item_key = (item_id_param, update[item_id_param])
+                if error is None:
+                    item_keys.append(item_key)
+                else:
+                    # E.g. the item has been removed. Retrying would not help, so it is dropped.
+                    logger.error('Unable to update %s: %s', update, error)
+                    failed_item_keys.append(item_key)
+                # The update might have been changed while it was being sent
+                if self._pending.get(item_key) == update:
+                    del self._pending[item_key]
+            self._save_journal()
+        logger.debug('Sent %s pending updates', len(item_keys))
+        for item_id_param, item_id in failed_item_keys:
+            # Revert locally patched values that the remote Kodi has not accepted
+            LIBRARY_CACHE.invalidate_watched_state(item_id_param, item_id)
+        with self._lock:
+            should_refresh = not self._unpatched.isdisjoint(item_keys)
+            self._unpatched.difference_update(item_keys, failed_item_keys)
+        try:
+            is_changed = reconcile_watched_state(item_keys)
+        except RemoteKodiError as exc:
+            # Updates have been sent, so locally patched values are most likely correct
+            logger.warning('Unable to reconcile watched status with %s', exc)
+            is_changed = False
+        if is_changed or should_refresh or failed_item_keys:
+            refresh_container()
+        return True
+
+    @staticmethod
+    def _send(updates: List[Dict[str, Any]]) -> List[Optional[NoDataError]]:
+        try:
+            return update_details_batch(updates)
+        except NoDataError as exc:
+            logger.warning('Pending updates batch has been rejected: %s. '
+                           'Sending updates one by one.', exc)
+        # A malformed update must not block other updates
+        errors = []
+        for update in updates:
+            try:
+                errors.extend(update_details_batch([update]))
+            except NoDataError as exc:
+                errors.append(exc)
+        return errors
@@ -18,9 +18,10 @@ import sys
 from libs.actions import router
 from libs.exception_logger import catch_exception
 from libs.kodi_service import initialize_logging
+from libs.profiler import profile_invocation
 
 initialize_logging()
 
 if __name__ == '__main__':
-    with catch_exception():
+    with catch_exception(), profile_invocation('plugin', sys.argv[0] + sys.argv[2]):
         router(sys.argv[2][1:])
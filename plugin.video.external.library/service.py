@@ -17,20 +17,90 @@ import logging
 
 import xbmc
 
+from libs.circuit_breaker import RecoveryProbe
+from libs.content_type_handlers import CONTENT_TYPE_HANDLERS
 from libs.exception_logger import catch_exception
-from libs.kodi_service import initialize_logging
+from libs.fetch_daemon import FetchDaemon
+from libs.http_session import close_session
+from libs.json_rpc_api import probe_remote_kodi
+from libs.kodi_service import ADDON_SETTINGS, get_remote_kodi_url, initialize_logging
 from libs.monitor import PlayMonitor
+from libs.notifications import NotificationListener
+from libs.write_behind import WriteBehindQueue, refresh_container
 
 initialize_logging()
 logger = logging.getLogger(__name__)
 
+
+def on_remote_kodi_recovered(write_queue):
+    write_queue.wake()
+    # Replace a stale listing with the current one
+    refresh_container()
+
+
+def get_notifications_address():
+    settings = ADDON_SETTINGS.get()
+    if not settings.kodi_host or not settings.remote_notifications:
+        return None
+    return settings.kodi_host, settings.kodi_tcp_port
+
+
+class ServiceMonitor(xbmc.Monitor):
+    """
+    Manages background components of the service
+
+    The service does not poll anything: components are driven by Kodi callbacks
+    and their own threads.
+    """
+
+    def __init__(self, write_queue):
+        super().__init__()
+        self._write_queue = write_queue
+        self._notification_listener = None
+        self.update_notification_listener()
+
+    def onSettingsChanged(self):
+        ADDON_SETTINGS.refresh()
+        self.update_notification_listener()
+
+    def update_notification_listener(self):
+        """Restart the notification listener if the remote Kodi address has changed"""
+        address = get_notifications_address()
+        listener = self._notification_listener
+        if listener is not None and listener.address == address:
+            return
+        if listener is not None:
+            listener.stop()
+        self._notification_listener = None
+        if address is not None:
+            # Pending watched status updates are sent when the remote Kodi is back online
+            self._notification_listener = NotificationListener(
+                *address, on_connected=self._write_queue.wake)
+            self._notification_listener.start()
+
+    def stop_notification_listener(self):
+        if self._notification_listener is not None:
+            self._notification_listener.stop()
+            self._notification_listener.join()
+
+
 with catch_exception():
     logger.debug('Starting playback monitoring service...')
-    kodi_monitor = xbmc.Monitor()
-    play_monitor = PlayMonitor()
-    while not kodi_monitor.waitForAbort(1.0):
-        if (play_monitor.isPlayingVideo()
-                and not xbmc.getCondVisibility('Player.Paused')
-                and play_monitor.is_monitoring):
-            play_monitor.update_time()
+    write_behind_queue = WriteBehindQueue()
+    write_behind_queue.start()
+    kodi_monitor = ServiceMonitor(write_behind_queue)
+    play_monitor = PlayMonitor(write_behind_queue)
+    fetch_daemon = FetchDaemon(CONTENT_TYPE_HANDLERS)
+    fetch_daemon.start()
+    recovery_probe = RecoveryProbe(
+        get_remote_kodi_url, probe_remote_kodi,
+        on_recovered=lambda: on_remote_kodi_recovered(write_behind_queue)
+    )
+    recovery_probe.start()
+    kodi_monitor.waitForAbort()
+    recovery_probe.stop()
+    fetch_daemon.stop()
+    kodi_monitor.stop_notification_listener()
+    write_behind_queue.stop()
+    close_session()
 logger.debug('Stopped playback monitoring service.')
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark of filling xbmc.InfoTagVideo instances with media info
+
+Compares the compiled per-mediatype InfoTagFiller with the previous approach
+that created a setter object for each of MEDIA_PROPERTIES for every media item
+and a new Actor instance for every cast member.
+Requires Kodistubs: pip install Kodistubs
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+from urllib.parse import quote
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR / 'plugin.video.external.library'))
+
+# pylint: disable=wrong-import-position
+from xbmc import Actor, InfoTagVideo
+
+from libs import json_rpc_api
+from libs.media_info_service import (
+    MEDIA_PROPERTIES,
+    CastSetter,
+    SimpleMediaPropertySetter,
+    InfoTagFiller,
+    get_actor,
+    get_image_url,
+)
+
+MEDIATYPES = {
+    'movie': json_rpc_api.GetMovies,
+    'episode': json_rpc_api.GetEpisodes,
+    'musicvideo': json_rpc_api.GetMusicVideos,
+}
+
+
+def make_media_info(index):
+    return {
+        'title': f'Title {index}',
+        'genre': ['Drama', 'Comedy'],
+        'year': 2000 + index % 20,
+        'rating': 7.5,
+        'director': ['Director'],
+        'plot': 'Plot ' * 50,
+        'playcount': index % 2,
+        'writer': ['Writer'],
+        'studio': ['Studio'],
+        'mpaa': 'PG',
+        # Actors are shared between items, like in a real library
+        'cast': [
+            {'name': f'Actor {i}', 'role': 'Role', 'order': i, 'thumbnail': f'image://a{i}.jpg/'}
+            for i in range(index % 100, index % 100 + 20)
+        ],
+        'country': ['UK'],
+        'streamdetails': {
+            'video': [{'width': 1920, 'height': 1080, 'aspect': 1.78, 'duration': 6000,
+                       'codec': 'h264', 'stereomode': '', 'language': '', 'hdrtype': ''}],
+            'audio': [{'channels': 6, 'codec': 'ac3', 'language': 'eng'}],
+            'subtitle': [{'language': 'eng'}],
+        },
+        'votes': '1234',
+        'sorttitle': '',
+        'resume': {'position': 0.0, 'total': 0.0},
+        'dateadded': '2020-01-01 00:00:00',
+        'premiered': '2020-01-01',
+        'season': 1,
+        'episode': index,
+        'showtitle': 'Show',
+        'specialsortseason': -1,
+        'specialsortepisode': -1,
+        'track': -1,
+    }
+
+
+class LegacySetter:  # pylint: disable=too-few-public-methods
+    """Reproduces a per-item setter object of the previous implementation"""
+
+    def __init__(self, media_property, media_info, info_tag_method, setter_class):
+        self._property_value = media_info.get(media_property)
+        self._info_tag_method = info_tag_method
+        self._setter_class = setter_class
+
+    @staticmethod
+    def make_actors(cast):
+        actors = []
+        for actor_info in cast:
+            actor_thumbnail = actor_info.get('thumbnail', '')
+            if actor_thumbnail:
+                actor_thumbnail = f'{get_image_url()}/{quote(actor_thumbnail)}'
+            actors.append(Actor(
+                name=actor_info.get('name', ''),
+                role=actor_info.get('role', ''),
+                order=actor_info.get('order') or -1,
+                thumbnail=actor_thumbnail
+            ))
+        return actors
+
+    def set(self, info_tag):
+        if self._setter_class.should_set(self._property_value):
+            method = getattr(InfoTagVideo, self._info_tag_method)
+            if self._setter_class is CastSetter:
+                method(info_tag, self.make_actors(self._property_value))
+            elif self._setter_class is SimpleMediaPropertySetter:
+                method(info_tag, self._property_value)
+            else:
+                self._setter_class.set_info_tag_property(method, info_tag, self._property_value)
+
+
+def legacy_set_info(info_tag, media_info, mediatype):
+    info_tag.setMediaType(mediatype)
+    for media_property, info_tag_method, setter_class in MEDIA_PROPERTIES:
+        LegacySetter(media_property, media_info, info_tag_method, setter_class).set(info_tag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--items', type=int, default=20000, help='media items in a listing')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='benchmark repetitions')
+    parser.add_argument('-c', '--max-cast', type=int, default=0,
+                        help='maximum cast members per item, 0 - no limit')
+    args = parser.parse_args()
+    media_items = [make_media_info(i) for i in range(args.items)]
+    info_tags = [InfoTagVideo() for _ in range(args.items)]
+    for mediatype, api_class in MEDIATYPES.items():
+        filler = InfoTagFiller(mediatype, api_class.properties, args.max_cast)
+
+        def run_legacy(mediatype=mediatype):
+            for info_tag, media_info in zip(info_tags, media_items):
+                legacy_set_info(info_tag, media_info, mediatype)
+
+        def run_compiled(filler=filler):
+            for info_tag, media_info in zip(info_tags, media_items):
+                filler.fill(info_tag, media_info)
+
+        legacy_time = min(timeit.repeat(run_legacy, number=1, repeat=args.repeat))
+        compiled_time = min(timeit.repeat(run_compiled, number=1, repeat=args.repeat))
+        print(f'{mediatype:>10}: {args.items} items, per-item setters: {legacy_time:.3f} s, '
+              f'compiled filler: {compiled_time:.3f} s, '
+              f'speedup: {legacy_time / compiled_time:.2f}x')
+    print(f'Interned actors: {get_actor.cache_info()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the listing pipeline on a synthetic library
+
+Runs actions.show_media_items for movies, TV shows and episodes against
+Kodistubs with a fake window for MemStorage. The remote Kodi is replaced
+by pre-encoded JSON-RPC replies, so only the time spent in the addon
+is measured: decoding replies, creating list items (art, info tags,
+context menus and URLs), adding items to a directory and saving
+the playback map to MemStorage. For each handler and library size
+the report shows throughput, per-stage timings and peak memory.
+Requires Kodistubs: pip install Kodistubs
+"""
+
+import argparse
+import gc
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+ADDON_DIR = BASE_DIR / 'plugin.video.external.library'
+sys.path.insert(0, str(ADDON_DIR))
+BENCHMARK_ARGV = sys.argv
+# actions.py reads the plugin handle from the command line
+sys.argv = ['plugin://plugin.video.external.library/', '1', '']
+
+# pylint: disable=wrong-import-position,protected-access
+import xbmcgui
+import xbmcplugin
+
+
+class FakeWindow:
+    """Stores window properties in memory instead of the no-op Kodistubs window"""
+    properties = {}
+
+    def __init__(self, window_id=10000):
+        self._window_id = window_id
+
+    def getProperty(self, key):  # pylint: disable=invalid-name
+        return self.properties.get(key, '')
+
+    def setProperty(self, key, value):  # pylint: disable=invalid-name
+        self.properties[key] = value
+
+    def clearProperty(self, key):  # pylint: disable=invalid-name
+        self.properties.pop(key, None)
+
+
+xbmcgui.Window = FakeWindow
+
+from libs import actions, json_rpc_api, kodi_service, media_info_service
+from libs.kodi_service import ADDON_SETTINGS, Settings
+
+SETTINGS = Settings(
+    kodi_host='192.168.1.2',
+    kodi_port=8080,
+    use_https=False,
+    remote_notifications=False,
+    kodi_tcp_port=9090,
+    kodi_login='kodi',
+    kodi_password='kodi',
+    show_movies=True,
+    show_recent_movies=True,
+    show_tvshows=True,
+    show_recent_episodes=True,
+    flatten_seasons=0,
+    show_music_videos=True,
+    show_recent_music_videos=True,
+    show_item_counts=False,
+    files_on_shares=False,
+    playtime_to_skip=10,
+    watched_threshold_percent=90,
+    page_size=0,
+    cache_ttl=0,
+    recent_cache_ttl=0,
+    delta_sync=False,
+    movies_listing_profile=0,
+    episodes_listing_profile=0,
+    musicvideos_listing_profile=0,
+    lean_listing_threshold=5000,
+    background_details_fill=False,
+    max_cast_members=0,
+    fetch_daemon=False,
+    log_level=1,
+    collect_stats=False,
+)
+
+CONTENT_TYPES = ['movies', 'tvshows', 'episodes']
+
+GENRES = ['Drama', 'Comedy', 'Thriller', 'Action', 'Documentary', 'Animation', 'Crime']
+STUDIOS = ['BBC', 'HBO', 'Warner Bros.', 'Paramount', 'Netflix']
+LANGUAGES = ['eng', 'ger', 'fre', 'spa', 'rus']
+# Large libraries share a pool of actors between movies and shows
+ACTORS_POOL_SIZE = 20000
+
+PLOT = ('A synthetic plot that is about as long as a typical plot in a scraped library. '
+        * 5).strip()
+
+
+def make_art(path, *art_types):
+    return {art_type: f'image://{path}/{art_type}.jpg/' for art_type in art_types}
+
+
+def make_cast(rng):
+    cast = []
+    for order, actor_index in enumerate(rng.sample(range(ACTORS_POOL_SIZE), rng.randint(5, 30))):
+        actor = {'name': f'Actor Name {actor_index}', 'role': f'Role {order}', 'order': order}
+        # Some actors have no photo in a real library
+        if actor_index % 5:
+            actor['thumbnail'] = f'image://actors/{actor_index}.jpg/'
+        cast.append(actor)
+    return cast
+
+
+def make_streamdetails(rng):
+    return {
+        'video': [{
+            'codec': rng.choice(['h264', 'hevc']),
+            'aspect': 1.78,
+            'width': 1920,
+            'height': 1080,
+            'duration': rng.randint(1200, 9000),
+            'stereomode': '',
+            'language': '',
+            'hdrtype': rng.choice(['', 'hdr10']),
+        }],
+        'audio': [{'codec': rng.choice(['ac3', 'dts', 'aac']), 'channels': rng.choice([2, 6]),
+                   'language': language} for language in rng.sample(LANGUAGES, 2)],
+        'subtitle': [{'language': language} for language in rng.sample(LANGUAGES, 3)],
+    }
+
+
+def make_common(rng, index, path):
+    return {
+        'label': f'Title {index}',
+        'title': f'Title {index}',
+        'originaltitle': f'Original Title {index}',
+        'plot': PLOT,
+        'rating': round(rng.uniform(1, 10), 1),
+        'votes': str(rng.randint(0, 100000)),
+        'playcount': rng.choice([0, 0, 1]),
+        'dateadded': f'20{rng.randint(10, 23)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)} 12:00:00',
+        'lastplayed': '',
+        'cast': make_cast(rng),
+        'file': f'/storage/videos/{path}.mkv',
+    }
+
+
+def make_movie(rng, index):
+    movie = make_common(rng, index, f'movies/movie-{index}')
+    movie.update({
+        'movieid': index + 1,
+        'genre': rng.sample(GENRES, 2),
+        'year': rng.randint(1950, 2023),
+        'director': [f'Director {rng.randint(0, 2000)}'],
+        'trailer': '',
+        'tagline': 'A tagline',
+        'plotoutline': PLOT[:100],
+        'writer': [f'Writer {rng.randint(0, 2000)}'],
+        'studio': rng.sample(STUDIOS, 1),
+        'mpaa': 'Rated PG-13',
+        'country': ['United States'],
+        'streamdetails': make_streamdetails(rng),
+        'top250': 0,
+        'sorttitle': '',
+        'resume': {'position': 0.0, 'total': 0.0},
+        'art': make_art(f'movies/{index}', 'poster', 'fanart', 'clearlogo', 'landscape'),
+        'premiered': '2020-01-01',
+    })
+    return movie
+
+
+def make_tvshow(rng, index):
+    tvshow = make_common(rng, index, f'tvshows/show-{index}')
+    tvshow.update({
+        'tvshowid': index + 1,
+        'genre': rng.sample(GENRES, 2),
+        'year': rng.randint(1950, 2023),
+        'studio': rng.sample(STUDIOS, 1),
+        'mpaa': 'TV-14',
+        'episode': rng.randint(1, 200),
+        'premiered': '2020-01-01',
+        'sorttitle': '',
+        'season': rng.randint(1, 10),
+        'watchedepisodes': 0,
+        'tag': [],
+        'art': make_art(f'tvshows/{index}', 'poster', 'fanart', 'banner', 'clearlogo'),
+        'userrating': 0,
+        'ratings': {'default': {'default': True, 'rating': 8.1, 'votes': 1000}},
+        'runtime': 2700,
+        'uniqueid': {'tvdb': str(100000 + index), 'imdb': f'tt{1000000 + index}'},
+    })
+    return tvshow
+
+
+def make_episode(rng, index):
+    tvshowid = index // 100 + 1
+    season, episode = divmod(index % 100, 20)
+    episode_info = make_common(rng, index, f'tvshows/show-{tvshowid}/s{season}e{episode}')
+    episode_info.update({
+        'episodeid': index + 1,
+        'writer': [f'Writer {rng.randint(0, 2000)}'],
+        'firstaired': '2020-01-01',
+        'runtime': 2700,
+        'director': [f'Director {rng.randint(0, 2000)}'],
+        'productioncode': '',
+        'season': season + 1,
+        'episode': episode + 1,
+        'showtitle': f'Show {tvshowid}',
+        'streamdetails': make_streamdetails(rng),
+        'resume': {'position': 0.0, 'total': 0.0},
+        'tvshowid': tvshowid,
+        'uniqueid': {'tvdb': str(200000 + index)},
+        'art': make_art(f'episodes/{index}', 'thumb', 'tvshow.poster', 'tvshow.fanart'),
+        'specialsortseason': -1,
+        'specialsortepisode': -1,
+        'seasonid': tvshowid * 10 + season,
+    })
+    return episode_info
+
+
+ITEM_FACTORIES = {
+    'movies': make_movie,
+    'tvshows': make_tvshow,
+    'episodes': make_episode,
+}
+
+
+def make_reply(content, size, seed=42):
+    """Make an encoded JSON-RPC reply with a synthetic library"""
+    rng = random.Random(seed)
+    items = [ITEM_FACTORIES[content](rng, index) for index in range(size)]
+    reply = {
+        'id': '1',
+        'jsonrpc': '2.0',
+        'result': {content: items, 'limits': {'start': 0, 'end': size, 'total': size}},
+    }
+    return json.dumps(reply).encode('utf-8')
+
+
+class StageTimer:
+    """
+    Accumulates exclusive time spent in wrapped functions
+
+    The time of a nested stage, e.g. setting art while creating a list item,
+    is not included in the outer stage, so stage times do not overlap.
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        # The time of nested stages for each stage that is being measured
+        self._nested_times = []
+
+    def wrap(self, stage, func):
+        timings = self.timings
+        nested_times = self._nested_times
+
+        def wrapper(*args, **kwargs):
+            nested_times.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                timings[stage] += elapsed - nested_times.pop()
+                if nested_times:
+                    nested_times[-1] += elapsed
+
+        return wrapper
+
+
+def install_fakes(timer, replies):
+    """Replace the remote Kodi with pre-encoded replies and wrap pipeline stages"""
+    ADDON_SETTINGS.get = lambda: SETTINGS
+    profile_dir = Path(tempfile.mkdtemp(prefix='external-library-benchmark-'))
+    kodi_service.ADDON_DIR = ADDON_DIR
+    kodi_service.ADDON_PROFILE_DIR = profile_dir
+
+    def send_json_rpc(self):
+        return json.loads(replies[self._content])
+
+    json_rpc_api.BaseJsonRpcApi.send_json_rpc = timer.wrap('decode replies', send_json_rpc)
+    media_info_service.set_art = timer.wrap('set art', media_info_service.set_art)
+    media_info_service.InfoTagFiller.fill = timer.wrap('fill info tags',
+                                                       media_info_service.InfoTagFiller.fill)
+    actions._create_directory_item = timer.wrap('create list items',
+                                                actions._create_directory_item)
+    xbmcplugin.addDirectoryItems = timer.wrap('add directory items',
+                                              xbmcplugin.addDirectoryItems)
+    actions.PLAYBACK_MAP.update = timer.wrap('save playback map', actions.PLAYBACK_MAP.update)
+
+
+def run(content_type, measure_memory):
+    """
+    Create a listing once
+
+    :return: (elapsed time, peak memory in bytes or None)
+    """
+    FakeWindow.properties.clear()
+    media_info_service.clear_url_caches()
+    gc.collect()
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    actions.show_media_items(content_type)
+    elapsed = time.perf_counter() - start
+    peak_memory = None
+    if measure_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak_memory
+
+
+def print_report(content_type, size, reply_size, elapsed, timings, peak_memory):
+    print(f'{content_type}: {size} items, reply {reply_size / 2 ** 20:.1f} MiB, '
+          f'{elapsed:.3f} s, {size / elapsed:.0f} items/s, '
+          f'peak memory {peak_memory / 2 ** 20:.1f} MiB')
+    memstorage_size = sum(len(value) for value in FakeWindow.properties.values())
+    # Stage times are exclusive, e.g. "create list items" does not include
+    # setting art and info tags, so the stages and "other" add up to 100%
+    for stage, stage_time in timings.items():
+        print(f'  {stage:>20}: {stage_time * 1000:9.1f} ms {stage_time / elapsed:6.1%}')
+    other = elapsed - sum(timings.values())
+    print(f'  {"other":>20}: {other * 1000:9.1f} ms {other / elapsed:6.1%}')
+    print(f'  MemStorage: {memstorage_size / 2 ** 10:.1f} KiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog=BENCHMARK_ARGV[0],
+                                     description=__doc__.splitlines()[1])
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='library sizes')
+    parser.add_argument('-t', '--content-types', nargs='+', choices=CONTENT_TYPES,
+                        default=CONTENT_TYPES, help='content types to benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='benchmark repetitions')
+    parser.add_argument('-c', '--max-cast', type=int, default=0,
+                        help='maximum cast members per item, 0 - no limit')
+    args = parser.parse_args(BENCHMARK_ARGV[1:])
+    global SETTINGS  # pylint: disable=global-statement
+    SETTINGS = SETTINGS._replace(max_cast_members=args.max_cast)
+    replies = {}
+    timer = StageTimer()
+    install_fakes(timer, replies)
+    for content_type in args.content_types:
+        for size in args.sizes:
+            replies.clear()
+            replies[content_type] = make_reply(content_type, size)
+            best_elapsed = None
+            best_timings = None
+            for _ in range(args.repeat):
+                timer.timings.clear()
+                elapsed, _peak_memory = run(content_type, measure_memory=False)
+                if best_elapsed is None or elapsed < best_elapsed:
+                    best_elapsed = elapsed
+                    best_timings = dict(timer.timings)
+            # tracemalloc slows down the pipeline, so memory is measured in a separate run
+            _elapsed, peak_memory = run(content_type, measure_memory=True)
+            print_report(content_type, size, len(replies[content_type]), best_elapsed,
+                         best_timings, peak_memory)
+        print()
+
+
+if __name__ == '__main__':
+    main()
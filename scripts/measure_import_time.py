@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Measure import time of the addon modules
+
+Each module is imported in a fresh interpreter with "python -X importtime",
+and the self and cumulative import times of the addon modules and the most
+expensive third-party and standard library modules are reported.
+The report also shows whether networking modules have been imported,
+which must not happen when the plugin root menu is shown.
+Requires Kodistubs: pip install Kodistubs
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+ADDON_DIR = BASE_DIR / 'plugin.video.external.library'
+
+DEFAULT_MODULES = ['libs.actions', 'libs.content_type_handlers', 'commands', 'service']
+
+NETWORKING_MODULES = ['libs.json_rpc_api', 'libs.http_session', 'http.client']
+
+# Plugin modules read a handle from sys.argv, and entry point modules
+# run only under "if __name__ == '__main__'" or inside catch_exception().
+CHILD_CODE = """
+import sys
+sys.argv = ['plugin://plugin.video.external.library/', '1', '']
+import {module}
+print(','.join(name for name in {networking_modules!r} if name in sys.modules))
+"""
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def measure(module: str) -> Tuple[List[ImportTime], List[str]]:
+    """
+    Import a module in a fresh interpreter
+
+    :return: (import times of all imported modules, imported networking modules)
+    """
+    if module == 'service':
+        # The service runs until Kodi exits, so only its imports are measured
+        code = CHILD_CODE.replace('import {module}', _get_service_imports())
+    else:
+        code = CHILD_CODE
+    code = code.format(module=module, networking_modules=NETWORKING_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=str(ADDON_DIR), capture_output=True, text=True, check=False)
+    if result.returncode:
+        raise RuntimeError(f'Unable to import {module}:\n{result.stderr}')
+    import_times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        import_times.append(ImportTime(name.strip(), int(self_us), int(cumulative_us)))
+    networking = [name for name in result.stdout.strip().split(',') if name]
+    return import_times, networking
+
+
+def _get_service_imports() -> str:
+    lines = (ADDON_DIR / 'service.py').read_text(encoding='utf-8').splitlines()
+    return '\n'.join(line for line in lines if line.startswith(('import ', 'from ')))
+
+
+def print_report(module: str, import_times: List[ImportTime], networking: List[str],
+                 top: int) -> None:
+    total_ms = sum(item.self_us for item in import_times) / 1000
+    print(f'{module}: {total_ms:.1f} ms, {len(import_times)} modules')
+    print(f'  networking modules: {", ".join(networking) or "none"}')
+    addon_modules = [item for item in import_times
+                     if item.module.startswith('libs.') or item.module in DEFAULT_MODULES]
+    other_modules = sorted((item for item in import_times if item not in addon_modules),
+                           key=lambda item: item.self_us, reverse=True)[:top]
+    print(f'  {"self, ms":>10} {"cumul., ms":>10}  addon modules')
+    for item in sorted(addon_modules, key=lambda item: item.cumulative_us, reverse=True):
+        print(f'  {item.self_us / 1000:10.2f} {item.cumulative_us / 1000:10.2f}  {item.module}')
+    print(f'  {"self, ms":>10} {"cumul., ms":>10}  other modules (top {top})')
+    for item in other_modules:
+        print(f'  {item.self_us / 1000:10.2f} {item.cumulative_us / 1000:10.2f}  {item.module}')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES,
+                        help=f'modules to import (default: {" ".join(DEFAULT_MODULES)})')
+    parser.add_argument('-t', '--top', type=int, default=10,
+                        help='the number of most expensive other modules to show')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='imports of each module, the fastest one is reported')
+    args = parser.parse_args()
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        import_times, networking = min(
+            runs, key=lambda run: sum(item.self_us for item in run[0]))
+        print_report(module, import_times, networking, args.top)
+
+
+if __name__ == '__main__':
+    main()
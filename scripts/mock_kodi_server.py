@@ -0,0 +1,683 @@
+#!/usr/bin/env python3
+"""
+Mock remote Kodi with a synthetic video library
+
+Serves the JSON-RPC HTTP API methods that are used by the addon:
+VideoLibrary.Get* with "limits", "filter" and "sort", Set*Details and Scan,
+including batch requests. Library change notifications are sent to clients
+of the JSON-RPC TCP interface. Network latency, jitter, bandwidth limits
+and failures can be injected to test the addon under WAN conditions.
+
+Point "Kodi host", "Kodi port" and "Kodi TCP port" addon settings
+to this server, e.g.:
+
+    python3 scripts/mock_kodi_server.py --movies 5000 --tvshows 200 --latency 80 --jitter 20
+
+Only the Python standard library is required.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import random
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger('mock_kodi')
+
+KODI_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# JSON-RPC error codes returned by Kodi
+INVALID_PARAMS = -32602
+METHOD_NOT_FOUND = -32601
+INVALID_REQUEST = -32600
+PARSE_ERROR = -32700
+
+# Kodi returns this number of items for VideoLibrary.GetRecentlyAdded* by default
+RECENTLY_ADDED_ITEMS = 25
+
+GENRES = ['Drama', 'Comedy', 'Thriller', 'Action', 'Documentary', 'Animation', 'Crime']
+STUDIOS = ['BBC', 'HBO', 'Warner Bros.', 'Paramount', 'Netflix']
+LANGUAGES = ['eng', 'ger', 'fre', 'spa', 'rus']
+ACTORS_POOL_SIZE = 20000
+PLOT = ('A synthetic plot that is about as long as a typical plot in a scraped library. '
+        * 5).strip()
+
+
+class JsonRpcError(Exception):
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class SyntheticLibrary:
+    """
+    A video library with generated movies, TV shows, seasons, episodes and music videos
+
+    Items have all properties that the addon requests, and JSON-RPC replies
+    contain only the requested ones, like in Kodi.
+    """
+
+    def __init__(self, movies: int, tvshows: int, seasons: int, episodes: int,
+                 musicvideos: int, seed: int = 42):
+        self._rng = random.Random(seed)
+        self._start_date = datetime(2015, 1, 1)
+        self._date_index = 0
+        self.lock = threading.Lock()
+        self.items: Dict[str, List[Dict[str, Any]]] = {
+            'movie': [self._make_movie(index) for index in range(movies)],
+            'tvshow': [],
+            'season': [],
+            'episode': [],
+            'musicvideo': [self._make_musicvideo(index) for index in range(musicvideos)],
+        }
+        for tvshow_index in range(tvshows):
+            self._add_tvshow(tvshow_index, seasons, episodes)
+        self._by_id = {
+            mediatype: {item[f'{mediatype}id']: item for item in items}
+            for mediatype, items in self.items.items()
+        }
+
+    def _next_date(self) -> str:
+        # Items are added one after another, like during library scans
+        self._date_index += 1
+        return (self._start_date + timedelta(minutes=self._date_index)).strftime(
+            KODI_DATE_FORMAT)
+
+    def _make_art(self, path: str, *art_types: str) -> Dict[str, str]:
+        return {art_type: f'image://{path}/{art_type}.jpg/' for art_type in art_types}
+
+    def _make_cast(self) -> List[Dict[str, Any]]:
+        cast = []
+        actor_indexes = self._rng.sample(range(ACTORS_POOL_SIZE), self._rng.randint(5, 30))
+        for order, actor_index in enumerate(actor_indexes):
+            actor = {'name': f'Actor Name {actor_index}', 'role': f'Role {order}',
+                     'order': order}
+            if actor_index % 5:
+                actor['thumbnail'] = f'image://actors/{actor_index}.jpg/'
+            cast.append(actor)
+        return cast
+
+    def _make_streamdetails(self) -> Dict[str, Any]:
+        rng = self._rng
+        return {
+            'video': [{
+                'codec': rng.choice(['h264', 'hevc']),
+                'aspect': 1.78,
+                'width': 1920,
+                'height': 1080,
+                'duration': rng.randint(1200, 9000),
+                'stereomode': '',
+                'language': '',
+                'hdrtype': rng.choice(['', 'hdr10']),
+            }],
+            'audio': [{'codec': rng.choice(['ac3', 'dts', 'aac']),
+                       'channels': rng.choice([2, 6]),
+                       'language': language} for language in rng.sample(LANGUAGES, 2)],
+            'subtitle': [{'language': language} for language in rng.sample(LANGUAGES, 3)],
+        }
+
+    def _make_common(self, title: str, path: str) -> Dict[str, Any]:
+        rng = self._rng
+        return {
+            'label': title,
+            'title': title,
+            'originaltitle': title,
+            'sorttitle': '',
+            'plot': PLOT,
+            'rating': round(rng.uniform(1, 10), 1),
+            'votes': str(rng.randint(0, 100000)),
+            'playcount': 0,
+            'dateadded': self._next_date(),
+            'lastplayed': '',
+            'resume': {'position': 0.0, 'total': 0.0},
+            'cast': self._make_cast(),
+            'file': f'/storage/videos/{path}.mkv',
+            'genre': rng.sample(GENRES, 2),
+            'year': rng.randint(1950, 2023),
+            'director': [f'Director {rng.randint(0, 2000)}'],
+            'writer': [f'Writer {rng.randint(0, 2000)}'],
+            'studio': rng.sample(STUDIOS, 1),
+            'premiered': '2020-01-01',
+            'runtime': 2700,
+            'streamdetails': self._make_streamdetails(),
+        }
+
+    def _make_movie(self, index: int) -> Dict[str, Any]:
+        movie = self._make_common(f'Movie {index}', f'movies/movie-{index}')
+        movie.update({
+            'movieid': index + 1,
+            'trailer': '',
+            'tagline': 'A tagline',
+            'plotoutline': PLOT[:100],
+            'mpaa': 'Rated PG-13',
+            'country': ['United States'],
+            'top250': 0,
+            'art': self._make_art(f'movies/{index}', 'poster', 'fanart', 'clearlogo'),
+        })
+        return movie
+
+    def _make_musicvideo(self, index: int) -> Dict[str, Any]:
+        musicvideo = self._make_common(f'Song {index}', f'musicvideos/song-{index}')
+        musicvideo.update({
+            'musicvideoid': index + 1,
+            'album': f'Album {index // 10}',
+            'artist': [f'Artist {index // 100}'],
+            'track': index % 10 + 1,
+            'art': self._make_art(f'musicvideos/{index}', 'poster', 'fanart'),
+        })
+        return musicvideo
+
+    def _add_tvshow(self, index: int, seasons: int, episodes: int) -> None:
+        tvshowid = index + 1
+        title = f'Show {index}'
+        tvshow = self._make_common(title, f'tvshows/show-{index}')
+        tvshow.update({
+            'tvshowid': tvshowid,
+            'mpaa': 'TV-14',
+            'episode': seasons * episodes,
+            'season': seasons,
+            'watchedepisodes': 0,
+            'tag': [],
+            'art': self._make_art(f'tvshows/{index}', 'poster', 'fanart', 'banner'),
+            'userrating': 0,
+            'ratings': {'default': {'default': True, 'rating': 8.1, 'votes': 1000}},
+            'uniqueid': {'tvdb': str(100000 + index)},
+        })
+        self.items['tvshow'].append(tvshow)
+        for season_number in range(1, seasons + 1):
+            seasonid = len(self.items['season']) + 1
+            self.items['season'].append({
+                'seasonid': seasonid,
+                'label': f'Season {season_number}',
+                'title': f'Season {season_number}',
+                'season': season_number,
+                'showtitle': title,
+                'tvshowid': tvshowid,
+                'playcount': 0,
+                'episode': episodes,
+                'watchedepisodes': 0,
+                'art': self._make_art(f'tvshows/{index}/{season_number}', 'poster'),
+            })
+            for episode_number in range(1, episodes + 1):
+                episode = self._make_common(
+                    f'{season_number}x{episode_number:02}. Episode {episode_number}',
+                    f'tvshows/show-{index}/s{season_number}e{episode_number}'
+                )
+                episode.update({
+                    'episodeid': len(self.items['episode']) + 1,
+                    'firstaired': '2020-01-01',
+                    'productioncode': '',
+                    'season': season_number,
+                    'episode': episode_number,
+                    'showtitle': title,
+                    'tvshowid': tvshowid,
+                    'seasonid': seasonid,
+                    'uniqueid': {'tvdb': str(200000 + len(self.items['episode']))},
+                    'art': self._make_art(f'episodes/{tvshowid}/{season_number}/{episode_number}',
+                                          'thumb'),
+                    'specialsortseason': -1,
+                    'specialsortepisode': -1,
+                })
+                self.items['episode'].append(episode)
+
+    def get_item(self, mediatype: str, item_id: Any) -> Dict[str, Any]:
+        try:
+            return self._by_id[mediatype][item_id]
+        except (KeyError, TypeError) as exc:
+            raise JsonRpcError(INVALID_PARAMS, 'Invalid params.') from exc
+
+    def update_item(self, mediatype: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Update a playcount and a resume point of an item
+
+        :return: VideoLibrary.OnUpdate notification data
+        """
+        item = self.get_item(mediatype, params.get(f'{mediatype}id'))
+        data = {'item': {'id': item[f'{mediatype}id'], 'type': mediatype}}
+        with self.lock:
+            if 'playcount' in params:
+                if params['playcount'] > item['playcount']:
+                    item['lastplayed'] = datetime.now().strftime(KODI_DATE_FORMAT)
+                item['playcount'] = params['playcount']
+                data['playcount'] = params['playcount']
+            if 'resume' in params:
+                item['resume'] = dict(params['resume'])
+                item['lastplayed'] = datetime.now().strftime(KODI_DATE_FORMAT)
+            if 'lastplayed' in params:
+                item['lastplayed'] = params['lastplayed']
+        return data
+
+
+def _compare(operator: str, item_value: Any, value: Any) -> bool:
+    if isinstance(item_value, list):
+        return any(_compare(operator, element, value) for element in item_value)
+    item_value = str(item_value)
+    value = str(value)
+    comparisons: Dict[str, Callable[[], bool]] = {
+        'is': lambda: item_value.lower() == value.lower(),
+        'isnot': lambda: item_value.lower() != value.lower(),
+        'contains': lambda: value.lower() in item_value.lower(),
+        'doesnotcontain': lambda: value.lower() not in item_value.lower(),
+        'startswith': lambda: item_value.lower().startswith(value.lower()),
+        'endswith': lambda: item_value.lower().endswith(value.lower()),
+        # Kodi dates are sortable strings
+        'after': lambda: item_value > value,
+        'before': lambda: bool(item_value) and item_value < value,
+        'greaterthan': lambda: float(item_value or 0) > float(value),
+        'lessthan': lambda: float(item_value or 0) < float(value),
+    }
+    try:
+        return comparisons[operator]()
+    except KeyError as exc:
+        raise JsonRpcError(INVALID_PARAMS, f'Unsupported filter operator: {operator}') from exc
+
+
+# Filter fields that differ from item properties
+FILTER_FIELDS = {'numepisodes': 'episode'}
+
+
+def matches_filter(item: Dict[str, Any], item_filter: Dict[str, Any]) -> bool:
+    if 'and' in item_filter:
+        return all(matches_filter(item, rule) for rule in item_filter['and'])
+    if 'or' in item_filter:
+        return any(matches_filter(item, rule) for rule in item_filter['or'])
+    try:
+        field = FILTER_FIELDS.get(item_filter['field'], item_filter['field'])
+        return _compare(item_filter['operator'], item.get(field, ''), item_filter['value'])
+    except KeyError as exc:
+        raise JsonRpcError(INVALID_PARAMS, 'Invalid filter.') from exc
+
+
+SORT_KEYS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    'label': lambda item: item['label'].lower(),
+    'title': lambda item: item.get('title', item['label']).lower(),
+    'season': lambda item: item.get('season', 0),
+    'episode': lambda item: (item.get('season', 0), item.get('episode', 0)),
+    'dateadded': lambda item: item.get('dateadded', ''),
+    'year': lambda item: item.get('year', 0),
+    'playcount': lambda item: item.get('playcount', 0),
+    'lastplayed': lambda item: item.get('lastplayed', ''),
+}
+
+
+class MockKodi:
+    """Executes JSON-RPC methods against a synthetic library"""
+
+    def __init__(self, library: SyntheticLibrary, notifier: 'Notifier',
+                 scan_duration: float = 5.0):
+        self.library = library
+        self.notifier = notifier
+        self.scan_duration = scan_duration
+        self._methods: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            'JSONRPC.Ping': lambda params: 'pong',
+            'VideoLibrary.GetMovies': self._get_list('movie', 'movies'),
+            'VideoLibrary.GetTVShows': self._get_list('tvshow', 'tvshows'),
+            'VideoLibrary.GetSeasons': self._get_list('season', 'seasons'),
+            'VideoLibrary.GetEpisodes': self._get_list('episode', 'episodes'),
+            'VideoLibrary.GetMusicVideos': self._get_list('musicvideo', 'musicvideos'),
+            'VideoLibrary.GetRecentlyAddedMovies':
+                self._get_list('movie', 'movies', recently_added=True),
+            'VideoLibrary.GetRecentlyAddedEpisodes':
+                self._get_list('episode', 'episodes', recently_added=True),
+            'VideoLibrary.GetRecentlyAddedMusicVideos':
+                self._get_list('musicvideo', 'musicvideos', recently_added=True),
+            'VideoLibrary.GetMovieDetails': self._get_details('movie'),
+            'VideoLibrary.GetEpisodeDetails': self._get_details('episode'),
+            'VideoLibrary.GetMusicVideoDetails': self._get_details('musicvideo'),
+            'VideoLibrary.SetMovieDetails': self._set_details('movie'),
+            'VideoLibrary.SetEpisodeDetails': self._set_details('episode'),
+            'VideoLibrary.SetMusicVideoDetails': self._set_details('musicvideo'),
+            'VideoLibrary.Scan': self._scan,
+        }
+
+    @staticmethod
+    def _select_properties(item: Dict[str, Any], mediatype: str,
+                           properties: List[str]) -> Dict[str, Any]:
+        # Kodi always returns an item ID and a label
+        selected = {f'{mediatype}id': item[f'{mediatype}id'], 'label': item['label']}
+        for media_property in properties:
+            if media_property in item:
+                selected[media_property] = item[media_property]
+        return selected
+
+    def _get_list(self, mediatype: str, content: str, recently_added: bool = False):
+        def get_list(params: Dict[str, Any]) -> Dict[str, Any]:
+            items = self.library.items[mediatype]
+            if (tvshowid := params.get('tvshowid')) is not None:
+                items = [item for item in items if item.get('tvshowid') == tvshowid]
+            if (season := params.get('season')) is not None:
+                items = [item for item in items if item.get('season') == season]
+            if (item_filter := params.get('filter')) is not None:
+                items = [item for item in items if matches_filter(item, item_filter)]
+            sort = params.get('sort') or {}
+            if recently_added:
+                sort = {'method': 'dateadded', 'order': 'descending'}
+            if (sort_key := SORT_KEYS.get(sort.get('method', 'none'))) is not None:
+                items = sorted(items, key=sort_key,
+                               reverse=sort.get('order') == 'descending')
+            if recently_added:
+                items = items[:RECENTLY_ADDED_ITEMS]
+            total = len(items)
+            limits = params.get('limits') or {}
+            start = limits.get('start', 0)
+            end = limits.get('end', -1)
+            if end < 0:
+                end = total
+            items = items[start:end]
+            properties = params.get('properties', [])
+            result = {'limits': {'start': start, 'end': start + len(items), 'total': total}}
+            if items:
+                result[content] = [self._select_properties(item, mediatype, properties)
+                                   for item in items]
+            return result
+
+        return get_list
+
+    def _get_details(self, mediatype: str):
+        def get_details(params: Dict[str, Any]) -> Dict[str, Any]:
+            item = self.library.get_item(mediatype, params.get(f'{mediatype}id'))
+            return {f'{mediatype}details': self._select_properties(
+                item, mediatype, params.get('properties', []))}
+
+        return get_details
+
+    def _set_details(self, mediatype: str):
+        def set_details(params: Dict[str, Any]) -> str:
+            data = self.library.update_item(mediatype, params)
+            self.notifier.notify('VideoLibrary.OnUpdate', data)
+            return 'OK'
+
+        return set_details
+
+    def _scan(self, params: Dict[str, Any]) -> str:
+        self.notifier.notify('VideoLibrary.OnScanStarted')
+        timer = threading.Timer(self.scan_duration, self.notifier.notify,
+                                ('VideoLibrary.OnScanFinished',))
+        timer.daemon = True
+        timer.start()
+        return 'OK'
+
+    def execute(self, request: Any) -> Optional[Dict[str, Any]]:
+        """
+        Execute a JSON-RPC request
+
+        :return: a JSON-RPC reply or ``None`` for notifications without an ID
+        """
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or 'method' not in request:
+                raise JsonRpcError(INVALID_REQUEST, 'Invalid request.')
+            method = self._methods.get(request['method'])
+            if method is None:
+                raise JsonRpcError(METHOD_NOT_FOUND, 'Method not found.')
+            params = request.get('params') or {}
+            if not isinstance(params, dict):
+                raise JsonRpcError(INVALID_PARAMS, 'Invalid params.')
+            result = method(params)
+        except JsonRpcError as exc:
+            reply = {'id': request_id, 'jsonrpc': '2.0',
+                     'error': {'code': exc.code, 'message': exc.message}}
+        else:
+            reply = {'id': request_id, 'jsonrpc': '2.0', 'result': result}
+        if isinstance(request, dict) and 'id' not in request:
+            return None
+        return reply
+
+    def handle_payload(self, payload: bytes) -> Optional[bytes]:
+        """Execute a JSON-RPC request or a batch of requests"""
+        try:
+            request = json.loads(payload)
+        except ValueError:
+            reply = {'id': None, 'jsonrpc': '2.0',
+                     'error': {'code': PARSE_ERROR, 'message': 'Parse error.'}}
+        else:
+            if isinstance(request, list):
+                replies = [reply for reply in map(self.execute, request) if reply is not None]
+                reply = replies or None
+                if not request:
+                    reply = {'id': None, 'jsonrpc': '2.0',
+                             'error': {'code': INVALID_REQUEST, 'message': 'Invalid request.'}}
+            else:
+                reply = self.execute(request)
+        if reply is None:
+            return None
+        return json.dumps(reply).encode('utf-8')
+
+
+class NetworkConditions:
+    """Injects latency, jitter, bandwidth limits and failures"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, bandwidth: int = 0,
+                 failure_rate: float = 0.0, http_error_rate: float = 0.0, seed: int = 0):
+        """
+        :param latency: delay before a reply in seconds
+        :param jitter: maximum random deviation of the latency in seconds
+        :param bandwidth: bytes per second, 0 - unlimited
+        :param failure_rate: the fraction of requests for which the connection
+            is closed without a reply
+        :param http_error_rate: the fraction of requests that fail with HTTP 503
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.http_error_rate = http_error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def delay(self) -> None:
+        jitter = (self._random() * 2 - 1) * self.jitter
+        time.sleep(max(0.0, self.latency + jitter))
+
+    def should_fail(self) -> bool:
+        return self._random() < self.failure_rate
+
+    def should_return_error(self) -> bool:
+        return self._random() < self.http_error_rate
+
+    def send(self, wfile, data: bytes) -> None:
+        if not self.bandwidth:
+            wfile.write(data)
+            return
+        # Write in chunks of about 1/10 s to emulate a slow link
+        chunk_size = max(1024, self.bandwidth // 10)
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            wfile.write(chunk)
+            wfile.flush()
+            time.sleep(len(chunk) / self.bandwidth)
+
+
+class JsonRpcHttpHandler(BaseHTTPRequestHandler):
+    """Serves JSON-RPC requests over HTTP with keep-alive connections"""
+    protocol_version = 'HTTP/1.1'
+    server: 'MockKodiHttpServer'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+    def _is_authorized(self) -> bool:
+        if self.server.credentials is None:
+            return True
+        expected = 'Basic ' + base64.b64encode(
+            ':'.join(self.server.credentials).encode('utf-8')).decode('ascii')
+        return self.headers.get('Authorization') == expected
+
+    def _send_reply(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.server.conditions.send(self.wfile, body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers.get('Content-Length', 0))
+        payload = self.rfile.read(length)
+        conditions = self.server.conditions
+        conditions.delay()
+        if conditions.should_fail():
+            logger.info('Injected failure: closing the connection')
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        if conditions.should_return_error():
+            logger.info('Injected failure: HTTP 503')
+            self._send_reply(503, b'{"error": "Service Unavailable"}')
+            return
+        if self.path.rstrip('/') != '/jsonrpc':
+            self._send_reply(404, b'{"error": "Not Found"}')
+            return
+        if not self._is_authorized():
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="XBMC"')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start = time.perf_counter()
+        body = self.server.kodi.handle_payload(payload)
+        logger.debug('Processed %s bytes request in %.1f ms', length,
+                     (time.perf_counter() - start) * 1000)
+        if body is None:
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send_reply(200, body)
+
+
+class MockKodiHttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, kodi: MockKodi, conditions: NetworkConditions,
+                 credentials: Optional[tuple] = None):
+        super().__init__(address, JsonRpcHttpHandler)
+        self.kodi = kodi
+        self.conditions = conditions
+        self.credentials = credentials
+
+
+class NotificationHandler(socketserver.BaseRequestHandler):
+    """Keeps a JSON-RPC TCP connection open to receive notifications"""
+    server: 'Notifier'
+
+    def handle(self):
+        self.server.add_client(self.request)
+        try:
+            # Requests over TCP are not supported, incoming data is ignored
+            while self.request.recv(4096):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.server.remove_client(self.request)
+
+
+class Notifier(socketserver.ThreadingTCPServer):
+    """Sends notifications to all clients of the JSON-RPC TCP interface"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, NotificationHandler)
+        self._clients: Set[socket.socket] = set()
+        self._lock = threading.Lock()
+
+    def add_client(self, sock: socket.socket) -> None:
+        logger.info('Notification client connected: %s', sock.getpeername())
+        with self._lock:
+            self._clients.add(sock)
+
+    def remove_client(self, sock: socket.socket) -> None:
+        with self._lock:
+            self._clients.discard(sock)
+
+    def notify(self, method: str, data: Optional[Dict[str, Any]] = None) -> None:
+        message = json.dumps({
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': {'data': data, 'sender': 'xbmc'},
+        }).encode('utf-8')
+        logger.info('Notification: %s %s', method, data)
+        with self._lock:
+            clients = list(self._clients)
+        for sock in clients:
+            try:
+                sock.sendall(message)
+            except OSError:
+                self.remove_client(sock)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='JSON-RPC HTTP port')
+    parser.add_argument('--tcp-port', type=int, default=9090,
+                        help='JSON-RPC TCP port for notifications')
+    parser.add_argument('--login', help='HTTP basic authentication login')
+    parser.add_argument('--password', default='', help='HTTP basic authentication password')
+    library_group = parser.add_argument_group('synthetic library')
+    library_group.add_argument('--movies', type=int, default=1000)
+    library_group.add_argument('--tvshows', type=int, default=50)
+    library_group.add_argument('--seasons', type=int, default=3, help='seasons per TV show')
+    library_group.add_argument('--episodes', type=int, default=20, help='episodes per season')
+    library_group.add_argument('--musicvideos', type=int, default=100)
+    library_group.add_argument('--seed', type=int, default=42, help='random seed')
+    network_group = parser.add_argument_group('network conditions')
+    network_group.add_argument('--latency', type=float, default=0.0,
+                               help='reply delay in milliseconds')
+    network_group.add_argument('--jitter', type=float, default=0.0,
+                               help='maximum random deviation of the delay in milliseconds')
+    network_group.add_argument('--bandwidth', type=int, default=0,
+                               help='reply bandwidth in KiB/s, 0 - unlimited')
+    network_group.add_argument('--failure-rate', type=float, default=0.0,
+                               help='fraction of requests that drop the connection')
+    network_group.add_argument('--http-error-rate', type=float, default=0.0,
+                               help='fraction of requests that fail with HTTP 503')
+    parser.add_argument('--scan-duration', type=float, default=5.0,
+                        help='seconds between scan started and finished notifications')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    start = time.perf_counter()
+    library = SyntheticLibrary(args.movies, args.tvshows, args.seasons, args.episodes,
+                               args.musicvideos, args.seed)
+    logger.info('Generated a library in %.1f s: %s', time.perf_counter() - start,
+                ', '.join(f'{len(items)} {mediatype}s'
+                          for mediatype, items in library.items.items()))
+    notifier = Notifier((args.host, args.tcp_port))
+    conditions = NetworkConditions(args.latency / 1000, args.jitter / 1000,
+                                   args.bandwidth * 1024, args.failure_rate,
+                                   args.http_error_rate, args.seed)
+    credentials = (args.login, args.password) if args.login else None
+    http_server = MockKodiHttpServer((args.host, args.port),
+                                     MockKodi(library, notifier, args.scan_duration),
+                                     conditions, credentials)
+    threading.Thread(target=notifier.serve_forever, name='Notifier', daemon=True).start()
+    logger.info('Serving JSON-RPC at http://%s:%s/jsonrpc, notifications at tcp://%s:%s',
+                args.host, args.port, args.host, args.tcp_port)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        notifier.shutdown()
+        notifier.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Tests for coalescing of concurrent listing requests"""
+
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'plugin.video.external.library'))
+
+from libs.single_flight import SingleFlight  # pylint: disable=wrong-import-position
+
+
+class SlowSource:
+    """Counts started requests and delays the first item like a first page download"""
+
+    def __init__(self, item_count=5, first_item_delay=0.0):
+        self.item_count = item_count
+        self.first_item_delay = first_item_delay
+        self.calls = 0
+        self.closed = 0
+
+    def __call__(self):
+        self.calls += 1
+        request_number = self.calls
+        try:
+            for index in range(self.item_count):
+                if not index:
+                    time.sleep(self.first_item_delay)
+                yield request_number, index
+        finally:
+            self.closed += 1
+
+
+def consume_concurrently(flight, key, source, consumer_count):
+    results = [None] * consumer_count
+
+    def consume(consumer_index):
+        media_items, _ = flight.join(key, source)
+        results[consumer_index] = list(media_items)
+
+    threads = [threading.Thread(target=consume, args=(index,)) for index in range(consumer_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_concurrent_joins_share_one_request(self):
+        flight = SingleFlight('test')
+        source = SlowSource(first_item_delay=0.5)
+        results = consume_concurrently(flight, 'key', source, 3)
+        self.assertEqual(source.calls, 1)
+        self.assertEqual(flight.suppressed, 2)
+        for result in results:
+            self.assertEqual(result, [(1, index) for index in range(5)])
+
+    def test_other_keys_are_not_blocked_by_a_retrieval(self):
+        flight = SingleFlight('test')
+        slow_source = SlowSource(first_item_delay=1.0)
+        slow_thread = threading.Thread(target=consume_concurrently,
+                                       args=(flight, 'slow', slow_source, 2))
+        slow_thread.start()
+        time.sleep(0.1)
+        started_at = time.monotonic()
+        media_items, _ = flight.join('fast', SlowSource())
+        self.assertEqual(len(list(media_items)), 5)
+        self.assertLess(time.monotonic() - started_at, 0.5)
+        slow_thread.join()
+
+    def test_late_consumer_receives_all_items(self):
+        flight = SingleFlight('test')
+        source = SlowSource()
+        first_items, _ = flight.join('key', source)
+        self.assertEqual([next(first_items) for _ in range(3)], [(1, 0), (1, 1), (1, 2)])
+        second_items, _ = flight.join('key', source)
+        self.assertEqual(list(second_items), [(1, index) for index in range(5)])
+        self.assertEqual(list(first_items), [(1, 3), (1, 4)])
+        self.assertEqual(source.calls, 1)
+
+    def test_closed_request_is_not_joined(self):
+        flight = SingleFlight('test')
+        source = SlowSource()
+        media_items, _ = flight.join('key', source)
+        next(media_items)
+        media_items.close()
+        self.assertEqual(source.closed, 1)
+        media_items, _ = flight.join('key', source)
+        self.assertEqual(list(media_items), [(2, index) for index in range(5)])
+
+    def test_finished_request_is_not_joined(self):
+        flight = SingleFlight('test')
+        source = SlowSource()
+        self.assertEqual(len(list(flight.join('key', source)[0])), 5)
+        self.assertEqual(len(list(flight.join('key', source)[0])), 5)
+        self.assertEqual(source.calls, 2)
+
+    def test_errors_are_shared(self):
+        def failing_source():
+            yield 1
+            raise ConnectionError('Connection lost')
+
+        flight = SingleFlight('test')
+        first_items, _ = flight.join('key', failing_source)
+        second_items, _ = flight.join('key', failing_source)
+        for media_items in (first_items, second_items):
+            self.assertEqual(next(media_items), 1)
+            with self.assertRaises(ConnectionError):
+                next(media_items)
+        self.assertEqual(flight.started, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()